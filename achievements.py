@@ -0,0 +1,126 @@
+import threading
+from collections import deque
+from typing import List
+
+from cache import TTLCache
+from database import Database
+from gamification import Gamification
+import events
+
+db = Database()
+
+# speed_demon: SPEED_ANSWERS правильных ответов за SPEED_WINDOW секунд
+SPEED_ANSWERS = 20
+SPEED_WINDOW = 300
+
+MASTERED_LEVEL = 4
+MASTERED_THRESHOLDS = (('first_steps', 1), ('ten_cards', 10), ('hundred_cards', 100))
+STREAK_THRESHOLDS = (('week_streak', 7), ('month_streak', 30))
+COLLECTOR_DECKS = 5
+
+
+class _UserState:
+    __slots__ = ('mask', 'recent', 'unseen')
+
+    def __init__(self, mask: int):
+        self.mask = mask
+        self.recent = deque(maxlen=SPEED_ANSWERS)  # время последних правильных ответов
+        self.unseen: List[str] = []
+
+
+class AchievementEngine:
+    """Выдаёт достижения по событиям обучения, колод и серий.
+
+    На каждое событие проверяются только связанные с ним правила, и только
+    для ещё не полученных достижений. Счётчики карточек и колод читаются из
+    user_stats лишь тогда, когда событие может изменить результат.
+    Подписчики работают в транзакции издателя: достижение и очки за него
+    фиксируются вместе с ответом, который их принёс.
+    """
+
+    def __init__(self, database: Database):
+        self.db = database
+        self._states = TTLCache.shared(f'{database.db_name}:achievements', maxsize=10000, ttl=600)
+        self._lock = threading.Lock()
+        events.subscribe('card_progress', self.on_card_progress)
+        events.subscribe('streak', self.on_streak)
+        events.subscribe('deck_created', self.on_deck_created)
+        events.subscribe('session_finished', self.on_session_finished)
+
+    def _state(self, user_id: int) -> _UserState:
+        with self._lock:
+            state = self._states.get(user_id)
+            if state is None:
+                row = Gamification._get_row(user_id)
+                state = _UserState(row.get('achievements_mask', 0) if row else 0)
+                self._states.set(user_id, state)
+            return state
+
+    @staticmethod
+    def _has(state: _UserState, key: str) -> bool:
+        return bool(state.mask >> Gamification.ACHIEVEMENT_BITS[key] & 1)
+
+    def _stat(self, user_id: int, column: str) -> int:
+        with self.db.connection(user_id=user_id) as conn:
+            row = conn.execute(f'SELECT {column} FROM user_stats WHERE user_id = ?', (user_id,)).fetchone()
+        return row[0] if row else 0
+
+    def _unlock(self, user_id: int, state: _UserState, keys: List[str]):
+        if not keys:
+            return
+        if Gamification.unlock_achievements(user_id, keys) is None:
+            # Строки user_gamification нет — в базе ничего не записано, запоминать нечего
+            return
+
+        def remember():
+            with self._lock:
+                for key in keys:
+                    if not self._has(state, key):
+                        state.mask |= 1 << Gamification.ACHIEVEMENT_BITS[key]
+                        state.unseen.append(key)
+        self.db.after_commit(remember)
+
+    # ===== ПРАВИЛА =====
+
+    def on_card_progress(self, user_id, old_level, new_level, result, ts):
+        state = self._state(user_id)
+        unlocked = []
+        if result == 'correct' and not self._has(state, 'speed_demon'):
+            state.recent.append(ts)
+            if len(state.recent) == SPEED_ANSWERS and ts - state.recent[0] <= SPEED_WINDOW:
+                unlocked.append('speed_demon')
+        if old_level < MASTERED_LEVEL <= new_level:
+            pending = [(key, n) for key, n in MASTERED_THRESHOLDS if not self._has(state, key)]
+            if pending:
+                mastered = self._stat(user_id, 'mastered_cards')
+                unlocked += [key for key, n in pending if mastered >= n]
+        self._unlock(user_id, state, unlocked)
+
+    def on_streak(self, user_id, streak):
+        state = self._state(user_id)
+        self._unlock(user_id, state, [key for key, n in STREAK_THRESHOLDS
+                                      if streak >= n and not self._has(state, key)])
+
+    def on_deck_created(self, user_id):
+        state = self._state(user_id)
+        if not self._has(state, 'collector') and self._stat(user_id, 'decks_count') >= COLLECTOR_DECKS:
+            self._unlock(user_id, state, ['collector'])
+
+    def on_session_finished(self, user_id, mode, correct, total):
+        state = self._state(user_id)
+        if mode == 'quiz' and total >= 3 and correct == total and not self._has(state, 'perfect_quiz'):
+            self._unlock(user_id, state, ['perfect_quiz'])
+
+    # ===== ПОКАЗ =====
+
+    def pop_unseen(self, user_id: int) -> List[str]:
+        """Достижения, полученные с прошлого вызова"""
+        with self._lock:
+            state = self._states.get(user_id)
+            if state is None or not state.unseen:
+                return []
+            unseen, state.unseen = state.unseen, []
+            return unseen
+
+
+achievements = AchievementEngine(db)
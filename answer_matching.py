@@ -0,0 +1,179 @@
+import unicodedata
+from collections import namedtuple
+from functools import lru_cache
+from typing import Dict, Tuple
+import config
+
+CORRECT_THRESHOLD = 0.85  # засчитываем ответ
+CLOSE_THRESHOLD = 0.5     # «почти», без штрафа
+
+ARTICLES = {'a', 'an', 'the'}
+VARIANT_SEPARATOR = ';'
+
+MatchResult = namedtuple('MatchResult', 'grade similarity variant')
+
+
+class _PunctuationToSpace(dict):
+    """Таблица для str.translate: знак препинания -> пробел.
+
+    Категория символа определяется при первой встрече, дальше замена идёт
+    внутри translate без цикла на Python.
+    """
+
+    def __missing__(self, code: int) -> int:
+        value = self[code] = 32 if unicodedata.category(chr(code)).startswith('P') else code
+        return value
+
+
+_PUNCTUATION = _PunctuationToSpace()
+
+
+def normalize(text: str) -> str:
+    """Привести ответ к сравнимому виду: регистр, ё/е, пунктуация, артикли"""
+    folded = unicodedata.normalize('NFKC', text).casefold().replace('ё', 'е')
+    cleaned = folded.translate(_PUNCTUATION)
+    words = cleaned.split()
+    while len(words) > 1 and words[0] in ARTICLES:
+        words.pop(0)
+    # Ответ из одних знаков препинания сравниваем как есть
+    return ' '.join(words) or folded.strip()
+
+
+@lru_cache(maxsize=8192)
+def compile_answer(answer: str) -> Tuple[str, ...]:
+    """Нормализованные варианты ответа карточки («a; b» — два варианта)"""
+    variants = [normalize(part) for part in answer.split(VARIANT_SEPARATOR) if part.strip()]
+    return tuple(dict.fromkeys(variants)) or (normalize(answer),)
+
+
+def _common_prefix(a: str, b: str) -> int:
+    """Длина общего начала: двоичный поиск сравнениями срезов, без цикла по символам"""
+    lo, hi = 0, min(len(a), len(b))
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[:mid] == b[:mid]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+
+def _common_suffix(a: str, b: str) -> int:
+    lo, hi = 0, min(len(a), len(b))
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[len(a) - mid:] == b[len(b) - mid:]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+
+def bounded_levenshtein(a: str, b: str, limit: int) -> int:
+    """Расстояние Левенштейна, но не больше limit + 1.
+
+    Бит-параллельный алгоритм Майерса/Хиррё: столбец таблицы — одно целое
+    число, строка длины n обрабатывается за n шагов. Общие начало и конец
+    строк на расстояние не влияют и отбрасываются до расчёта; расчёт
+    прекращается, как только оставшиеся символы уже не могут вернуть
+    расстояние в limit.
+    """
+    big = limit + 1
+    if abs(len(a) - len(b)) > limit:
+        return big
+    prefix = _common_prefix(a, b)
+    a, b = a[prefix:], b[prefix:]
+    suffix = _common_suffix(a, b)
+    if suffix:
+        a, b = a[:len(a) - suffix], b[:len(b) - suffix]
+    if len(a) > len(b):
+        a, b = b, a
+    m, n = len(a), len(b)
+    if m == 0:
+        return min(n, big)
+    peq: Dict[str, int] = {}
+    for i, char in enumerate(a):
+        peq[char] = peq.get(char, 0) | (1 << i)
+    mask = (1 << m) - 1
+    last = 1 << (m - 1)
+    pv, mv, score = mask, 0, m
+    # Каждый следующий символ уменьшает расстояние не больше чем на 1:
+    # после j-го символа дальше считать незачем, если score + j > limit + n
+    cutoff = limit + n
+    for j, char in enumerate(b, 1):
+        eq = peq.get(char, 0)
+        xv = eq | mv
+        xh = ((((eq & pv) + pv) & mask) ^ pv) | eq
+        ph = (mv | ~(xh | pv)) & mask
+        mh = pv & xh
+        if ph & last:
+            score += 1
+        elif mh & last:
+            score -= 1
+        if score + j > cutoff:
+            return big
+        ph = ((ph << 1) | 1) & mask
+        mh = (mh << 1) & mask
+        pv = (mh | ~(xv | ph)) & mask
+        mv = ph & xv
+    return min(score, big)
+
+
+class AnswerMatcher:
+    """Сравнение по точному совпадению нормализованных вариантов"""
+
+    name = 'exact'
+
+    def similarity(self, given: str, expected: str, floor: float) -> float:
+        """Схожесть 0-1; всё, что ниже floor, можно вернуть как 0"""
+        return 1.0 if given == expected else 0.0
+
+    def match(self, user_answer: str, answer: str) -> MatchResult:
+        given = normalize(user_answer)
+        best, best_variant = 0.0, None
+        for variant in compile_answer(answer):
+            score = self.similarity(given, variant, max(best, CLOSE_THRESHOLD))
+            if score > best:
+                best, best_variant = score, variant
+            if best >= CORRECT_THRESHOLD:
+                break
+        if best >= CORRECT_THRESHOLD:
+            grade = 'correct'
+        elif best >= CLOSE_THRESHOLD:
+            grade = 'close'
+        else:
+            grade = 'wrong'
+        return MatchResult(grade, best, best_variant)
+
+
+class LevenshteinMatcher(AnswerMatcher):
+    """1 - расстояние Левенштейна / длина; дальше порога floor не считает"""
+
+    name = 'levenshtein'
+
+    def similarity(self, given: str, expected: str, floor: float) -> float:
+        if given == expected:
+            return 1.0
+        length = max(len(given), len(expected))
+        limit = int((1 - floor) * length)
+        distance = bounded_levenshtein(given, expected, limit)
+        if distance > limit:
+            return 0.0
+        return 1 - distance / length
+
+
+MATCHERS: Dict[str, AnswerMatcher] = {}
+
+
+def register_matcher(matcher: AnswerMatcher) -> AnswerMatcher:
+    MATCHERS[matcher.name] = matcher
+    return matcher
+
+
+register_matcher(AnswerMatcher())
+register_matcher(LevenshteinMatcher())
+
+
+def get_matcher(name: str = None) -> AnswerMatcher:
+    """Матчер по имени; по умолчанию — config.ANSWER_MATCHER"""
+    return MATCHERS[name or config.ANSWER_MATCHER]
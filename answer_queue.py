@@ -0,0 +1,212 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import defaultdict, namedtuple
+from datetime import date, datetime
+from spaced_repetition import SpacedRepetition
+from gamification import Gamification
+
+logger = logging.getLogger(__name__)
+
+# deck_id добавлен позже: в старых строках журнала его нет
+AnswerEvent = namedtuple('AnswerEvent', 'seq user_id card_id result action streak ts deck_id', defaults=(None,))
+
+
+class AnswerQueue:
+    """Отложенная запись ответов (write-behind).
+
+    Обработчик кладёт компактное событие в очередь и сразу получает очки и
+    серию, посчитанные в памяти. Фоновый сброс применяет накопленные события
+    одной транзакцией на шард — по размеру пачки, по таймеру и в конце сессии.
+    Каждое событие до применения дописывается в журнал, поэтому после
+    падения процесса оно будет применено при следующем запуске; номер
+    последнего применённого события хранится в answer_queue_state.
+    """
+
+    def __init__(self, adb, journal_path=None, max_batch=50, flush_interval=2.0):
+        self.adb = adb
+        self.db = adb.db
+        if journal_path is None:
+            journal_path = os.path.splitext(self.db.db_name)[0] + '.answers.journal'
+        self.journal_path = journal_path
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self._pending = []
+        self._journal = None
+        self._seq = 0
+        self._streaks = {}  # user_id -> (дата, серия) по уже принятым событиям
+        self._flush_lock = asyncio.Lock()
+        self._flush_task = None
+        self._timer = None
+
+    # ===== ЖУРНАЛ =====
+
+    def _open_journal(self):
+        self._journal = open(self.journal_path, 'a', encoding='utf-8')
+
+    def _append_journal(self, event: AnswerEvent):
+        self._journal.write(json.dumps(event, separators=(',', ':')) + '\n')
+        self._journal.flush()
+
+    def _rewrite_journal(self):
+        """Оставить в журнале только ещё не применённые события"""
+        self._journal.close()
+        tmp_path = self.journal_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as tmp:
+            for event in self._pending:
+                tmp.write(json.dumps(event, separators=(',', ':')) + '\n')
+        os.replace(tmp_path, self.journal_path)
+        self._open_journal()
+
+    def _read_journal(self):
+        events = []
+        if not os.path.exists(self.journal_path):
+            return events
+        with open(self.journal_path, encoding='utf-8') as journal:
+            for line in journal:
+                try:
+                    events.append(AnswerEvent(*json.loads(line)))
+                except (ValueError, TypeError):
+                    # Оборванная последняя строка после падения
+                    logger.warning("Пропущена повреждённая запись журнала ответов")
+        return events
+
+    # ===== ЖИЗНЕННЫЙ ЦИКЛ =====
+
+    async def start(self):
+        """Применить события из журнала и запустить сброс по таймеру"""
+        events = self._read_journal()
+        applied = await self.adb.run_read(self._last_applied_seqs)
+        self._seq = max(applied + [e.seq for e in events])
+        self._pending = [
+            e for e in events if e.seq > applied[self.db.shard_for_user(e.user_id)]
+        ]
+        self._open_journal()
+        if self._pending:
+            logger.info(f"Восстановлено {len(self._pending)} событий из журнала ответов")
+        await self.flush()
+        self._timer = asyncio.create_task(self._flush_periodically())
+
+    async def stop(self):
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        await self.flush()
+        if self._journal:
+            self._journal.close()
+            self._journal = None
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Не удалось сбросить очередь ответов")
+
+    # ===== СОБЫТИЯ =====
+
+    async def submit(self, user_id, card_id, result, action=None, streak=False, deck_id=None):
+        """Принять ответ; вернуть (очки, серия) без ожидания записи в базу"""
+        if self._journal is None:
+            self._open_journal()
+        self._seq += 1
+        event = AnswerEvent(self._seq, user_id, card_id, result, action, streak, time.time(), deck_id)
+        self._append_journal(event)
+        self._pending.append(event)
+
+        points = Gamification.POINTS.get(action, 5) if action else 0
+        current_streak = await self._streak_after(user_id, date.fromtimestamp(event.ts)) if streak else 0
+
+        if len(self._pending) >= self.max_batch and not self._flush_task:
+            self._flush_task = asyncio.create_task(self.flush())
+        return points, current_streak
+
+    async def _streak_after(self, user_id, today):
+        state = self._streaks.get(user_id)
+        if state is None:
+            # Событий этого пользователя в очереди ещё нет: база актуальна
+            last_date, streak = await self.adb.run_read(Gamification.get_streak_state, user_id)
+        else:
+            last_date, streak = state
+            if last_date == str(today):
+                return streak
+        streak = Gamification.next_streak(last_date, streak, today)
+        self._streaks[user_id] = (str(today), streak)
+        return streak
+
+    async def flush(self):
+        """Применить все накопленные события"""
+        async with self._flush_lock:
+            self._flush_task = None
+            if not self._pending:
+                return 0
+            events = self._pending
+            self._pending = []
+            by_shard = defaultdict(list)
+            for event in events:
+                by_shard[self.db.shard_for_user(event.user_id)].append(event)
+            # Шарды пишутся параллельно, каждый в своём потоке-писателе
+            results = await asyncio.gather(*(
+                self.adb.run_shard_write(shard, self._apply, shard_events)
+                for shard, shard_events in by_shard.items()
+            ), return_exceptions=True)
+            errors = [result for result in results if isinstance(result, BaseException)]
+            if errors:
+                # Уже применённые шарды пропустят свои события по last_seq
+                self._pending = events + self._pending
+                raise errors[0]
+            if self._journal is not None:
+                self._rewrite_journal()
+            # Серии в памяти больше не опережают базу
+            pending_users = {e.user_id for e in self._pending}
+            for user_id in list(self._streaks):
+                if user_id not in pending_users:
+                    del self._streaks[user_id]
+            return len(events)
+
+    @staticmethod
+    def _last_applied_seq(conn):
+        row = conn.execute('SELECT last_seq FROM answer_queue_state WHERE id = 1').fetchone()
+        return row['last_seq'] if row else 0
+
+    def _last_applied_seqs(self):
+        """Номер последнего применённого события в каждом шарде"""
+        seqs = []
+        for pool in self.db.pools:
+            with pool.connection() as conn:
+                seqs.append(self._last_applied_seq(conn))
+        return seqs
+
+    def _card_exists(self, card_id) -> bool:
+        with self.db.connection(row_id=card_id) as conn:
+            return conn.execute('SELECT 1 FROM cards WHERE card_id = ?', (card_id,)).fetchone() is not None
+
+    def _apply(self, events):
+        # Транзакции не пересекают шарды: каждый шард фиксирует свою пачку
+        # и свой last_seq
+        by_shard = defaultdict(list)
+        for event in events:
+            by_shard[self.db.shard_for_user(event.user_id)].append(event)
+        for shard, shard_events in by_shard.items():
+            with self.db.pools[shard].transaction() as conn:
+                last_seq = self._last_applied_seq(conn)
+                for event in shard_events:
+                    if event.seq <= last_seq:
+                        continue
+                    if not self._card_exists(event.card_id):
+                        # Карточку удалили после записи в журнал — прогресс не к чему привязать
+                        logger.info(f"Пропущен ответ на удалённую карточку {event.card_id}")
+                        continue
+                    SpacedRepetition.update_card_progress(event.user_id, event.card_id, event.result, event.ts)
+                    day = datetime.fromtimestamp(event.ts).date()
+                    if event.action:
+                        Gamification.add_points(event.user_id, event.action, event.deck_id, day)
+                    if event.streak:
+                        Gamification.update_streak(event.user_id, day)
+                conn.execute('''
+                    INSERT INTO answer_queue_state (id, last_seq) VALUES (1, ?)
+                    ON CONFLICT (id) DO UPDATE SET last_seq = MAX(last_seq, excluded.last_seq)
+                ''', (max(e.seq for e in shard_events),))
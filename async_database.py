@@ -0,0 +1,129 @@
+import asyncio
+import inspect
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from database import Database
+from spaced_repetition import SpacedRepetition
+from gamification import Gamification
+
+
+# Параметры, по которым запись направляется в поток-писатель своего шарда
+_ROUTE_PARAMS = (('user_id', 'user_id'), ('deck_id', 'row_id'), ('card_id', 'row_id'))
+
+
+def _router(func):
+    """Функция (args, kwargs) -> аргументы Database._route для вызова func"""
+    params = list(inspect.signature(func).parameters)
+    routes = [(params.index(name), name, key) for name, key in _ROUTE_PARAMS if name in params]
+
+    def route(args, kwargs):
+        for index, name, key in routes:
+            value = kwargs.get(name, args[index] if index < len(args) else None)
+            if value is not None:
+                return {key: value}
+        return {}
+    return route
+
+
+class _AsyncProxy:
+    """Асинхронные версии методов синхронного объекта"""
+
+    def __init__(self, owner, target, reads, writes):
+        self._owner = owner
+        self._target = target
+        self._reads = frozenset(reads)
+        self._writes = frozenset(writes)
+
+    def __getattr__(self, name):
+        if name not in self._writes and name not in self._reads:
+            raise AttributeError(f"{type(self._target).__name__}.{name} не доступен асинхронно")
+        func = getattr(self._target, name)
+        owner = self._owner
+
+        if name in self._writes:
+            route = _router(func)
+
+            async def method(*args, **kwargs):
+                return await owner._run(owner.writer(**route(args, kwargs)), func, args, kwargs)
+        else:
+            async def method(*args, **kwargs):
+                return await owner.run_read(func, *args, **kwargs)
+
+        method.__name__ = name
+        setattr(self, name, method)
+        return method
+
+
+class AsyncDatabase:
+    """Неблокирующий фасад над Database, SpacedRepetition и Gamification.
+
+    У каждого файла базы — общего и каждого шарда — свой поток-писатель
+    (SQLite допускает лишь одного писателя на файл), чтения — в пуле
+    потоков. Запись идёт в поток шарда по user_id, а для колод и карточек —
+    по deck_id / card_id, как маршрутизирует Database; записи разных
+    шардов не ждут друг друга. Обработчики не блокируют цикл событий на
+    fsync и ожидании блокировок.
+    """
+
+    DB_READS = {
+        'get_user_decks', 'get_user_deck_overview', 'get_deck_info', 'get_deck_cards',
+        'get_card', 'get_user_stats', 'get_usernames', 'peek_user_settings',
+    }
+    # get_user_settings может создать строку настроек по умолчанию
+    DB_WRITES = {
+        'add_user', 'create_deck', 'delete_deck', 'add_card', 'add_cards_bulk',
+        'delete_card', 'update_card', 'record_study_session', 'get_user_settings',
+        'update_user_setting',
+    }
+    SRS_READS = {'get_due_cards', 'get_due_page', 'get_due_count', 'get_deck_progress', 'get_detailed_stats'}
+    SRS_WRITES = {'init_card', 'update_card_progress'}
+    # get_full_stats инициализирует пользователя, если его ещё нет
+    GAME_READS = {'check_achievements'}
+    GAME_WRITES = {'init_user', 'add_points', 'update_streak', 'get_full_stats'}
+
+    def __init__(self, database: Database = None, readers: int = 4):
+        self.db = database or Database()
+        # При shards == 1 общий файл и есть единственный шард — один писатель
+        self._writers = {
+            pool: ThreadPoolExecutor(max_workers=1, thread_name_prefix=f'db-writer-{index}')
+            for index, pool in enumerate(dict.fromkeys([self.db.common] + self.db.pools))
+        }
+        self._readers = ThreadPoolExecutor(max_workers=readers, thread_name_prefix='db-reader')
+        self._db_proxy = _AsyncProxy(self, self.db, self.DB_READS, self.DB_WRITES)
+        self.srs = _AsyncProxy(self, SpacedRepetition, self.SRS_READS, self.SRS_WRITES)
+        self.game = _AsyncProxy(self, Gamification, self.GAME_READS, self.GAME_WRITES)
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self._db_proxy, name)
+
+    def writer(self, user_id: int = None, row_id: int = None) -> ThreadPoolExecutor:
+        """Поток-писатель шарда пользователя / шарда id; без аргументов — общего файла"""
+        return self._writers[self.db._route(user_id, row_id)]
+
+    @staticmethod
+    async def _run(executor, func, args, kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, partial(func, *args, **kwargs))
+
+    async def run_read(self, func, *args, **kwargs):
+        """Выполнить синхронную функцию чтения в пуле читателей"""
+        return await self._run(self._readers, func, args, kwargs)
+
+    async def run_write(self, func, *args, **kwargs):
+        """Выполнить синхронную функцию записи в потоке-писателе.
+
+        С именованным user_id — в потоке шарда этого пользователя (user_id
+        передаётся и в func), иначе — в потоке общего файла.
+        """
+        return await self._run(self.writer(kwargs.get('user_id')), func, args, kwargs)
+
+    async def run_shard_write(self, shard: int, func, *args, **kwargs):
+        """Выполнить функцию записи в потоке-писателе шарда с номером shard"""
+        return await self._run(self._writers[self.db.pools[shard]], func, args, kwargs)
+
+    def shutdown(self, wait: bool = True):
+        for writer in self._writers.values():
+            writer.shutdown(wait=wait)
+        self._readers.shutdown(wait=wait)
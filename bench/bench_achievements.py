@@ -0,0 +1,86 @@
+"""Стоимость события для движка достижений в зависимости от истории пользователя.
+
+Событие — переход карточки на уровень MASTERED_LEVEL: самый дорогой путь
+AchievementEngine, он читает mastered_cards из строки user_stats. История
+пользователя — от 0 до 100 000 строк card_progress на уровне ниже
+MASTERED_LEVEL, поэтому пороги first_steps/ten_cards/hundred_cards не
+взяты и проверяются на каждом событии. Для сравнения — правило, которое
+на каждое событие пересчитывает карточки и колоды запросами к
+card_progress и decks.
+"""
+import time
+
+from common import rate, table, workdir
+
+from database import Database
+
+HISTORY_SIZES = (0, 1_000, 10_000, 100_000)
+DECK_CARDS = 500
+EVENTS = 2000
+REQUERY_EVENTS = 200  # пересчёт на большой истории медленный
+
+
+def seed(db: Database, user_id: int, history: int, first_deck: int, first_card: int, now: int):
+    from gamification import Gamification
+    Gamification.init_user(user_id)
+    decks = -(-history // DECK_CARDS)
+    with db.transaction(user_id=user_id) as conn:
+        for d in range(decks):
+            deck_id = first_deck + d
+            conn.execute('INSERT INTO decks (deck_id, user_id, name) VALUES (?, ?, ?)', (deck_id, user_id, 'deck'))
+            cards = range(first_card + d * DECK_CARDS, first_card + min((d + 1) * DECK_CARDS, history))
+            conn.executemany('INSERT INTO cards (card_id, deck_id, question, answer) VALUES (?, ?, ?, ?)',
+                             [(card_id, deck_id, 'q', 'a') for card_id in cards])
+            conn.executemany('INSERT INTO card_progress (user_id, card_id, deck_id, level, next_review) '
+                             'VALUES (?, ?, ?, 3, ?)', [(user_id, card_id, deck_id, now) for card_id in cards])
+    return decks
+
+
+def requery_rules(db: Database, user_id: int):
+    """Пересчёт по исходным таблицам на каждое событие"""
+    with db.connection(user_id=user_id) as conn:
+        mastered = conn.execute('SELECT COUNT(*) FROM card_progress WHERE user_id = ? AND level >= 4',
+                                (user_id,)).fetchone()[0]
+        decks = conn.execute('SELECT COUNT(*) FROM decks WHERE user_id = ?', (user_id,)).fetchone()[0]
+    return mastered >= 1, mastered >= 10, mastered >= 100, decks >= 5
+
+
+def main():
+    workdir()
+    now = int(time.time())
+    db = Database('quizlet_bot.db', shards=1)
+    db.init_db()
+    # Движок подписывается на события при импорте и работает с базой по умолчанию
+    import events
+    from achievements import MASTERED_LEVEL, achievements
+
+    first_deck, first_card = 1, 1
+    for user_id, history in enumerate(HISTORY_SIZES, start=1):
+        first_deck += seed(db, user_id, history, first_deck, first_card, now)
+        first_card += history
+    with db.transaction() as conn:
+        conn.execute('ANALYZE')
+
+    rows = []
+    for user_id, history in enumerate(HISTORY_SIZES, start=1):
+        clock = [now]
+
+        def event():
+            # Шаг больше SPEED_WINDOW / SPEED_ANSWERS: speed_demon проверяется, но не выдаётся
+            clock[0] += 60
+            with db.transaction(user_id=user_id):
+                events.publish('card_progress', user_id=user_id, old_level=MASTERED_LEVEL - 1,
+                               new_level=MASTERED_LEVEL, result='correct', ts=clock[0])
+
+        def requery():
+            with db.transaction(user_id=user_id):
+                requery_rules(db, user_id)
+
+        rows.append((f'{history:,}', 1e6 / rate(event, EVENTS), 1e6 / rate(requery, REQUERY_EVENTS)))
+        assert not achievements.pop_unseen(user_id)
+    print(f'Микросекунд на событие, {EVENTS} (пересчёт — {REQUERY_EVENTS}) событий на пользователя')
+    table(('строк card_progress', 'AchievementEngine', 'пересчёт запросами'), rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""Проверка письменного ответа: SequenceMatcher против LevenshteinMatcher.
+
+До: calculate_similarity считал difflib.SequenceMatcher(...).ratio() по
+строкам в нижнем регистре, худший случай квадратичен по длине. После:
+нормализованные варианты ответа карточки кешируются, общие начало и конец
+отбрасываются, расстояние Левенштейна на остатке считается бит-параллельно
+и обрывается за порогом 0.5.
+Длины ответов — до MAX_ANSWER_LENGTH; время одного сравнения в микросекундах.
+
+На «повторах» длиной 500+ levenshtein медленнее: SequenceMatcher там
+быстр из-за autojunk — частые символы считаются мусором, ratio падает до
+0.00, и верный ответ со сдвигом на символ оценивался бы как неверный.
+Майерс же проходит все n столбцов по числам в m бит.
+"""
+import random
+from difflib import SequenceMatcher
+
+from common import rate, table, workdir
+
+import config
+from answer_matching import get_matcher
+
+LENGTHS = (10, 100, 500, config.MAX_ANSWER_LENGTH)
+WORDS = ('кошка', 'собака', 'дом', 'река', 'солнце', 'ветер', 'книга', 'город', 'дерево', 'море',
+         'the', 'house', 'river', 'window', 'light', 'answer', 'question', 'memory')
+
+
+def text(rng: random.Random, length: int) -> str:
+    words = []
+    while sum(len(word) + 1 for word in words) < length:
+        words.append(rng.choice(WORDS))
+    return ' '.join(words)[:length]
+
+
+def typo(rng: random.Random, answer: str, share: float) -> str:
+    """Заменить долю share символов на случайные буквы"""
+    chars = list(answer)
+    for i in rng.sample(range(len(chars)), max(1, int(len(chars) * share))):
+        chars[i] = rng.choice('абвгдеклмнопрст')
+    return ''.join(chars)
+
+
+def cases(length: int):
+    rng = random.Random(length)
+    answer = text(rng, length)
+    return {
+        'верный': (answer.upper(), answer),
+        'одна опечатка': (typo(rng, answer, 0), answer),
+        'опечатки 5%': (typo(rng, answer, 0.05), answer),
+        'почти, 30%': (typo(rng, answer, 0.3), answer),
+        'неверный': (text(rng, length), answer),
+        # Повторяющиеся символы — худший случай SequenceMatcher
+        'повторы': (('аб' * length)[:length], ('ба' * length)[:length]),
+    }
+
+
+def old_similarity(given: str, answer: str) -> float:
+    return SequenceMatcher(None, given.lower(), answer.lower()).ratio()
+
+
+def main():
+    workdir()
+    matcher = get_matcher('levenshtein')
+    rows = []
+    for length in LENGTHS:
+        n = max(20, 20_000 // length)
+        for name, (given, answer) in cases(length).items():
+            old = 1e6 / rate(lambda: old_similarity(given, answer), n)
+            new = 1e6 / rate(lambda: matcher.match(given, answer), n)
+            rows.append((length, name, old, new, f'{old / new:.1f}x',
+                         f'{old_similarity(given, answer):.2f}', matcher.match(given, answer).grade))
+    print('Микросекунд на одно сравнение')
+    table(('длина', 'ответ', 'до: SequenceMatcher', 'после: levenshtein', 'ускорение', 'ratio до', 'оценка после'),
+          rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""Разбор нажатия inline-кнопки: цепочка startswith против CallbackRouter.
+
+До: в состояниях колоды и обучения все нажатия шли в deck_menu_callback,
+который перебирал ~20 проверок data.startswith(...), а обработчик потом
+ещё раз разбирал data.split("_"). После: CallbackRouter.parse — поиск в
+словаре действий с кэшем разбора, затем выбор маршрута. Сравнивается
+только маршрутизация, без вызова обработчиков; «без кэша» — первый
+разбор строки, которой ещё нет в кэше.
+"""
+from common import rate, table, workdir
+
+N = 200_000
+DATA = ('deck_menu_123', 'study_write_123', 'flip_card', 'rate_good', 'next_card',
+        'stop_study', 'quiz_correct', 'quiz_wrong_2', 'unknown_button')
+
+
+def old_route(data: str):
+    """deck_menu_callback до роутера и разбор аргумента в вызванном обработчике"""
+    if data.startswith("deck_menu_"):
+        return 'deck_menu', int(data.split("_")[2])
+    elif data.startswith("study_select_"):
+        return 'study_select', int(data.split("_")[2])
+    elif data.startswith("study_flash_"):
+        return 'study_flash', int(data.split("_")[2])
+    elif data.startswith("study_write_"):
+        return 'study_write', int(data.split("_")[2])
+    elif data.startswith("study_quiz_"):
+        return 'study_quiz', int(data.split("_")[2])
+    elif data.startswith("study_mixed_"):
+        return 'study_mixed', int(data.split("_")[2])
+    elif data.startswith("add_cards_"):
+        return 'add_cards', int(data.split("_")[2])
+    elif data.startswith("list_cards_"):
+        return 'list_cards', int(data.split("_")[2])
+    elif data.startswith("delete_deck_"):
+        return 'delete_deck', int(data.split("_")[2])
+    elif data.startswith("confirm_delete_"):
+        return 'confirm_delete', int(data.split("_")[2])
+    elif data == "flip_card":
+        return 'flip_card', None
+    elif data.startswith("rate_"):
+        return 'rate', data.split("_")[1]
+    elif data == "next_card":
+        return 'next_card', None
+    elif data == "retry_card":
+        return 'retry_card', None
+    elif data == "show_hint":
+        return 'show_hint', None
+    elif data == "stop_study":
+        return 'stop_study', None
+    elif data.startswith("quiz_"):
+        return ('quiz_correct', None) if data == "quiz_correct" else ('quiz_wrong', None)
+    return None
+
+
+def main():
+    workdir()
+    # Таблица действий — настоящая, из handlers; обработчики не вызываются
+    from handlers import router
+    routes = router._routes
+
+    def new_route(data: str):
+        parsed = router.parse(data)
+        if parsed is None:
+            return None
+        return routes[parsed.action], parsed.arg
+
+    def cold_route(data: str):
+        parsed = router._parse(data)
+        if parsed is None:
+            return None
+        return routes[parsed.action], parsed.arg
+
+    rows = []
+    for data in DATA:
+        expected = old_route(data)
+        parsed = new_route(data)
+        assert (expected is None) == (parsed is None) and (
+            expected is None or expected[0] == parsed[0].action), data
+        old = 1e9 / rate(lambda: old_route(data), N)
+        new = 1e9 / rate(lambda: new_route(data), N)
+        cold = 1e9 / rate(lambda: cold_route(data), N)
+        rows.append((data, old, new, cold, f'{old / new:.1f}x'))
+    print(f'Наносекунд на разбор, {N:,} вызовов')
+    table(('callback_data', 'до: startswith', 'после: parse', 'после: без кэша', 'ускорение'), rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+"""Соединение на вызов против пула долгоживущих соединений.
+
+До пула каждый метод Database открывал sqlite3.connect, выполнял запрос,
+фиксировал и закрывал соединение; оценка карточки открывала их четыре.
+Бенчмарк повторяет оба варианта на одной схеме и печатает операций в секунду.
+"""
+import sqlite3
+from datetime import datetime
+
+from common import rate, table, workdir
+
+from database import Database
+
+CARDS = 1000
+N = 2000
+
+
+def seed(db: Database):
+    db.init_db()
+    with db.transaction() as conn:
+        conn.execute("INSERT INTO decks (user_id, name) VALUES (1, 'bench')")
+        conn.executemany('INSERT INTO cards (deck_id, question, answer) VALUES (1, ?, ?)',
+                         [(f'q{i}', f'a{i}') for i in range(CARDS)])
+        conn.executemany('INSERT INTO card_progress (user_id, card_id, deck_id, next_review) VALUES (1, ?, 1, 0)',
+                         [(i + 1,) for i in range(CARDS)])
+
+
+class PerCall:
+    """Старый путь: новое соединение с настройками по умолчанию на каждый вызов"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.i = 0
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def read(self):
+        self.i = self.i % CARDS + 1
+        conn = self._connect()
+        conn.execute('SELECT * FROM cards WHERE card_id = ?', (self.i,)).fetchone()
+        conn.close()
+
+    def write(self):
+        conn = self._connect()
+        conn.execute('''
+            INSERT INTO learning_stats (user_id, deck_id, cards_studied, correct_answers, total_attempts, last_studied)
+            VALUES (1, 1, 1, 1, 1, ?)
+            ON CONFLICT (user_id, deck_id) DO UPDATE SET cards_studied = cards_studied + 1
+        ''', (datetime.now(),))
+        conn.commit()
+        conn.close()
+
+    def rate_card(self):
+        # Оценка карточки: карточка, прогресс, обновление прогресса, статистика
+        self.read()
+        self.i = self.i % CARDS + 1
+        conn = self._connect()
+        conn.execute('SELECT level FROM card_progress WHERE user_id = 1 AND card_id = ?', (self.i,)).fetchone()
+        conn.close()
+        conn = self._connect()
+        conn.execute('UPDATE card_progress SET level = level + 1 WHERE user_id = 1 AND card_id = ?', (self.i,))
+        conn.commit()
+        conn.close()
+        self.write()
+
+
+class Pooled(PerCall):
+    """Текущий путь: соединения из пула, PRAGMA применены один раз"""
+
+    def __init__(self, db: Database):
+        super().__init__(db.db_name)
+        self.pool = db.common
+
+    def read(self):
+        self.i = self.i % CARDS + 1
+        with self.pool.connection() as conn:
+            conn.execute('SELECT * FROM cards WHERE card_id = ?', (self.i,)).fetchone()
+
+    def write(self):
+        with self.pool.transaction() as conn:
+            conn.execute('''
+                INSERT INTO learning_stats (user_id, deck_id, cards_studied, correct_answers, total_attempts, last_studied)
+                VALUES (1, 1, 1, 1, 1, ?)
+                ON CONFLICT (user_id, deck_id) DO UPDATE SET cards_studied = cards_studied + 1
+            ''', (datetime.now(),))
+
+    def rate_card(self):
+        self.i = self.i % CARDS + 1
+        with self.pool.transaction() as conn:
+            conn.execute('SELECT * FROM cards WHERE card_id = ?', (self.i,)).fetchone()
+            conn.execute('SELECT level FROM card_progress WHERE user_id = 1 AND card_id = ?', (self.i,)).fetchone()
+            conn.execute('UPDATE card_progress SET level = level + 1 WHERE user_id = 1 AND card_id = ?', (self.i,))
+        self.write()
+
+
+def main():
+    workdir()
+    before_db = Database('before.db', shards=1)
+    seed(before_db)
+    before_db.close()
+    # Старые базы жили в журнале отката: возвращаем режим по умолчанию
+    with sqlite3.connect('before.db') as conn:
+        conn.execute('PRAGMA journal_mode=DELETE')
+    after_db = Database('after.db', shards=1)
+    seed(after_db)
+
+    before, after = PerCall('before.db'), Pooled(after_db)
+    rows = []
+    for name in ('read', 'write', 'rate_card'):
+        old = rate(getattr(before, name), N)
+        new = rate(getattr(after, name), N)
+        rows.append((name, old, new, f'{new / old:.1f}x'))
+    print(f'Операций в секунду, {N} вызовов')
+    table(('операция', 'до (connect на вызов)', 'после (пул)', 'ускорение'), rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""Задержка очереди повторения в зависимости от объёма card_progress.
+
+До: get_due_cards соединял cards и card_progress, сравнивал текстовый
+next_review с datetime('now') и сортировал всё просроченное по level.
+После: next_review в epoch, индекс (user_id, deck_id, next_review, card_id),
+страница get_due_page и счётчик get_due_count без сортировки.
+Таблицы растут до 1 млн строк прогресса; у пользователя из запроса —
+колода из 500 карточек, половина которых просрочена.
+"""
+import time
+from datetime import datetime, timezone
+
+from common import table, timed, workdir
+
+from database import Database
+from migrations import migrate
+
+DECK_CARDS = 500
+CARDS_PER_USER = 5000  # 10 колод по 500 карточек у каждого пользователя
+SIZES = (10_000, 100_000, 1_000_000)
+
+
+def fill(pool, first_user: int, last_user: int, now: int, epoch: bool):
+    """Колоды, карточки и прогресс пользователей first_user..last_user - 1"""
+    decks = CARDS_PER_USER // DECK_CARDS
+    with pool.transaction() as conn:
+        for user_id in range(first_user, last_user):
+            progress = []
+            for d in range(decks):
+                deck_id = (user_id - 1) * decks + d + 1
+                conn.execute('INSERT INTO decks (deck_id, user_id, name) VALUES (?, ?, ?)', (deck_id, user_id, 'd'))
+                first_card = (deck_id - 1) * DECK_CARDS + 1
+                conn.executemany('INSERT INTO cards (card_id, deck_id, question, answer) VALUES (?, ?, ?, ?)',
+                                 [(first_card + i, deck_id, 'q', 'a') for i in range(DECK_CARDS)])
+                for i in range(DECK_CARDS):
+                    # Чётные просрочены, нечётные — в будущем
+                    due = now - 3600 * (i + 1) if i % 2 == 0 else now + 3600 * (i + 1)
+                    if not epoch:
+                        due = datetime.fromtimestamp(due, timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+                    progress.append((user_id, first_card + i, deck_id, i % 7, due))
+            if epoch:
+                conn.executemany('INSERT INTO card_progress (user_id, card_id, deck_id, level, next_review) '
+                                 'VALUES (?, ?, ?, ?, ?)', progress)
+            else:
+                conn.executemany('INSERT INTO card_progress (user_id, card_id, level, next_review) '
+                                 'VALUES (?, ?, ?, ?)', [(u, c, level, due) for u, c, _, level, due in progress])
+
+
+def old_due_cards(pool, user_id: int, deck_id: int):
+    with pool.connection() as conn:
+        return [dict(row) for row in conn.execute('''
+            SELECT c.*, cp.level
+            FROM cards c
+            JOIN card_progress cp ON c.card_id = cp.card_id
+            WHERE c.deck_id = ? AND cp.user_id = ? AND cp.next_review <= datetime('now')
+            ORDER BY cp.level ASC
+        ''', (deck_id, user_id))]
+
+
+def main():
+    workdir()
+    now = int(time.time())
+    # Схема до очереди повторения — версия 1, без индексов и с текстовым next_review
+    before = Database('before.db', shards=1)
+    migrate(before.common, target=1)
+    after = Database('quizlet_bot.db', shards=1)
+    after.init_db()
+    # SpacedRepetition работает с базой по умолчанию — quizlet_bot.db в рабочем каталоге
+    from spaced_repetition import SpacedRepetition
+
+    rows, users = [], 1
+    for size in SIZES:
+        target = size // CARDS_PER_USER
+        fill(before.common, users, target + 1, now, epoch=False)
+        fill(after.common, users, target + 1, now, epoch=True)
+        users = target + 1
+        for pool in (before.common, after.common):
+            with pool.transaction() as conn:
+                conn.execute('ANALYZE')
+
+        assert len(old_due_cards(before.common, 1, 1)) == DECK_CARDS // 2 == SpacedRepetition.get_due_count(1, 1)
+        rows.append((
+            f'{size:,}',
+            timed(lambda: old_due_cards(before.common, 1, 1)) * 1000,
+            timed(lambda: SpacedRepetition.get_due_page(1, 1, 20)) * 1000,
+            timed(lambda: SpacedRepetition.get_due_count(1, 1)) * 1000,
+        ))
+    print('Задержка, мс (лучшее из 5)')
+    table(('строк card_progress', 'до: get_due_cards', 'после: get_due_page(20)', 'после: get_due_count'), rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""Сборка учебной сессии на колодах из 500 и 50 000 карточек.
+
+До: prepare_cards загружал всю колоду в список словарей, сортировал его
+по difficulty, перемешивал и брал первые 20. После: просроченные
+карточки и взвешенная выборка остальных выбираются в SQL, в Python
+приходит только сессия. Просроченных карточек нет, чтобы работала
+выборка, самая дорогая часть нового пути. Печатаются время и пиковая
+память Python (tracemalloc) на одну сессию.
+"""
+import random
+import time
+import tracemalloc
+
+from common import table, timed, workdir
+
+from database import Database
+
+DECK_SIZES = (500, 50_000)
+STUDIED = 0.2  # доля колоды, у которой уже есть прогресс
+SESSION = 20
+# Колоды других пользователей: в живой базе одна колода — малая доля таблицы cards,
+# иначе статистика ANALYZE подсказывает планировщику полный обход
+OTHER_DECKS = 200
+OTHER_DECK_CARDS = 250
+
+
+def seed(db: Database, deck_id: int, size: int, first_card: int, now: int, user_id: int = 1):
+    with db.transaction() as conn:
+        conn.execute('INSERT INTO decks (deck_id, user_id, name) VALUES (?, ?, ?)', (deck_id, user_id, f'deck {size}'))
+        conn.executemany('INSERT INTO cards (card_id, deck_id, question, answer) VALUES (?, ?, ?, ?)', [
+            (first_card + i, deck_id, f'Вопрос номер {i} о чём-нибудь важном', f'ответ номер {i}')
+            for i in range(size)
+        ])
+        conn.executemany('''
+            INSERT INTO card_progress (user_id, card_id, deck_id, level, next_review, correct_count, wrong_count)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', [
+            (user_id, first_card + i, deck_id, i % 6, now + 86400 * (i % 30 + 1), i % 5, i % 3)
+            for i in range(int(size * STUDIED))
+        ])
+
+
+def old_prepare_cards(db: Database, deck_id: int, mode: str = 'write', limit: int = SESSION):
+    """prepare_cards до изменения; соединение из пула, чтобы сравнивать только сам алгоритм"""
+    with db.connection() as conn:
+        cards = [dict(row) for row in conn.execute('SELECT * FROM cards WHERE deck_id = ? ORDER BY card_id',
+                                                   (deck_id,))]
+    if not cards:
+        return []
+    if mode in ['write', 'quiz']:
+        cards.sort(key=lambda x: x.get('difficulty', 1), reverse=True)
+    random.shuffle(cards)
+    return cards[:limit]
+
+
+def peak_kib(func) -> float:
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak / 1024
+
+
+def main():
+    workdir()
+    now = int(time.time())
+    db = Database('quizlet_bot.db', shards=1)
+    db.init_db()
+    # StudyModes работает с базой по умолчанию — quizlet_bot.db в рабочем каталоге
+    from study_modes import StudyModes
+
+    rows, first_card = [], 1
+    for deck_id, size in enumerate(DECK_SIZES, start=1):
+        seed(db, deck_id, size, first_card, now)
+        first_card += size
+    for deck_id in range(len(DECK_SIZES) + 1, len(DECK_SIZES) + 1 + OTHER_DECKS):
+        seed(db, deck_id, OTHER_DECK_CARDS, first_card, now, user_id=deck_id)
+        first_card += OTHER_DECK_CARDS
+    with db.transaction() as conn:
+        conn.execute('ANALYZE')
+
+    for deck_id, size in enumerate(DECK_SIZES, start=1):
+        def old():
+            return old_prepare_cards(db, deck_id)
+
+        def new():
+            return StudyModes.prepare_cards(1, deck_id, 'write', SESSION)
+
+        assert len(old()) == len(new()) == SESSION
+        rows.append((
+            f'{size:,}',
+            timed(old, repeat=10) * 1000, timed(new, repeat=10) * 1000,
+            peak_kib(old), peak_kib(new),
+        ))
+    print(f'Сессия из {SESSION} карточек, режим write; время — лучшее из 10')
+    table(('карточек в колоде', 'до, мс', 'после, мс', 'до, КиБ', 'после, КиБ'), rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""Память на одну активную сессию обучения при 10 000 сессий.
+
+До: user_data['study_session'] — словарь со списком полных строк карточек
+из prepare_cards (смешанный режим дописывал в них sub_mode). После:
+StudySession со __slots__, id карточек в array('q'), тексты — в общем
+кэше карточек. Сессии строятся из настоящих выборок prepare_cards;
+считается память, оставшаяся после построения (tracemalloc).
+"""
+import gc
+import random
+import time
+import tracemalloc
+
+from common import table, workdir
+
+from database import Database
+
+SESSIONS = 10_000
+DECKS = 500
+DECK_CARDS = 200
+SESSION_CARDS = 20
+MODES = ('flashcard', 'write', 'mixed')
+SUB_MODES = ('flashcard', 'write', 'quiz')
+
+
+def seed(db: Database):
+    with db.transaction() as conn:
+        for deck_id in range(1, DECKS + 1):
+            conn.execute('INSERT INTO decks (deck_id, user_id, name) VALUES (?, ?, ?)', (deck_id, deck_id, 'deck'))
+            conn.executemany('INSERT INTO cards (deck_id, question, answer) VALUES (?, ?, ?)', [
+                (deck_id, f'Как переводится слово номер {i} из колоды {deck_id}?', f'перевод {i}; вариант {i}')
+                for i in range(DECK_CARDS)
+            ])
+        conn.execute('ANALYZE')
+
+
+def sessions(build):
+    """Построить SESSIONS сессий; вернуть их и оставшуюся после построения память"""
+    rng = random.Random(1)
+    gc.collect()
+    tracemalloc.start()
+    built = []
+    for i in range(SESSIONS):
+        mode = MODES[i % len(MODES)]
+        sub_modes = [rng.choice(SUB_MODES) for _ in range(SESSION_CARDS)] if mode == 'mixed' else None
+        built.append(build(mode, rng.randint(1, DECKS), sub_modes))
+    gc.collect()
+    retained, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return built, retained
+
+
+def main():
+    workdir()
+    db = Database('quizlet_bot.db', shards=1)
+    db.init_db()
+    seed(db)
+    # StudyModes и кэш карточек работают с базой по умолчанию — quizlet_bot.db в рабочем каталоге
+    from study_modes import StudyModes, db as shared_db
+    from study_session import StudySession
+    user_id = 1
+
+    def old(mode, deck_id, sub_modes):
+        cards = StudyModes.prepare_cards(user_id, deck_id, mode, SESSION_CARDS)
+        for card, sub_mode in zip(cards, sub_modes or ()):
+            card['sub_mode'] = sub_mode
+        return {'mode': mode, 'deck_id': deck_id, 'cards': cards,
+                'current': 0, 'correct': 0, 'wrong': 0, 'flipped': False}
+
+    def new(mode, deck_id, sub_modes):
+        # То же, что handlers._start_session
+        cards = StudyModes.prepare_cards(user_id, deck_id, mode, SESSION_CARDS)
+        shared_db.cache_cards(cards)
+        return StudySession.from_cards(mode, deck_id, cards, sub_modes)
+
+    started = time.perf_counter()
+    old_sessions, old_bytes = sessions(old)
+    del old_sessions
+    shared_db.cards_cache.clear()
+    new_sessions, new_bytes = sessions(new)
+    cache_entries = len(shared_db.cards_cache)
+    # Без кэша: только объекты сессий, кэш уже заполнен и общий для всех
+    _, session_bytes = sessions(
+        lambda mode, deck_id, sub_modes: StudySession(mode, deck_id, range(SESSION_CARDS), sub_modes))
+
+    print(f'{SESSIONS:,} сессий по {SESSION_CARDS} карточек, {DECKS} колод по {DECK_CARDS} карточек '
+          f'({time.perf_counter() - started:.0f} с)')
+    table(('', 'всего, МиБ', 'байт на сессию'), [
+        ('до: словари карточек', old_bytes / 2 ** 20, old_bytes // SESSIONS),
+        (f'после: сессии + кэш ({cache_entries:,} карточек)', new_bytes / 2 ** 20, new_bytes // SESSIONS),
+        ('после: только сессии', session_bytes / 2 ** 20, session_bytes // SESSIONS),
+    ])
+
+
+if __name__ == '__main__':
+    main()
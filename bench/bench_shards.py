@@ -0,0 +1,98 @@
+"""Пропускная способность записи через AsyncDatabase в зависимости от числа шардов.
+
+Каждая задача asyncio — пользователь, который отвечает на карточки, как
+обработчик бота: await adb.run_write(..., user_id=...) с транзакцией,
+обновляющей прогресс и статистику колоды в шарде пользователя. Сравниваются
+один поток-писатель на все шарды (как было) и поток-писатель на шард.
+
+С synchronous=NORMAL (настройка бота) фиксация в WAL почти не ждёт диск, и
+предел задаёт GIL; выигрыш шардов виден, когда фиксация ждёт диск, — это
+показывает прогон с synchronous=FULL (fsync на COMMIT).
+"""
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from common import table, workdir
+
+import database
+from async_database import AsyncDatabase
+from database import Database
+
+USERS = 32
+ANSWERS = 300
+CARDS = 50
+SHARD_COUNTS = (1, 2, 4, 8)
+
+
+def answer(db: Database, user_id: int, card_id: int):
+    with db.transaction(user_id=user_id) as conn:
+        conn.execute('''
+            INSERT INTO card_progress (user_id, card_id, deck_id, level, next_review, correct_count)
+            VALUES (?, ?, 1, 1, 0, 1)
+            ON CONFLICT (user_id, card_id) DO UPDATE
+            SET level = MIN(level + 1, 6), correct_count = correct_count + 1, next_review = ?
+        ''', (user_id, card_id, int(time.time())))
+        conn.execute('''
+            INSERT INTO learning_stats (user_id, deck_id, cards_studied, correct_answers, total_attempts, last_studied)
+            VALUES (?, 1, 1, 1, 1, ?)
+            ON CONFLICT (user_id, deck_id) DO UPDATE
+            SET cards_studied = cards_studied + 1, correct_answers = correct_answers + 1,
+                total_attempts = total_attempts + 1, last_studied = excluded.last_studied
+        ''', (user_id, datetime.now()))
+
+
+class SingleWriter(AsyncDatabase):
+    """AsyncDatabase до разделения писателей: один поток на записи всех шардов"""
+
+    def __init__(self, db: Database):
+        super().__init__(db)
+        self._single = ThreadPoolExecutor(max_workers=1, thread_name_prefix='db-writer')
+
+    def writer(self, user_id: int = None, row_id: int = None):
+        return self._single
+
+    def shutdown(self, wait: bool = True):
+        self._single.shutdown(wait=wait)
+        super().shutdown(wait)
+
+
+def run(shards: int, synchronous: str, adb_class) -> float:
+    database.CONNECTION_PRAGMAS = tuple(
+        f'PRAGMA synchronous={synchronous}' if pragma.startswith('PRAGMA synchronous') else pragma
+        for pragma in database.CONNECTION_PRAGMAS
+    )
+    db = Database(f'bench{shards}{synchronous}{adb_class.__name__}.db', shards=shards)
+    db.init_db()
+    adb = adb_class(db)
+
+    async def user(user_id: int):
+        for i in range(ANSWERS):
+            await adb.run_write(answer, db, user_id=user_id, card_id=i % CARDS + 1)
+
+    async def main():
+        started = time.perf_counter()
+        await asyncio.gather(*(user(1000 + u) for u in range(USERS)))
+        return time.perf_counter() - started
+
+    elapsed = asyncio.run(main())
+    adb.shutdown()
+    db.close()
+    return USERS * ANSWERS / elapsed
+
+
+def main():
+    workdir()
+    print(f'{USERS} пользователей параллельно, по {ANSWERS} ответов; ответов в секунду')
+    for synchronous in ('NORMAL', 'FULL'):
+        rows = [(shards, run(shards, synchronous, SingleWriter), run(shards, synchronous, AsyncDatabase))
+                for shards in SHARD_COUNTS]
+        base = rows[0][2]
+        print(f'synchronous={synchronous}')
+        table(('шардов', 'один писатель', 'писатель на шард', 'к одному файлу'),
+              [(shards, single, per_shard, f'{per_shard / base:.2f}x') for shards, single, per_shard in rows])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+"""Общее для бенчмарков.
+
+Запуск из корня репозитория: python bench/<имя>.py. Базы создаются во
+временном каталоге — модули бота открывают quizlet_bot.db по
+относительному пути, поэтому каталог меняется до их импорта.
+"""
+import os
+import sys
+import tempfile
+import time
+from typing import Callable, Iterable, Sequence
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def workdir() -> str:
+    path = tempfile.mkdtemp(prefix='quizlet-bench-')
+    os.chdir(path)
+    return path
+
+
+def rate(func: Callable[[], object], n: int) -> float:
+    """Операций в секунду для n вызовов func"""
+    started = time.perf_counter()
+    for _ in range(n):
+        func()
+    return n / (time.perf_counter() - started)
+
+
+def timed(func: Callable[[], object], repeat: int = 5) -> float:
+    """Лучшее из repeat время одного вызова, секунды"""
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def table(header: Sequence[str], rows: Iterable[Sequence]):
+    rows = [[f'{value:,.1f}' if isinstance(value, float) else str(value) for value in row] for row in rows]
+    widths = [max(len(str(cell)) for cell in column) for column in zip(header, *rows)]
+    for row in [list(header)] + rows:
+        print('  '.join(str(cell).rjust(width) for cell, width in zip(row, widths)))
+    print()
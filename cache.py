@@ -0,0 +1,83 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict
+
+_MISSING = object()
+
+
+class TTLCache:
+    """Ограниченный LRU-кэш со временем жизни записей и счётчиками попаданий"""
+
+    _shared: Dict[str, 'TTLCache'] = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(self, maxsize: int = 10000, ttl: float = 300.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()  # key -> (срок годности, значение)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def shared(cls, name: str, maxsize: int = 10000, ttl: float = 300.0) -> 'TTLCache':
+        """Именованный кэш, общий для всех модулей процесса"""
+        with cls._shared_lock:
+            cache = cls._shared.get(name)
+            if cache is None:
+                cache = cls._shared[name] = cls(maxsize, ttl)
+            return cache
+
+    @classmethod
+    def all_stats(cls) -> Dict[str, Dict]:
+        with cls._shared_lock:
+            return {name: cache.stats() for name, cache in cls._shared.items()}
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is not _MISSING:
+                expires, value = item
+                if expires > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def update(self, key, **fields):
+        """Обновить поля закэшированного словаря, если он есть"""
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None:
+                expires, value = item
+                self._data[key] = (expires, {**value, **fields})
+
+    def invalidate(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> Dict:
+        total = self.hits + self.misses
+        return {
+            'size': len(self._data),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / total, 3) if total else 0.0,
+        }
@@ -0,0 +1,89 @@
+from functools import lru_cache
+from typing import Any, Callable, Dict, NamedTuple, Optional
+from telegram import Update
+from telegram.ext import CallbackQueryHandler, ContextTypes
+
+
+class CallbackData(NamedTuple):
+    """Разобранный callback_data: действие и типизированный аргумент"""
+    action: str
+    arg: Any = None
+
+
+class Route(NamedTuple):
+    action: str
+    handler: Callable
+    arg_type: Optional[Callable[[str], Any]]
+    answer: bool
+
+
+class CallbackRouter:
+    """Маршрутизация нажатий inline-кнопок по таблице вместо цепочки startswith.
+
+    callback_data имеет вид «действие» или «действие_аргумент»; в имени
+    действия тоже бывают «_» (deck_menu_5, quiz_wrong_2). Действия без
+    аргумента находятся одним поиском в словаре, с аргументом — поиском
+    префиксов до каждого «_». Разбор кэшируется: данные кнопок повторяются,
+    и фильтр состояния и dispatch разбирают одну строку один раз.
+    """
+
+    def __init__(self, cache_size: int = 4096):
+        self._routes: Dict[str, Route] = {}
+        self.parse = lru_cache(maxsize=cache_size)(self._parse)
+
+    def route(self, action: str, arg_type: Callable[[str], Any] = None, answer: bool = True):
+        """Декоратор: handler(update, context[, arg]) для действия action.
+
+        answer=False — обработчик сам отвечает на callback query (всплывающий текст).
+        """
+        def decorator(handler):
+            if action in self._routes:
+                raise ValueError(f"Действие {action} уже зарегистрировано")
+            self._routes[action] = Route(action, handler, arg_type, answer)
+            self.parse.cache_clear()
+            return handler
+        return decorator
+
+    def _parse(self, data: str) -> Optional[CallbackData]:
+        route = self._routes.get(data)
+        if route is not None and route.arg_type is None:
+            return CallbackData(data)
+        sep = data.find('_')
+        while sep != -1:
+            route = self._routes.get(data[:sep])
+            if route is not None and route.arg_type is not None:
+                try:
+                    return CallbackData(route.action, route.arg_type(data[sep + 1:]))
+                except ValueError:
+                    return None
+            sep = data.find('_', sep + 1)
+        return None
+
+    async def dispatch(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        query = update.callback_query
+        parsed = self.parse(query.data) if isinstance(query.data, str) else None
+        if parsed is None:
+            # Кнопка устаревшей версии бота: гасим часики, состояние не меняем
+            await query.answer()
+            return None
+        route = self._routes[parsed.action]
+        if route.answer:
+            await query.answer()
+        if route.arg_type is None:
+            return await route.handler(update, context)
+        return await route.handler(update, context, parsed.arg)
+
+    def handler(self, *actions: str) -> CallbackQueryHandler:
+        """CallbackQueryHandler состояния диалога; без actions — все нажатия"""
+        if not actions:
+            return CallbackQueryHandler(self.dispatch)
+        unknown = set(actions) - set(self._routes)
+        if unknown:
+            raise ValueError(f"Неизвестные действия: {', '.join(sorted(unknown))}")
+        allowed = frozenset(actions)
+
+        def matches(data) -> bool:
+            parsed = self.parse(data) if isinstance(data, str) else None
+            return parsed is not None and parsed.action in allowed
+
+        return CallbackQueryHandler(self.dispatch, pattern=matches)
@@ -11,6 +11,7 @@ DATABASE_PATH = "./"
 MAX_CARDS_PER_SESSION = 50  # Максимум карточек в одной сессии
 SHUFFLE_CARDS = True  # Перемешивать карточки при обучении
 AUTO_SAVE = True  # Автосохранение прогресса
+ANSWER_MATCHER = "levenshtein"  # Проверка письменных ответов: levenshtein / exact
 
 # UI Настройки
 USE_EMOJIS = True  # Использовать эмодзи в сообщениях
@@ -1,343 +1,708 @@
+import math
+import os
+import queue
 import sqlite3
+import threading
+import time
+from contextlib import contextmanager
 from datetime import datetime
 from typing import List, Dict, Optional
+from migrations import migrate
+from cache import TTLCache
+from distractors import DistractorIndex
+import events
 
-class Database:
-    def __init__(self, db_name='quizlet_bot.db'):
-        self.db_name = db_name
+# PRAGMA применяются один раз при открытии соединения
+CONNECTION_PRAGMAS = (
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA cache_size=-16000',     # ~16 МБ страничного кэша
+    'PRAGMA mmap_size=134217728',   # 128 МБ memory-mapped I/O
+    'PRAGMA temp_store=MEMORY',
+)
+
+# В шардированном режиме id колод и карточек шарда i начинаются с i << ID_SHARD_BITS,
+# поэтому шард определяется по самому id без обращения к базе
+ID_SHARD_BITS = 40
+
+# Запросы горячего пути; планы их выполнения проверяет tests/test_migrations.py
+DECK_CARDS_SQL = 'SELECT * FROM cards WHERE deck_id = ? ORDER BY card_id'
+USER_DECKS_SQL = '''
+    SELECT deck_id, name, description, card_count, created_at
+    FROM decks
+    WHERE user_id = ?
+    ORDER BY updated_at DESC
+'''
+# deck_filter — пусто или 'AND d.deck_id = ?'
+DECK_OVERVIEW_SQL = '''
+    SELECT d.deck_id, d.name, d.description, d.created_at, d.card_count,
+           COUNT(CASE WHEN cp.level >= 4 THEN 1 END) as mastered,
+           COUNT(CASE WHEN cp.level BETWEEN 1 AND 3 THEN 1 END) as learning,
+           COUNT(CASE WHEN cp.next_review <= ? THEN 1 END) as due
+    FROM decks d
+    LEFT JOIN cards c ON c.deck_id = d.deck_id
+    LEFT JOIN card_progress cp ON cp.card_id = c.card_id AND cp.user_id = ?
+    WHERE d.user_id = ? {deck_filter}
+    GROUP BY d.deck_id
+    ORDER BY d.updated_at DESC
+'''
+DELETE_CARD_PROGRESS_SQL = 'DELETE FROM card_progress WHERE card_id = ?'
+RECORD_STUDY_SQL = '''
+    INSERT INTO learning_stats
+    (user_id, deck_id, cards_studied, correct_answers, total_attempts, last_studied)
+    VALUES (?, ?, 1, ?, ?, ?)
+    ON CONFLICT (user_id, deck_id) DO UPDATE
+    SET cards_studied = cards_studied + 1,
+        correct_answers = correct_answers + excluded.correct_answers,
+        total_attempts = total_attempts + excluded.total_attempts,
+        last_studied = excluded.last_studied
+'''
+
+
+class ConnectionPool:
+    """Пул долгоживущих соединений SQLite для одного файла базы"""
 
-    def get_connection(self):
-        conn = sqlite3.connect(self.db_name)
+    _pools: Dict[str, 'ConnectionPool'] = {}
+    _pools_lock = threading.Lock()
+
+    def __init__(self, path: str, size: int = 8, timeout: float = 30.0):
+        self.path = path
+        self.size = size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @classmethod
+    def for_path(cls, path: str) -> 'ConnectionPool':
+        """Общий пул на файл: все экземпляры Database делят соединения"""
+        with cls._pools_lock:
+            pool = cls._pools.get(path)
+            if pool is None:
+                pool = cls._pools[path] = cls(path)
+            return pool
+
+    def _connect(self) -> sqlite3.Connection:
+        # isolation_level=None: транзакциями управляет transaction()
+        conn = sqlite3.connect(
+            self.path, timeout=self.timeout,
+            isolation_level=None, check_same_thread=False
+        )
         conn.row_factory = sqlite3.Row
+        for pragma in CONNECTION_PRAGMAS:
+            conn.execute(pragma)
+        try:
+            conn.execute('SELECT ln(1)')
+        except sqlite3.OperationalError:
+            # SQLite собран без математических функций — нужна для выборки сессии
+            conn.create_function('ln', 1, math.log, deterministic=True)
         return conn
 
+    def acquire(self) -> sqlite3.Connection:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                create = True
+            else:
+                create = False
+        if create:
+            try:
+                return self._connect()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+        return self._idle.get(timeout=self.timeout)
+
+    def release(self, conn: sqlite3.Connection):
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        """Соединение для чтения; внутри транзакции — её соединение"""
+        active = getattr(self._local, 'conn', None)
+        if active is not None:
+            yield active
+            return
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    @contextmanager
+    def transaction(self):
+        """Транзакция с записью; вложенные вызовы в том же потоке объединяются"""
+        active = getattr(self._local, 'conn', None)
+        if active is not None:
+            yield active
+            return
+        conn = self.acquire()
+        self._local.conn = conn
+        self._local.before_commit = []
+        self._local.after_commit = []
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield conn
+                # Обработчик может зарегистрировать следующий — проходим по индексу
+                i = 0
+                while i < len(self._local.before_commit):
+                    self._local.before_commit[i]()
+                    i += 1
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+            conn.execute('COMMIT')
+            callbacks = self._local.after_commit
+        finally:
+            self._local.conn = None
+            self._local.before_commit = []
+            self._local.after_commit = []
+            self.release(conn)
+        for callback in callbacks:
+            callback()
+
+    def in_transaction(self) -> bool:
+        return getattr(self._local, 'conn', None) is not None
+
+    def before_commit(self, callback) -> bool:
+        """Вызвать callback внутри текущей транзакции перед COMMIT.
+
+        Повторная регистрация того же callback игнорируется; возвращает
+        True, если callback добавлен сейчас.
+        """
+        if callback in self._local.before_commit:
+            return False
+        self._local.before_commit.append(callback)
+        return True
+
+    def after_commit(self, callback):
+        """Вызвать callback после фиксации текущей транзакции (или сразу вне её)"""
+        if getattr(self._local, 'conn', None) is None:
+            callback()
+        else:
+            self._local.after_commit.append(callback)
+
+    def close(self):
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._created -= 1
+
+
+class Database:
+    CARD_COLUMNS = ('card_id', 'deck_id', 'question', 'answer', 'difficulty', 'created_at', 'updated_at')
+
+    SETTINGS_DEFAULTS = {
+        'notifications': 1,
+        'difficulty': 'medium',
+        'cards_per_session': 20,
+        'reminder_time': '20:00'
+    }
+
+    def __init__(self, db_name='quizlet_bot.db', shards: int = None):
+        self.db_name = db_name
+        if shards is None:
+            shards = int(os.getenv('DATABASE_SHARDS', '1'))
+        self.shards = max(1, shards)
+        # Общий файл: глобальные данные; при shards == 1 в нём и все пользователи
+        self.common = ConnectionPool.for_path(db_name)
+        if self.shards == 1:
+            self.pools = [self.common]
+        else:
+            self.pools = [ConnectionPool.for_path(path) for path in self.shard_paths()]
+        # Кэши общие для всех экземпляров с тем же файлом базы
+        self.users_cache = TTLCache.shared(f'{db_name}:users', maxsize=10000, ttl=3600)
+        self.settings_cache = TTLCache.shared(f'{db_name}:settings', maxsize=10000, ttl=600)
+        # card_id -> строка cards; из него сессии обучения берут тексты карточек
+        self.cards_cache = TTLCache.shared(f'{db_name}:cards', maxsize=50000, ttl=3600)
+        # deck_id -> DistractorIndex, общий для всех сессий и пользователей колоды
+        self.distractors_cache = TTLCache.shared(f'{db_name}:distractors', maxsize=500, ttl=3600)
+
+    # ===== ШАРДЫ =====
+
+    def shard_paths(self) -> List[str]:
+        if self.shards == 1:
+            return [self.db_name]
+        stem, ext = os.path.splitext(self.db_name)
+        return [f'{stem}.shard{i}{ext}' for i in range(self.shards)]
+
+    def shard_for_user(self, user_id: int) -> int:
+        # Мультипликативное хэширование: соседние id расходятся по разным шардам
+        return ((user_id * 2654435761) & 0xFFFFFFFF) % self.shards
+
+    def shard_for_id(self, row_id: int) -> int:
+        """Шард колоды или карточки по её id"""
+        return min(row_id >> ID_SHARD_BITS, self.shards - 1)
+
+    def _route(self, user_id: int = None, row_id: int = None) -> ConnectionPool:
+        if user_id is not None:
+            return self.pools[self.shard_for_user(user_id)]
+        if row_id is not None:
+            return self.pools[self.shard_for_id(row_id)]
+        return self.common
+
+    def connection(self, user_id: int = None, row_id: int = None):
+        """Соединение шарда пользователя / шарда id; без аргументов — общий файл"""
+        return self._route(user_id, row_id).connection()
+
+    def transaction(self, user_id: int = None, row_id: int = None):
+        return self._route(user_id, row_id).transaction()
+
+    def after_commit(self, callback):
+        for pool in set(self.pools + [self.common]):
+            if pool.in_transaction():
+                return pool.after_commit(callback)
+        callback()
+
+    def close(self):
+        for pool in set(self.pools + [self.common]):
+            pool.close()
+
     def init_db(self):
-        conn = self.get_connection()
-        cursor = conn.cursor()
-
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                user_id INTEGER PRIMARY KEY,
-                username TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS decks (
-                deck_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                name TEXT NOT NULL,
-                description TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users(user_id)
-            )
-        ''')
-
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS cards (
-                card_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                deck_id INTEGER NOT NULL,
-                question TEXT NOT NULL,
-                answer TEXT NOT NULL,
-                difficulty INTEGER DEFAULT 1,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (deck_id) REFERENCES decks(deck_id)
-            )
-        ''')
-
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS learning_stats (
-                stat_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                deck_id INTEGER NOT NULL,
-                cards_studied INTEGER DEFAULT 0,
-                correct_answers INTEGER DEFAULT 0,
-                total_attempts INTEGER DEFAULT 0,
-                last_studied TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users(user_id),
-                FOREIGN KEY (deck_id) REFERENCES decks(deck_id)
-            )
-        ''')
-
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS card_progress (
-                progress_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                card_id INTEGER NOT NULL,
-                level INTEGER DEFAULT 0,
-                next_review TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                correct_count INTEGER DEFAULT 0,
-                wrong_count INTEGER DEFAULT 0,
-                UNIQUE(user_id, card_id),
-                FOREIGN KEY (user_id) REFERENCES users(user_id),
-                FOREIGN KEY (card_id) REFERENCES cards(card_id)
-            )
-        ''')
-
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS user_gamification (
-                user_id INTEGER PRIMARY KEY,
-                total_points INTEGER DEFAULT 0,
-                current_streak INTEGER DEFAULT 0,
-                max_streak INTEGER DEFAULT 0,
-                last_study_date DATE,
-                study_days_streak INTEGER DEFAULT 0,
-                achievements TEXT,
-                FOREIGN KEY (user_id) REFERENCES users(user_id)
-            )
-        ''')
-
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS user_settings (
-                user_id INTEGER PRIMARY KEY,
-                notifications INTEGER DEFAULT 1,
-                difficulty TEXT DEFAULT 'medium',
-                cards_per_session INTEGER DEFAULT 20,
-                reminder_time TEXT DEFAULT '20:00',
-                FOREIGN KEY (user_id) REFERENCES users(user_id)
-            )
-        ''')
+        """Создать схему или обновить существующие базы до последней версии"""
+        version = migrate(self.common)
+        if self.shards > 1:
+            for index, pool in enumerate(self.pools):
+                version = migrate(pool)
+                self._seed_shard_ids(pool, index)
+        return version
+
+    @staticmethod
+    def _seed_shard_ids(pool: ConnectionPool, index: int):
+        """Начать AUTOINCREMENT колод и карточек шарда с index << ID_SHARD_BITS"""
+        with pool.transaction() as conn:
+            for table in ('decks', 'cards'):
+                conn.execute(
+                    '''
+                    INSERT INTO sqlite_sequence (name, seq)
+                    SELECT ?, ? WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = ?)
+                    ''',
+                    (table, index << ID_SHARD_BITS, table)
+                )
+
+    # Таблицы с данными пользователей и выражения для переноса в шард:
+    # столбец -> SQL-выражение над строкой исходной базы (остальные — как есть).
+    # Владелец None — строки копируются в каждый шард
+    SHARDED_TABLES = (
+        ('users', 'user_id', {}),
+        ('user_settings', 'user_id', {}),
+        ('user_gamification', 'user_id', {}),
+        ('decks', 'user_id', {'deck_id': 'deck_id + :offset', 'card_count': '0'}),
+        ('cards', '(SELECT d.user_id FROM src.decks d WHERE d.deck_id = src.cards.deck_id)',
+         {'card_id': 'card_id + :offset', 'deck_id': 'deck_id + :offset'}),
+        ('learning_stats', 'user_id', {'stat_id': 'NULL', 'deck_id': 'deck_id + :offset'}),
+        ('card_progress', 'user_id',
+         {'progress_id': 'NULL', 'card_id': 'card_id + :offset', 'deck_id': 'deck_id + :offset'}),
+        ('bot_user_data', 'user_id', {}),
+        ('points_ledger', 'user_id', {'entry_id': 'NULL', 'deck_id': 'deck_id + :offset'}),
+        ('points_daily', 'user_id', {}),
+        # Журнал ответов общий: без last_seq шард заново применил бы уже учтённые события
+        ('answer_queue_state', None, {}),
+    )
 
-        conn.commit()
-        conn.close()
+    def split_into_shards(self, source_path: str, clear_source: bool = True) -> List[Dict]:
+        """Разнести однофайловую базу по шардам этого экземпляра.
+
+        Id колод и карточек получают смещение шарда. Счётчики колод и
+        user_stats пересчитываются триггерами и rebuild_user_stats.
+        """
+        if self.shards == 1:
+            raise ValueError("Для разбиения нужен Database(shards > 1)")
+        self.init_db()
+        report = []
+        for index, pool in enumerate(self.pools):
+            offset = index << ID_SHARD_BITS
+            with pool.transaction() as conn:
+                if conn.execute('SELECT COUNT(*) FROM users').fetchone()[0]:
+                    raise ValueError(f"Шард {index} уже содержит данные")
+            # ATTACH невозможен внутри транзакции, поэтому управляем ею вручную
+            conn = pool.acquire()
+            try:
+                conn.create_function('user_shard', 1, self.shard_for_user, deterministic=True)
+                conn.execute('ATTACH DATABASE ? AS src', (source_path,))
+                conn.execute('BEGIN IMMEDIATE')
+                counts = {'shard': index}
+                for table, owner, overrides in self.SHARDED_TABLES:
+                    columns = [row['name'] for row in conn.execute(f'PRAGMA main.table_info({table})')]
+                    select = ', '.join(overrides.get(col, col) for col in columns)
+                    where = '' if owner is None else f' WHERE user_shard({owner}) = :shard'
+                    cursor = conn.execute(
+                        f'INSERT INTO main.{table} ({", ".join(columns)}) '
+                        f'SELECT {select} FROM src.{table}{where}',
+                        {'offset': offset, 'shard': index}
+                    )
+                    counts[table] = cursor.rowcount
+                # Триггеры вставки карточек сдвинули updated_at — возвращаем исходный
+                conn.execute('''
+                    UPDATE main.decks SET updated_at = (
+                        SELECT s.updated_at FROM src.decks s WHERE s.deck_id = main.decks.deck_id - :offset
+                    )
+                ''', {'offset': offset})
+                conn.execute('COMMIT')
+            finally:
+                if conn.in_transaction:
+                    conn.execute('ROLLBACK')
+                conn.execute('DETACH DATABASE src')
+                pool.release(conn)
+            self._rebuild_user_stats(pool)
+            report.append(counts)
+
+        if clear_source:
+            source = ConnectionPool.for_path(source_path)
+            with source.transaction() as conn:
+                for table, _, _ in reversed(self.SHARDED_TABLES):
+                    conn.execute(f'DELETE FROM {table}')
+                # Последней: удаления выше обновляют её триггерами
+                conn.execute('DELETE FROM user_stats')
+        return report
 
     # ===== ПОЛЬЗОВАТЕЛИ =====
 
     def add_user(self, user_id: int, username: str = None):
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('SELECT user_id FROM users WHERE user_id = ?', (user_id,))
-        if cursor.fetchone():
-            cursor.execute('UPDATE users SET username = ? WHERE user_id = ?', (username, user_id))
-        else:
-            cursor.execute('INSERT INTO users (user_id, username) VALUES (?, ?)', (user_id, username))
-        conn.commit()
-        conn.close()
+        cached = self.users_cache.get(user_id, False)
+        if cached is not False and cached == username:
+            return
+        with self.transaction(user_id=user_id) as conn:
+            conn.execute('''
+                INSERT INTO users (user_id, username) VALUES (?, ?)
+                ON CONFLICT (user_id) DO UPDATE SET username = excluded.username
+            ''', (user_id, username))
+            self.after_commit(lambda: self.users_cache.set(user_id, username))
+
+    def get_usernames(self, user_ids) -> Dict[int, Optional[str]]:
+        """username по id: из кэша, остальные — одним запросом на шард"""
+        names, missing = {}, {}
+        for user_id in user_ids:
+            cached = self.users_cache.get(user_id, False)
+            if cached is False:
+                missing.setdefault(self.shard_for_user(user_id), []).append(user_id)
+            else:
+                names[user_id] = cached
+        for shard, ids in missing.items():
+            with self.pools[shard].connection() as conn:
+                rows = conn.execute(
+                    f'SELECT user_id, username FROM users WHERE user_id IN ({",".join("?" * len(ids))})', ids
+                ).fetchall()
+            for row in rows:
+                names[row['user_id']] = row['username']
+                self.users_cache.set(row['user_id'], row['username'])
+        return names
 
     # ===== КОЛОДЫ =====
 
     def create_deck(self, user_id: int, name: str, description: str = None) -> int:
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            'INSERT INTO decks (user_id, name, description) VALUES (?, ?, ?)',
-            (user_id, name, description)
-        )
-        deck_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
-        return deck_id
+        with self.transaction(user_id=user_id) as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                'INSERT INTO decks (user_id, name, description) VALUES (?, ?, ?)',
+                (user_id, name, description)
+            )
+            events.publish('deck_created', user_id=user_id)
+            return cursor.lastrowid
 
     def get_user_decks(self, user_id: int) -> List[Dict]:
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT d.deck_id, d.name, d.description,
-                   COUNT(c.card_id) as card_count,
-                   d.created_at
-            FROM decks d
-            LEFT JOIN cards c ON d.deck_id = c.deck_id
-            WHERE d.user_id = ?
-            GROUP BY d.deck_id
-            ORDER BY d.updated_at DESC
-        ''', (user_id,))
-        decks = [dict(row) for row in cursor.fetchall()]
-        conn.close()
+        with self.connection(user_id=user_id) as conn:
+            cursor = conn.cursor()
+            cursor.execute(USER_DECKS_SQL, (user_id,))
+            return [dict(row) for row in cursor.fetchall()]
+
+    def get_user_deck_overview(self, user_id: int, deck_id: int = None) -> List[Dict]:
+        """Колоды пользователя со счётчиками прогресса одним запросом"""
+        deck_filter = 'AND d.deck_id = ?' if deck_id is not None else ''
+        params = (int(time.time()), user_id, user_id) + ((deck_id,) if deck_id is not None else ())
+        with self.connection(user_id=user_id) as conn:
+            cursor = conn.cursor()
+            cursor.execute(DECK_OVERVIEW_SQL.format(deck_filter=deck_filter), params)
+            decks = [dict(row) for row in cursor.fetchall()]
+        for deck in decks:
+            # Новые карточки и карточки без прогресса — к повторению
+            deck['review'] = deck['card_count'] - deck['mastered'] - deck['learning']
+            deck['progress'] = round(deck['mastered'] / deck['card_count'] * 100) if deck['card_count'] else 0
         return decks
 
     def delete_deck(self, deck_id: int, user_id: int) -> bool:
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('SELECT user_id FROM decks WHERE deck_id = ?', (deck_id,))
-        result = cursor.fetchone()
-        if not result or result['user_id'] != user_id:
-            conn.close()
-            return False
-        # Delete card_progress for all cards in deck
-        cursor.execute(
-            'DELETE FROM card_progress WHERE card_id IN (SELECT card_id FROM cards WHERE deck_id = ?)',
-            (deck_id,)
-        )
-        cursor.execute('DELETE FROM cards WHERE deck_id = ?', (deck_id,))
-        cursor.execute('DELETE FROM learning_stats WHERE deck_id = ?', (deck_id,))
-        cursor.execute('DELETE FROM decks WHERE deck_id = ?', (deck_id,))
-        conn.commit()
-        conn.close()
-        return True
+        with self.transaction(user_id=user_id) as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT user_id FROM decks WHERE deck_id = ?', (deck_id,))
+            result = cursor.fetchone()
+            if not result or result['user_id'] != user_id:
+                return False
+            # Delete card_progress for all cards in deck
+            cursor.execute(
+                'DELETE FROM card_progress WHERE card_id IN (SELECT card_id FROM cards WHERE deck_id = ?)',
+                (deck_id,)
+            )
+            # Колоду удаляем раньше карточек: триггерам счётчика нечего обновлять
+            cursor.execute('DELETE FROM decks WHERE deck_id = ?', (deck_id,))
+            cursor.execute('DELETE FROM cards WHERE deck_id = ?', (deck_id,))
+            cursor.execute('DELETE FROM learning_stats WHERE deck_id = ?', (deck_id,))
+            self.after_commit(lambda: self.distractors_cache.invalidate(deck_id))
+            return True
 
     def get_deck_info(self, deck_id: int) -> Optional[Dict]:
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT d.*, COUNT(c.card_id) as card_count
-            FROM decks d
-            LEFT JOIN cards c ON d.deck_id = c.deck_id
-            WHERE d.deck_id = ?
-            GROUP BY d.deck_id
-        ''', (deck_id,))
-        result = cursor.fetchone()
-        conn.close()
+        with self.connection(row_id=deck_id) as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT * FROM decks WHERE deck_id = ?', (deck_id,))
+            result = cursor.fetchone()
         return dict(result) if result else None
 
+    def check_deck_counters(self, repair: bool = False) -> List[Dict]:
+        """Найти колоды, где card_count разошёлся с реальным числом карточек"""
+        mismatches = []
+        for pool in self.pools:
+            with pool.transaction() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    SELECT d.deck_id, d.card_count as stored,
+                           (SELECT COUNT(*) FROM cards c WHERE c.deck_id = d.deck_id) as actual
+                    FROM decks d
+                    WHERE stored != actual
+                ''')
+                found = [dict(row) for row in cursor.fetchall()]
+                if repair and found:
+                    cursor.executemany(
+                        'UPDATE decks SET card_count = ? WHERE deck_id = ?',
+                        [(m['actual'], m['deck_id']) for m in found]
+                    )
+            mismatches.extend(found)
+        return mismatches
+
     # ===== КАРТОЧКИ =====
 
     def add_card(self, deck_id: int, question: str, answer: str) -> int:
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            'INSERT INTO cards (deck_id, question, answer) VALUES (?, ?, ?)',
-            (deck_id, question, answer)
-        )
-        card_id = cursor.lastrowid
-        cursor.execute('UPDATE decks SET updated_at = ? WHERE deck_id = ?', (datetime.now(), deck_id))
-        conn.commit()
-        conn.close()
-        return card_id
+        with self.transaction(row_id=deck_id) as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                'INSERT INTO cards (deck_id, question, answer) VALUES (?, ?, ?)',
+                (deck_id, question, answer)
+            )
+            card_id = cursor.lastrowid
+            self._update_distractors(deck_id, lambda index: index.add(card_id, answer))
+            return card_id
+
+    def add_cards_bulk(self, deck_id: int, pairs, user_id: int = None) -> List[int]:
+        """Добавить карточки одной транзакцией; с user_id — сразу и прогресс SRS"""
+        pairs = list(pairs)
+        if not pairs:
+            return []
+        with self.transaction(row_id=deck_id) as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT COALESCE(MAX(seq), 0) FROM sqlite_sequence WHERE name = 'cards'")
+            last_id = cursor.fetchone()[0]
+            cursor.executemany(
+                'INSERT INTO cards (deck_id, question, answer) VALUES (?, ?, ?)',
+                [(deck_id, question, answer) for question, answer in pairs]
+            )
+            # AUTOINCREMENT выдаёт id подряд, а BEGIN IMMEDIATE исключает чужие вставки
+            cursor.execute(
+                'SELECT card_id FROM cards WHERE deck_id = ? AND card_id > ? ORDER BY card_id',
+                (deck_id, last_id)
+            )
+            card_ids = [row['card_id'] for row in cursor.fetchall()]
+            self._update_distractors(deck_id, lambda index: [
+                index.add(card_id, answer) for card_id, (_, answer) in zip(card_ids, pairs)
+            ])
+            if user_id is not None:
+                cursor.execute('''
+                    INSERT OR IGNORE INTO card_progress
+                    (user_id, card_id, deck_id, level, next_review, correct_count, wrong_count)
+                    SELECT ?, card_id, deck_id, 0, ?, 0, 0
+                    FROM cards WHERE deck_id = ? AND card_id > ?
+                ''', (user_id, int(time.time()), deck_id, last_id))
+        return card_ids
 
     def get_deck_cards(self, deck_id: int) -> List[Dict]:
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('SELECT * FROM cards WHERE deck_id = ? ORDER BY card_id', (deck_id,))
-        cards = [dict(row) for row in cursor.fetchall()]
-        conn.close()
-        return cards
+        with self.connection(row_id=deck_id) as conn:
+            cursor = conn.cursor()
+            cursor.execute(DECK_CARDS_SQL, (deck_id,))
+            return [dict(row) for row in cursor.fetchall()]
 
     def get_card(self, card_id: int) -> Optional[Dict]:
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('SELECT * FROM cards WHERE card_id = ?', (card_id,))
-        result = cursor.fetchone()
-        conn.close()
-        return dict(result) if result else None
+        card = self.cards_cache.get(card_id)
+        if card is not None:
+            return card
+        with self.connection(row_id=card_id) as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT * FROM cards WHERE card_id = ?', (card_id,))
+            result = cursor.fetchone()
+        if not result:
+            return None
+        card = dict(result)
+        self.cards_cache.set(card_id, card)
+        return card
+
+    def cache_cards(self, cards: List[Dict]):
+        """Положить уже прочитанные карточки в кэш (без полей прогресса)"""
+        for card in cards:
+            self.cards_cache.set(card['card_id'], {col: card[col] for col in self.CARD_COLUMNS if col in card})
 
     def delete_card(self, card_id: int) -> bool:
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('DELETE FROM card_progress WHERE card_id = ?', (card_id,))
-        cursor.execute('DELETE FROM cards WHERE card_id = ?', (card_id,))
-        conn.commit()
-        conn.close()
+        with self.transaction(row_id=card_id) as conn:
+            cursor = conn.cursor()
+            cursor.execute(DELETE_CARD_PROGRESS_SQL, (card_id,))
+            cursor.execute('DELETE FROM cards WHERE card_id = ? RETURNING deck_id', (card_id,))
+            row = cursor.fetchone()
+            self.after_commit(lambda: self.cards_cache.invalidate(card_id))
+            if row:
+                self._update_distractors(row['deck_id'], lambda index: index.remove(card_id))
         return True
 
     def update_card(self, card_id: int, question: str = None, answer: str = None) -> bool:
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        if question:
-            cursor.execute('UPDATE cards SET question = ?, updated_at = ? WHERE card_id = ?',
-                           (question, datetime.now(), card_id))
-        if answer:
-            cursor.execute('UPDATE cards SET answer = ?, updated_at = ? WHERE card_id = ?',
-                           (answer, datetime.now(), card_id))
-        conn.commit()
-        conn.close()
+        with self.transaction(row_id=card_id) as conn:
+            cursor = conn.cursor()
+            self.after_commit(lambda: self.cards_cache.invalidate(card_id))
+            if question:
+                cursor.execute('UPDATE cards SET question = ?, updated_at = ? WHERE card_id = ?',
+                               (question, datetime.now(), card_id))
+            if answer:
+                cursor.execute('UPDATE cards SET answer = ?, updated_at = ? WHERE card_id = ? RETURNING deck_id',
+                               (answer, datetime.now(), card_id))
+                row = cursor.fetchone()
+                if row:
+                    self._update_distractors(row['deck_id'], lambda index: index.add(card_id, answer))
         return True
 
+    def get_distractor_index(self, deck_id: int) -> DistractorIndex:
+        """Индекс вариантов для теста; строится один раз на колоду"""
+        index = self.distractors_cache.get(deck_id)
+        if index is None:
+            with self.connection(row_id=deck_id) as conn:
+                rows = conn.execute('SELECT card_id, answer FROM cards WHERE deck_id = ?', (deck_id,))
+                index = DistractorIndex(rows)
+            self.distractors_cache.set(deck_id, index)
+        return index
+
+    def _update_distractors(self, deck_id: int, change):
+        """Применить изменение к построенному индексу после фиксации транзакции"""
+        def apply():
+            index = self.distractors_cache.get(deck_id)
+            if index is not None:
+                change(index)
+        self.after_commit(apply)
+
     # ===== СТАТИСТИКА =====
 
     def record_study_session(self, user_id: int, deck_id: int, correct: int, total: int):
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            'SELECT stat_id FROM learning_stats WHERE user_id = ? AND deck_id = ?',
-            (user_id, deck_id)
-        )
-        result = cursor.fetchone()
-        if result:
-            cursor.execute('''
-                UPDATE learning_stats
-                SET cards_studied = cards_studied + 1,
-                    correct_answers = correct_answers + ?,
-                    total_attempts = total_attempts + ?,
-                    last_studied = ?
-                WHERE user_id = ? AND deck_id = ?
-            ''', (correct, total, datetime.now(), user_id, deck_id))
-        else:
-            cursor.execute('''
-                INSERT INTO learning_stats
-                (user_id, deck_id, cards_studied, correct_answers, total_attempts, last_studied)
-                VALUES (?, ?, 1, ?, ?, ?)
-            ''', (user_id, deck_id, correct, total, datetime.now()))
-        conn.commit()
-        conn.close()
+        with self.transaction(user_id=user_id) as conn:
+            conn.execute(RECORD_STUDY_SQL, (user_id, deck_id, correct, total, datetime.now()))
+
+    USER_STATS_DEFAULTS = {
+        'mastered_cards': 0, 'learning_cards': 0, 'decks_count': 0,
+        'total_studied': 0, 'total_attempts': 0, 'total_correct': 0,
+        'last_studied': None, 'total_points': 0, 'current_streak': 0,
+        'max_streak': 0, 'study_days_streak': 0
+    }
 
     def get_user_stats(self, user_id: int) -> Dict:
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT
-                COUNT(DISTINCT deck_id) as decks_count,
-                COALESCE(SUM(cards_studied), 0) as total_studied,
-                COALESCE(SUM(correct_answers), 0) as total_correct,
-                COALESCE(SUM(total_attempts), 0) as total_attempts,
-                MAX(last_studied) as last_studied
-            FROM learning_stats
-            WHERE user_id = ?
-        ''', (user_id,))
-        result = cursor.fetchone()
-        conn.close()
-        if result:
-            stats = dict(result)
-            stats['accuracy'] = round(
-                (stats['total_correct'] / stats['total_attempts'] * 100)
-                if stats['total_attempts'] > 0 else 0, 1
-            )
-            # Also count decks created
-            conn2 = self.get_connection()
-            c2 = conn2.cursor()
-            c2.execute('SELECT COUNT(*) as cnt FROM decks WHERE user_id = ?', (user_id,))
-            r2 = c2.fetchone()
-            conn2.close()
-            stats['decks_count'] = r2['cnt'] if r2 else 0
-            return stats
-        return {
-            'decks_count': 0, 'total_studied': 0, 'total_correct': 0,
-            'total_attempts': 0, 'accuracy': 0, 'last_studied': None
-        }
+        """Сводная статистика: одна строка user_stats по первичному ключу"""
+        with self.connection(user_id=user_id) as conn:
+            result = conn.execute('SELECT * FROM user_stats WHERE user_id = ?', (user_id,)).fetchone()
+        stats = dict(result) if result else {'user_id': user_id, **self.USER_STATS_DEFAULTS}
+        stats['accuracy'] = round(
+            (stats['total_correct'] / stats['total_attempts'] * 100)
+            if stats['total_attempts'] > 0 else 0, 1
+        )
+        return stats
+
+    def rebuild_user_stats(self, user_id: int = None) -> int:
+        """Пересчитать user_stats из исходных таблиц (для всех или одного пользователя)"""
+        if user_id is None:
+            return sum(self._rebuild_user_stats(pool) for pool in self.pools)
+        return self._rebuild_user_stats(self._route(user_id=user_id), user_id)
+
+    @staticmethod
+    def _rebuild_user_stats(pool: ConnectionPool, user_id: int = None) -> int:
+        user_filter = 'WHERE u.user_id = ?' if user_id is not None else ''
+        params = (user_id,) if user_id is not None else ()
+        with pool.transaction() as conn:
+            if user_id is None:
+                conn.execute('DELETE FROM user_stats')
+            cursor = conn.execute(f'''
+                INSERT OR REPLACE INTO user_stats
+                SELECT u.user_id,
+                       (SELECT COUNT(*) FROM card_progress cp WHERE cp.user_id = u.user_id AND cp.level >= 4),
+                       (SELECT COUNT(*) FROM card_progress cp WHERE cp.user_id = u.user_id AND cp.level < 4),
+                       (SELECT COUNT(*) FROM decks d WHERE d.user_id = u.user_id),
+                       COALESCE((SELECT SUM(cards_studied) FROM learning_stats ls WHERE ls.user_id = u.user_id), 0),
+                       COALESCE((SELECT SUM(total_attempts) FROM learning_stats ls WHERE ls.user_id = u.user_id), 0),
+                       COALESCE((SELECT SUM(correct_answers) FROM learning_stats ls WHERE ls.user_id = u.user_id), 0),
+                       (SELECT MAX(last_studied) FROM learning_stats ls WHERE ls.user_id = u.user_id),
+                       COALESCE(g.total_points, 0)
+                           + COALESCE((SELECT SUM(points) FROM points_ledger pl WHERE pl.user_id = u.user_id), 0),
+                       COALESCE(g.current_streak, 0),
+                       COALESCE(g.max_streak, 0), COALESCE(g.study_days_streak, 0)
+                FROM (
+                    SELECT user_id FROM users UNION SELECT user_id FROM decks
+                    UNION SELECT user_id FROM card_progress UNION SELECT user_id FROM user_gamification
+                    UNION SELECT user_id FROM points_ledger
+                ) u
+                LEFT JOIN user_gamification g ON g.user_id = u.user_id
+                {user_filter}
+            ''', params)
+            return cursor.rowcount
 
     # ===== НАСТРОЙКИ =====
 
     def get_user_settings(self, user_id: int) -> Dict:
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('SELECT * FROM user_settings WHERE user_id = ?', (user_id,))
-        result = cursor.fetchone()
-        conn.close()
-        if result:
-            return dict(result)
-        # Create default settings
-        self._init_user_settings(user_id)
-        return {
-            'user_id': user_id,
-            'notifications': 1,
-            'difficulty': 'medium',
-            'cards_per_session': 20,
-            'reminder_time': '20:00'
-        }
+        settings = self._load_user_settings(user_id)
+        if settings is None:
+            # Create default settings
+            self._init_user_settings(user_id)
+            settings = {'user_id': user_id, **self.SETTINGS_DEFAULTS}
+            self.settings_cache.set(user_id, settings)
+        return dict(settings)
+
+    def peek_user_settings(self, user_id: int) -> Dict:
+        """Настройки без записи в базу: для потоков чтения AsyncDatabase"""
+        settings = self._load_user_settings(user_id)
+        if settings is None:
+            return {'user_id': user_id, **self.SETTINGS_DEFAULTS}
+        return dict(settings)
+
+    def _load_user_settings(self, user_id: int) -> Optional[Dict]:
+        settings = self.settings_cache.get(user_id)
+        if settings is not None:
+            return settings
+        with self.connection(user_id=user_id) as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT * FROM user_settings WHERE user_id = ?', (user_id,))
+            result = cursor.fetchone()
+        if not result:
+            return None
+        settings = dict(result)
+        self.settings_cache.set(user_id, settings)
+        return settings
 
     def _init_user_settings(self, user_id: int):
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            'INSERT OR IGNORE INTO user_settings (user_id) VALUES (?)',
-            (user_id,)
-        )
-        conn.commit()
-        conn.close()
+        with self.transaction(user_id=user_id) as conn:
+            conn.execute(
+                'INSERT OR IGNORE INTO user_settings (user_id) VALUES (?)',
+                (user_id,)
+            )
 
     def update_user_setting(self, user_id: int, key: str, value) -> bool:
-        allowed = {'notifications', 'difficulty', 'cards_per_session', 'reminder_time'}
-        if key not in allowed:
+        if key not in self.SETTINGS_DEFAULTS:
             return False
-        self._init_user_settings(user_id)
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            f'UPDATE user_settings SET {key} = ? WHERE user_id = ?',
-            (value, user_id)
-        )
-        conn.commit()
-        conn.close()
+        with self.transaction(user_id=user_id) as conn:
+            conn.execute(
+                f'''
+                INSERT INTO user_settings (user_id, {key}) VALUES (?, ?)
+                ON CONFLICT (user_id) DO UPDATE SET {key} = excluded.{key}
+                ''',
+                (user_id, value)
+            )
+            self.after_commit(lambda: self.settings_cache.update(user_id, **{key: value}))
         return True
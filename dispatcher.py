@@ -0,0 +1,99 @@
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Any, Dict, Hashable, Optional
+from telegram import Update
+from telegram.ext import Application
+
+# Лимит concurrent_updates для PTB: сколько обновлений может быть принято
+# в обработку одновременно, вместе с ждущими своего пользователя. Сколько
+# выполняется параллельно, задаёт max_concurrent, а не этот лимит
+PENDING_LIMIT = 4096
+
+
+class KeyedLocks:
+    """Отдельная FIFO-блокировка на ключ; записи без ожидающих удаляются"""
+
+    def __init__(self):
+        self._locks: Dict[Hashable, list] = {}  # ключ -> [asyncio.Lock, число владельцев и ожидающих]
+
+    def __len__(self):
+        return len(self._locks)
+
+    def waiting(self, key: Hashable) -> int:
+        entry = self._locks.get(key)
+        return entry[1] if entry else 0
+
+    @asynccontextmanager
+    async def hold(self, key: Hashable):
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._locks[key]
+
+
+class OrderedConcurrentApplication(Application):
+    """Application, который обрабатывает обновления разных пользователей параллельно.
+
+    Обновления одного пользователя (или чата, если пользователя нет)
+    выполняются строго по очереди в порядке поступления, поэтому состояние
+    ConversationHandler и context.user_data['study_session'] меняются так
+    же, как при последовательной обработке. Сначала берётся блокировка
+    пользователя, потом слот из max_concurrent: обновления, ждущие своего
+    пользователя, слотов не занимают и не задерживают остальных.
+
+    PTB создаёт задачу на каждое обновление и пропускает в process_update
+    не больше concurrent_updates; ждущие своего пользователя тоже
+    занимают это место. Поэтому concurrent_updates — не лимит
+    параллельности, а PENDING_LIMIT: остальных задержит только
+    пользователь, накопивший больше PENDING_LIMIT необработанных обновлений.
+
+    Подключение: Application.builder().application_class(
+    OrderedConcurrentApplication, kwargs={'max_concurrent': n})
+    .concurrent_updates(PENDING_LIMIT).
+    """
+
+    def __init__(self, *, max_concurrent: int, **kwargs):
+        super().__init__(**kwargs)
+        self.max_concurrent = max_concurrent
+        self._slots = asyncio.Semaphore(max_concurrent)
+        self._ordering = KeyedLocks()
+        self._active = 0
+        self.dispatch_metrics = {'processed': 0, 'max_active': 0, 'max_keys': 0, 'max_user_backlog': 0}
+
+    @staticmethod
+    def ordering_key(update: Any) -> Optional[Hashable]:
+        """Ключ, обновления с которым выполняются по очереди; None — без упорядочивания"""
+        if not isinstance(update, Update):
+            return None
+        if update.effective_user is not None:
+            return ('user', update.effective_user.id)
+        if update.effective_chat is not None:
+            return ('chat', update.effective_chat.id)
+        return None
+
+    async def process_update(self, update: object) -> None:
+        key = self.ordering_key(update)
+        if key is None:
+            return await self._process_in_slot(update)
+        async with self._ordering.hold(key):
+            metrics = self.dispatch_metrics
+            metrics['max_keys'] = max(metrics['max_keys'], len(self._ordering))
+            metrics['max_user_backlog'] = max(metrics['max_user_backlog'], self._ordering.waiting(key) - 1)
+            await self._process_in_slot(update)
+
+    async def _process_in_slot(self, update: object):
+        async with self._slots:
+            self._active += 1
+            self.dispatch_metrics['max_active'] = max(self.dispatch_metrics['max_active'], self._active)
+            try:
+                await super().process_update(update)
+            finally:
+                self._active -= 1
+                self.dispatch_metrics['processed'] += 1
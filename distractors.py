@@ -0,0 +1,103 @@
+import random
+import threading
+import unicodedata
+from typing import Dict, Iterable, List, Tuple
+
+# Сколько кандидатов из корзины сравниваем по n-граммам на один вопрос
+CANDIDATES_PER_QUESTION = 12
+
+
+def answer_script(text: str) -> str:
+    """Письменность ответа по первой букве: CYRILLIC, LATIN, ... или OTHER"""
+    for char in text:
+        if char.isalpha():
+            return unicodedata.name(char, 'OTHER').split(' ', 1)[0]
+    return 'OTHER'
+
+
+def length_band(text: str) -> int:
+    """Полосы длины растут вдвое: 1, 2-3, 4-7, 8-15, ..."""
+    return len(text).bit_length()
+
+
+def trigrams(text: str) -> frozenset:
+    text = f' {text.casefold()} '
+    return frozenset(text[i:i + 3] for i in range(len(text) - 2))
+
+
+class DistractorIndex:
+    """Индекс неправильных вариантов для теста по одной колоде.
+
+    Ответы разложены по корзинам (письменность, полоса длины); удаление —
+    перестановкой с последним элементом, поэтому все операции O(1).
+    """
+
+    def __init__(self, cards: Iterable[Dict] = ()):
+        self._answers: Dict[int, str] = {}
+        self._grams: Dict[int, frozenset] = {}
+        self._buckets: Dict[Tuple[str, int], List[int]] = {}
+        self._positions: Dict[int, Tuple[Tuple[str, int], int]] = {}
+        self._lock = threading.Lock()
+        for card in cards:
+            self._add(card['card_id'], card['answer'])
+
+    def __len__(self):
+        return len(self._answers)
+
+    def _add(self, card_id: int, answer: str):
+        key = (answer_script(answer), length_band(answer))
+        bucket = self._buckets.setdefault(key, [])
+        self._positions[card_id] = (key, len(bucket))
+        bucket.append(card_id)
+        self._answers[card_id] = answer
+        self._grams[card_id] = trigrams(answer)
+
+    def _remove(self, card_id: int):
+        if card_id not in self._positions:
+            return
+        key, index = self._positions.pop(card_id)
+        bucket = self._buckets[key]
+        last = bucket.pop()
+        if last != card_id:
+            bucket[index] = last
+            self._positions[last] = (key, index)
+        if not bucket:
+            del self._buckets[key]
+        del self._answers[card_id]
+        del self._grams[card_id]
+
+    def add(self, card_id: int, answer: str):
+        with self._lock:
+            self._remove(card_id)
+            self._add(card_id, answer)
+
+    def remove(self, card_id: int):
+        with self._lock:
+            self._remove(card_id)
+
+    def pick(self, card_id: int, answer: str, count: int = 3) -> List[str]:
+        """Правдоподобные неправильные ответы: та же письменность и похожая длина"""
+        script, band = answer_script(answer), length_band(answer)
+        grams = trigrams(answer)
+        taken = {answer.casefold()}
+        result = []
+        with self._lock:
+            # Своя полоса длины, затем соседние, затем любая корзина колоды
+            keys = [(script, band), (script, band - 1), (script, band + 1)]
+            keys += [key for key in self._buckets if key not in keys]
+            for key in keys:
+                bucket = self._buckets.get(key)
+                if not bucket:
+                    continue
+                sample = random.sample(bucket, min(CANDIDATES_PER_QUESTION, len(bucket)))
+                # Больше общих n-грамм — похожее на правильный ответ
+                sample.sort(key=lambda cid: len(grams & self._grams[cid]), reverse=True)
+                for other_id in sample:
+                    other = self._answers[other_id]
+                    if other_id == card_id or other.casefold() in taken:
+                        continue
+                    taken.add(other.casefold())
+                    result.append(other)
+                    if len(result) == count:
+                        return result
+        return result
@@ -0,0 +1,26 @@
+import logging
+from collections import defaultdict
+from typing import Callable, Dict, List
+
+logger = logging.getLogger(__name__)
+
+# Имя события -> подписчики. Подписчики вызываются синхронно в потоке
+# издателя, поэтому их записи попадают в ту же транзакцию.
+_subscribers: Dict[str, List[Callable]] = defaultdict(list)
+
+
+def subscribe(event: str, handler: Callable = None):
+    """Подписать handler на событие; можно использовать как декоратор"""
+    if handler is None:
+        return lambda func: subscribe(event, func)
+    _subscribers[event].append(handler)
+    return handler
+
+
+def publish(event: str, **payload):
+    """Оповестить подписчиков; ошибка подписчика не прерывает издателя"""
+    for handler in _subscribers.get(event, ()):
+        try:
+            handler(**payload)
+        except Exception:
+            logger.exception(f"Ошибка обработчика события {event}")
@@ -1,7 +1,25 @@
-from datetime import datetime, timedelta
+import asyncio
+import logging
+from datetime import datetime, time, timedelta
 from database import Database
+from cache import TTLCache
+from points import points_ledger
+import events
+
+logger = logging.getLogger(__name__)
 
 db = Database()
+# Строки user_gamification; обновляются после фиксации записей
+_rows = TTLCache.shared(f'{db.db_name}:gamification', maxsize=10000, ttl=600)
+# Серия меняется раз в день: user_id -> серия, уже учтённая за _counted_day
+_counted = {}
+_counted_day = None
+
+
+def _remember_streak(user_id, day, streak):
+    if day == _counted_day:
+        _counted[user_id] = streak
+
 
 class Gamification:
     """Игровые механики"""
@@ -25,132 +43,212 @@ class Gamification:
         'speed_demon': {'name': '⚡ Скорость', 'desc': 'Выучите 20 карточек за 5 минут', 'points': 100},
         'collector': {'name': '📚 Коллекционер', 'desc': 'Создайте 5 колод', 'points': 50}
     }
+    # Номер бита в user_gamification.achievements_mask; новые достижения — только в конец
+    ACHIEVEMENT_BITS = {key: bit for bit, key in enumerate(ACHIEVEMENTS)}
+    
+    @staticmethod
+    def _get_row(user_id):
+        """Строка user_gamification через кэш"""
+        row = _rows.get(user_id)
+        if row is None:
+            with db.connection(user_id=user_id) as conn:
+                result = conn.execute(
+                    'SELECT * FROM user_gamification WHERE user_id = ?', (user_id,)
+                ).fetchone()
+            if result is None:
+                return None
+            row = dict(result)
+            _rows.set(user_id, row)
+        return row
     
     @staticmethod
     def init_user(user_id):
         """Инициализировать пользователя"""
-        conn = db.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            INSERT OR IGNORE INTO user_gamification 
-            (user_id, total_points, current_streak, max_streak, last_study_date, study_days_streak)
-            VALUES (?, 0, 0, 0, NULL, 0)
-        ''', (user_id,))
-        
-        conn.commit()
-        conn.close()
+        if _rows.get(user_id) is not None:
+            return
+        with db.transaction(user_id=user_id) as conn:
+            conn.execute('''
+                INSERT OR IGNORE INTO user_gamification 
+                (user_id, total_points, current_streak, max_streak, last_study_date, study_days_streak)
+                VALUES (?, 0, 0, 0, NULL, 0)
+            ''', (user_id,))
+            row = dict(conn.execute(
+                'SELECT * FROM user_gamification WHERE user_id = ?', (user_id,)
+            ).fetchone())
+            db.after_commit(lambda: _rows.set(user_id, row))
     
     @staticmethod
-    def add_points(user_id, action):
-        """Добавить очки"""
-        points = Gamification.POINTS.get(action, 5)
-        
-        conn = db.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            UPDATE user_gamification 
-            SET total_points = total_points + ?
-            WHERE user_id = ?
-        ''', (points, user_id))
-        
-        conn.commit()
-        conn.close()
-        
+    def add_points(user_id, action, deck_id=None, day=None):
+        """Добавить очки; deck_id — колода, в которой они заработаны"""
+        return Gamification.award_points(user_id, Gamification.POINTS.get(action, 5), deck_id, day)
+    
+    @staticmethod
+    def award_points(user_id, points, deck_id=None, day=None):
+        """Начислить points очков записью в журнал очков; day — день начисления"""
+        points_ledger.add(user_id, points, deck_id, day)
         return points
     
     @staticmethod
-    def update_streak(user_id):
-        """Обновить серию"""
-        conn = db.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT last_study_date, current_streak, study_days_streak 
-            FROM user_gamification 
-            WHERE user_id = ?
-        ''', (user_id,))
-        
-        row = cursor.fetchone()
-        today = datetime.now().date()
-        
-        if row['last_study_date']:
-            last_date = datetime.strptime(row['last_study_date'], '%Y-%m-%d').date()
+    def next_streak(last_study_date, current_streak, today):
+        """Серия после занятия в день today"""
+        if last_study_date:
+            last_date = datetime.strptime(last_study_date, '%Y-%m-%d').date()
             days_diff = (today - last_date).days
             
             if days_diff == 0:  # Уже учились сегодня
-                current_streak = row['current_streak']
+                return current_streak
             elif days_diff == 1:  # Учились вчера - продолжаем серию
-                current_streak = row['current_streak'] + 1
-            else:  # Пропустили день - сброс
-                current_streak = 1
-        else:
-            current_streak = 1
-            study_days = 1
-        
-        # Обновляем рекорд
-        max_streak = max(row['max_streak'], current_streak)
-        study_days = row['study_days_streak'] + 1 if row['last_study_date'] != str(today) else row['study_days_streak']
-        
-        cursor.execute('''
-            UPDATE user_gamification 
-            SET current_streak = ?, max_streak = ?, last_study_date = ?, study_days_streak = ?
-            WHERE user_id = ?
-        ''', (current_streak, max_streak, str(today), study_days, user_id))
-        
-        conn.commit()
-        conn.close()
+                return current_streak + 1
+        # Пропустили день или первое занятие - сброс
+        return 1
+    
+    @staticmethod
+    def get_streak_state(user_id):
+        """Дата последнего занятия и текущая серия"""
+        row = Gamification._get_row(user_id)
+        if not row:
+            return None, 0
+        return row['last_study_date'], row['current_streak']
+    
+    @staticmethod
+    def update_streak(user_id, today=None):
+        """Обновить серию; повторные вызовы в тот же день ничего не читают и не пишут"""
+        global _counted, _counted_day
+        today = today or datetime.now().date()
+        day = str(today)
+        if day != _counted_day:
+            if _counted_day is not None and day < _counted_day:
+                # Запоздалое событие за прошлый день (повтор журнала) — без памятки
+                return Gamification._write_streak(user_id, today)
+            _counted, _counted_day = {}, day
+        streak = _counted.get(user_id)
+        if streak is None:
+            streak = Gamification._write_streak(user_id, today)
+        return streak
+    
+    @staticmethod
+    def _write_streak(user_id, today):
+        day = str(today)
+        with db.transaction(user_id=user_id) as conn:
+            row = Gamification._get_row(user_id)
+            if row is None:
+                return 0
+            if row['last_study_date'] and row['last_study_date'] >= day:
+                # Этот день уже учтён
+                current_streak = row['current_streak']
+                db.after_commit(lambda: _remember_streak(user_id, day, current_streak))
+                return current_streak
+            current_streak = Gamification.next_streak(row['last_study_date'], row['current_streak'], today)
+            
+            # Обновляем рекорд
+            max_streak = max(row['max_streak'], current_streak)
+            study_days = row['study_days_streak'] + 1
+            
+            conn.execute('''
+                UPDATE user_gamification 
+                SET current_streak = ?, max_streak = ?, last_study_date = ?, study_days_streak = ?
+                WHERE user_id = ?
+            ''', (current_streak, max_streak, day, study_days, user_id))
+            db.after_commit(lambda: _rows.update(
+                user_id, current_streak=current_streak, max_streak=max_streak,
+                last_study_date=day, study_days_streak=study_days
+            ))
+            db.after_commit(lambda: _remember_streak(user_id, day, current_streak))
+            events.publish('streak', user_id=user_id, streak=current_streak)
         
         return current_streak
     
+    @staticmethod
+    def reset_broken_streaks(today=None):
+        """Обнулить серии всех, кто не занимался вчера и сегодня; возвращает их число"""
+        today = today or datetime.now().date()
+        yesterday = str(today - timedelta(days=1))
+        reset = 0
+        for pool in db.pools:
+            with pool.transaction() as conn:
+                user_ids = [row[0] for row in conn.execute('''
+                    UPDATE user_gamification SET current_streak = 0
+                    WHERE current_streak > 0 AND (last_study_date IS NULL OR last_study_date < ?)
+                    RETURNING user_id
+                ''', (yesterday,))]
+            for user_id in user_ids:
+                _rows.update(user_id, current_streak=0)
+            reset += len(user_ids)
+        return reset
+    
     @staticmethod
     def check_achievements(user_id):
-        """Проверить достижения"""
-        # Логика проверки достижений
-        pass
+        """Полученные достижения пользователя (ключи ACHIEVEMENTS)"""
+        row = Gamification._get_row(user_id)
+        mask = row.get('achievements_mask', 0) if row else 0
+        return [key for key, bit in Gamification.ACHIEVEMENT_BITS.items() if mask >> bit & 1]
+    
+    @staticmethod
+    def unlock_achievements(user_id, keys):
+        """Записать новые достижения в битовую маску и начислить за них очки.
+
+        Возвращает новую маску или None, если у пользователя нет строки user_gamification.
+        """
+        mask = 0
+        for key in keys:
+            mask |= 1 << Gamification.ACHIEVEMENT_BITS[key]
+        with db.transaction(user_id=user_id) as conn:
+            row = conn.execute('''
+                UPDATE user_gamification SET achievements_mask = achievements_mask | ?
+                WHERE user_id = ?
+                RETURNING achievements_mask
+            ''', (mask, user_id)).fetchone()
+            if row is None:
+                return None
+            new_mask = row['achievements_mask']
+            db.after_commit(lambda: _rows.update(user_id, achievements_mask=new_mask))
+            points = sum(Gamification.ACHIEVEMENTS[key]['points'] for key in keys)
+            if points:
+                Gamification.award_points(user_id, points)
+        return new_mask
     
     @staticmethod
     def get_full_stats(user_id):
         """Полная статистика"""
-        conn = db.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT * FROM user_gamification WHERE user_id = ?
-        ''', (user_id,))
-        
-        row = cursor.fetchone()
-        conn.close()
-        
-        if not row:
+        if Gamification._get_row(user_id) is None:
             Gamification.init_user(user_id)
-            return {
-                'total_points': 0,
-                'current_streak': 0,
-                'max_streak': 0,
-                'study_days_streak': 0,
-                'mastered_cards': 0,
-                'learning_cards': 0
-            }
-        
-        # Получаем количество карточек
-        cursor = db.get_connection().cursor()
-        cursor.execute('''
-            SELECT 
-                COUNT(CASE WHEN level >= 4 THEN 1 END) as mastered,
-                COUNT(CASE WHEN level < 4 THEN 1 END) as learning
-            FROM card_progress 
-            WHERE user_id = ?
-        ''', (user_id,))
-        
-        cards = cursor.fetchone()
-        
+        stats = db.get_user_stats(user_id)
         return {
-            'total_points': row['total_points'],
-            'current_streak': row['current_streak'],
-            'max_streak': row['max_streak'],
-            'study_days_streak': row['study_days_streak'],
-            'mastered_cards': cards['mastered'] if cards else 0,
-            'learning_cards': cards['learning'] if cards else 0
+            'total_points': stats['total_points'],
+            'current_streak': stats['current_streak'],
+            'max_streak': stats['max_streak'],
+            'study_days_streak': stats['study_days_streak'],
+            'mastered_cards': stats['mastered_cards'],
+            'learning_cards': stats['learning_cards']
         }
+
+
+class StreakReset:
+    """Ночной сброс прерванных серий одним UPDATE на шард"""
+
+    def __init__(self):
+        self._task = None
+
+    async def start(self, adb):
+        # Ночи, пропущенные, пока бот не работал
+        await adb.run_write(Gamification.reset_broken_streaks)
+        self._task = asyncio.get_running_loop().create_task(self._reset_nightly(adb))
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    async def _reset_nightly(self, adb):
+        while True:
+            now = datetime.now()
+            midnight = datetime.combine(now.date() + timedelta(days=1), time.min)
+            await asyncio.sleep((midnight - now).total_seconds() + 1)
+            try:
+                reset = await adb.run_write(Gamification.reset_broken_streaks)
+                logger.info(f"🔥 Сброшено серий: {reset}")
+            except Exception:
+                logger.exception("Не удалось сбросить серии")
+
+
+streak_reset = StreakReset()
@@ -1,13 +1,28 @@
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes, ConversationHandler
 from database import Database
+from async_database import AsyncDatabase
+from answer_queue import AnswerQueue
+from callbacks import CallbackRouter
 from study_modes import StudyModes
-from spaced_repetition import SpacedRepetition
+from study_session import StudySession
+from leaderboard import leaderboards
+from points import points_ledger
+from achievements import achievements
 from gamification import Gamification
+import events
+from telegram.helpers import escape_markdown
 from datetime import datetime
+from functools import partial
+import asyncio
 import random
+import views
 
 db = Database()
+adb = AsyncDatabase(db)
+answer_queue = AnswerQueue(adb)
+# Обработчики нажатий inline-кнопок регистрируются декоратором @router.route
+router = CallbackRouter()
 
 # Состояния для ConversationHandler
 (
@@ -19,21 +34,14 @@ db = Database()
 # ==================== ГЛАВНОЕ МЕНЮ ====================
 
 def get_main_menu_keyboard():
-    keyboard = [
-        [InlineKeyboardButton("📚 Мои колоды", callback_data="my_decks"),
-         InlineKeyboardButton("➕ Создать колоду", callback_data="create_deck")],
-        [InlineKeyboardButton("📖 Общий словарь", callback_data="browse_dict"),
-         InlineKeyboardButton("📊 Статистика", callback_data="my_stats")],
-        [InlineKeyboardButton("⚙️ Настройки", callback_data="settings"),
-         InlineKeyboardButton("❓ Помощь", callback_data="help")]
-    ]
-    return InlineKeyboardMarkup(keyboard)
+    return views.MAIN_MENU_KEYBOARD
 
+@router.route('main_menu')
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     username = update.effective_user.username
-    db.add_user(user_id, username)
-    Gamification.init_user(user_id)
+    await adb.add_user(user_id, username)
+    await adb.game.init_user(user_id)
 
     welcome_text = (
         "🎓 *Добро пожаловать в QuizletBot!*\n\n"
@@ -52,32 +60,12 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.callback_query.edit_message_text(welcome_text, reply_markup=get_main_menu_keyboard(), parse_mode="Markdown")
     return MAIN_MENU
 
-async def main_menu_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    query = update.callback_query
-    await query.answer()
-    data = query.data
-
-    if data == "my_decks":
-        return await show_decks_menu(update, context)
-    elif data == "create_deck":
-        return await start_create_deck(update, context)
-    elif data == "browse_dict":
-        return await browse_dictionary(update, context)
-    elif data == "my_stats":
-        return await show_full_stats(update, context)
-    elif data == "settings":
-        return await show_settings(update, context)
-    elif data == "help":
-        return await show_help(update, context)
-    elif data == "main_menu":
-        return await start(update, context)
-    return MAIN_MENU
-
 # ==================== МОИ КОЛОДЫ ====================
 
+@router.route('my_decks')
 async def show_decks_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    decks = db.get_user_decks(user_id)
+    decks = await adb.get_user_deck_overview(user_id)
 
     if not decks:
         keyboard = [
@@ -95,7 +83,7 @@ async def show_decks_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     keyboard = []
 
     for deck in decks:
-        progress = SpacedRepetition.get_deck_progress(user_id, deck['deck_id'])
+        progress = deck['progress']
         bar = _progress_bar(progress)
         text += f"📖 *{deck['name']}* — {deck['card_count']} карт. {bar} {progress}%\n"
         keyboard.append([InlineKeyboardButton(f"📖 {deck['name']} ({deck['card_count']} карт.)", callback_data=f"deck_menu_{deck['deck_id']}")])
@@ -112,68 +100,26 @@ def _progress_bar(percent, length=5):
 
 # ==================== МЕНЮ КОЛОДЫ ====================
 
-async def deck_menu_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    query = update.callback_query
-    await query.answer()
-    data = query.data
-    user_id = query.from_user.id
-
-    if data.startswith("deck_menu_"):
-        deck_id = int(data.split("_")[2])
-        context.user_data['current_deck_id'] = deck_id
-        return await show_deck_menu(update, context, deck_id)
-
-    elif data.startswith("study_select_"):
-        return await select_study_mode(update, context)
-    elif data.startswith("study_flash_"):
-        return await start_flashcard_mode(update, context)
-    elif data.startswith("study_write_"):
-        return await start_write_mode(update, context)
-    elif data.startswith("study_quiz_"):
-        return await start_quiz_mode(update, context)
-    elif data.startswith("study_mixed_"):
-        return await start_mixed_mode(update, context)
-    elif data.startswith("add_cards_"):
-        return await start_add_cards(update, context)
-    elif data.startswith("list_cards_"):
-        return await list_cards(update, context)
-    elif data.startswith("delete_deck_"):
-        return await confirm_delete_deck(update, context)
-    elif data.startswith("confirm_delete_"):
-        return await do_delete_deck(update, context)
-
-    # Обработка действий в сессии обучения
-    elif data == "flip_card":
-        return await handle_flip_card(update, context)
-    elif data.startswith("rate_"):
-        return await handle_rate_card(update, context)
-    elif data == "next_card":
-        return await handle_next_card(update, context)
-    elif data == "retry_card":
-        return await handle_retry_card(update, context)
-    elif data == "show_hint":
-        return await handle_show_hint(update, context)
-    elif data == "stop_study":
-        return await stop_study_session(update, context)
-    elif data.startswith("quiz_"):
-        return await handle_quiz_answer(update, context)
-
-    return DECK_MENU
+@router.route('deck_menu', int)
+async def open_deck_menu(update: Update, context: ContextTypes.DEFAULT_TYPE, deck_id: int):
+    context.user_data['current_deck_id'] = deck_id
+    return await show_deck_menu(update, context, deck_id)
 
 async def show_deck_menu(update, context, deck_id):
     user_id = update.effective_user.id
-    deck_info = db.get_deck_info(deck_id)
-    if not deck_info:
+    overview = await adb.get_user_deck_overview(user_id, deck_id)
+    if not overview:
         await update.callback_query.edit_message_text("❌ Колода не найдена.")
         return MAIN_MENU
 
-    stats = SpacedRepetition.get_detailed_stats(user_id, deck_id)
+    stats = overview[0]
     bar = _progress_bar(stats['progress'])
 
     text = (
-        f"📖 *{deck_info['name']}*\n\n"
-        f"📝 Всего карточек: *{stats['total']}*\n"
-        f"✅ Выучено: {stats['mastered']} | 🔄 Изучается: {stats['learning']} | ⏰ Повторить: {stats['review']}\n"
+        f"📖 *{stats['name']}*\n\n"
+        f"📝 Всего карточек: *{stats['card_count']}*\n"
+        f"✅ Выучено: {stats['mastered']} | 🔄 Изучается: {stats['learning']} | 🌱 Новые: {stats['review']}\n"
+        f"⏰ Пора повторить: *{stats['due']}*\n"
         f"📊 Прогресс: {bar} {stats['progress']}%\n\n"
         f"*Выберите действие:*"
     )
@@ -195,9 +141,9 @@ async def show_deck_menu(update, context, deck_id):
 
 # ==================== РЕЖИМЫ ОБУЧЕНИЯ ====================
 
-async def select_study_mode(update: Update, context: ContextTypes.DEFAULT_TYPE):
+@router.route('study_select', int)
+async def select_study_mode(update: Update, context: ContextTypes.DEFAULT_TYPE, deck_id: int):
     query = update.callback_query
-    deck_id = int(query.data.split("_")[2])
     context.user_data['current_deck_id'] = deck_id
 
     text = (
@@ -220,242 +166,237 @@ async def select_study_mode(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode="Markdown")
     return STUDY_SELECT_MODE
 
+def _start_session(mode, deck_id, cards, sub_modes=None):
+    """Сессия хранит только id карточек; тексты — в общем кэше карточек"""
+    db.cache_cards(cards)
+    return StudySession.from_cards(mode, deck_id, cards, sub_modes)
+
+_prerender_tasks = set()
+
+def _prerender_next(session):
+    """Пока пользователь отвечает, собрать вид следующей карточки"""
+    upcoming = session.upcoming()
+    if upcoming is None:
+        return
+    card_id, mode = upcoming
+    task = asyncio.get_running_loop().create_task(_prerender(card_id, mode, session.number + 1, len(session)))
+    _prerender_tasks.add(task)
+    task.add_done_callback(_prerender_tasks.discard)
+
+async def _prerender(card_id, mode, number, total):
+    card = await adb.get_card(card_id)
+    if card is None:
+        return
+    if mode == 'quiz':
+        # Варианты выбираются при показе — заранее собираем только текст
+        views.quiz_text(card, number, total)
+    elif mode == 'write':
+        views.write_question(card, number, total)
+    else:
+        views.flashcard(card, number, total, False)
+        views.flashcard(card, number, total, True)
+
+async def _current_card(session):
+    """Текущая карточка сессии; удалённые после начала сессии пропускаются.
+
+    None — карточек до конца сессии не осталось.
+    """
+    while not session.finished:
+        card = await adb.get_card(session.card_id)
+        if card is not None:
+            return card
+        session.advance()
+    return None
+
+async def _show_current(query, context):
+    """Показать текущую карточку в её режиме; без карточек — завершить сессию"""
+    session = context.user_data['study_session']
+    card = await _current_card(session)
+    if card is None:
+        return await _finish_session(query, context, query.from_user.id)
+    sub_mode = session.sub_mode
+    if sub_mode == 'write':
+        await _ask_write_question(query, session, card)
+        return STUDY_WRITE
+    elif sub_mode == 'quiz':
+        await _show_quiz_question(query, session, card)
+        return STUDY_QUIZ
+    await _show_flashcard(query, session, card)
+    return STUDY_FLASHCARD
+
 # ---- Flashcard ----
 
-async def start_flashcard_mode(update: Update, context: ContextTypes.DEFAULT_TYPE):
+@router.route('study_flash', int)
+async def start_flashcard_mode(update: Update, context: ContextTypes.DEFAULT_TYPE, deck_id: int):
     query = update.callback_query
-    deck_id = int(query.data.split("_")[2])
     user_id = query.from_user.id
-    cards = StudyModes.prepare_cards(user_id, deck_id, mode='flashcard')
+    cards = await adb.run_read(StudyModes.prepare_cards, user_id, deck_id, mode='flashcard')
 
     if not cards:
         await query.edit_message_text("❌ В колоде нет карточек!")
         return DECK_MENU
 
-    context.user_data['study_session'] = {
-        'mode': 'flashcard',
-        'deck_id': deck_id,
-        'cards': cards,
-        'current': 0,
-        'correct': 0,
-        'wrong': 0,
-        'flipped': False
-    }
+    context.user_data['study_session'] = _start_session('flashcard', deck_id, cards)
 
-    await _show_flashcard(query, context)
-    return STUDY_FLASHCARD
+    return await _show_current(query, context)
 
-async def _show_flashcard(query, context):
-    session = context.user_data['study_session']
-    card = session['cards'][session['current']]
-    total = len(session['cards'])
-    current = session['current'] + 1
+async def _show_flashcard(query, session, card):
+    total = len(session)
+    current = session.number
 
-    if session.get('flipped'):
-        text = (
-            f"🎴 *Карточка {current}/{total}*\n\n"
-            f"❓ {card['question']}\n\n"
-            f"✅ *Ответ:* {card['answer']}\n\n"
-            f"*Оцените, как вы знали:*"
-        )
-        keyboard = [
-            [
-                InlineKeyboardButton("😞 Снова", callback_data="rate_again"),
-                InlineKeyboardButton("😐 Трудно", callback_data="rate_hard"),
-                InlineKeyboardButton("🙂 Хорошо", callback_data="rate_good"),
-                InlineKeyboardButton("😄 Легко", callback_data="rate_easy")
-            ],
-            [InlineKeyboardButton("⏹ Завершить", callback_data="stop_study")]
-        ]
-    else:
-        text = (
-            f"🎴 *Карточка {current}/{total}*\n\n"
-            f"❓ *{card['question']}*\n\n"
-            f"Подумайте и переверните карточку"
-        )
-        keyboard = [
-            [InlineKeyboardButton("🔄 Показать ответ", callback_data="flip_card")],
-            [InlineKeyboardButton("⏹ Завершить", callback_data="stop_study")]
-        ]
-
-    await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode="Markdown")
+    text, markup = views.flashcard(card, current, total, session.flipped)
+    await query.edit_message_text(text, reply_markup=markup, parse_mode="Markdown")
+    if not session.flipped:
+        _prerender_next(session)
 
+@router.route('flip_card')
 async def handle_flip_card(update: Update, context: ContextTypes.DEFAULT_TYPE):
     session = context.user_data.get('study_session')
     if not session:
         return MAIN_MENU
-    session['flipped'] = True
-    await _show_flashcard(update.callback_query, context)
-    return STUDY_FLASHCARD
+    session.flipped = True
+    return await _show_current(update.callback_query, context)
 
-async def handle_rate_card(update: Update, context: ContextTypes.DEFAULT_TYPE):
+@router.route('rate', str)
+async def handle_rate_card(update: Update, context: ContextTypes.DEFAULT_TYPE, rating: str):
     query = update.callback_query
     user_id = query.from_user.id
     session = context.user_data.get('study_session')
     if not session:
         return MAIN_MENU
 
-    rating = query.data.split("_")[1]  # again, hard, good, easy
-    card = session['cards'][session['current']]
+    card = await adb.get_card(session.card_id)
 
     result_map = {'again': 'again', 'hard': 'wrong', 'good': 'correct', 'easy': 'correct'}
-    SpacedRepetition.update_card_progress(user_id, card['card_id'], result_map[rating])
+
+    # Карточку удалили, пока её показывали, — оценку некуда записать
+    if card is None:
+        session.advance()
+        return await _show_current(query, context)
 
     if rating in ['good', 'easy']:
-        session['correct'] += 1
-        Gamification.add_points(user_id, 'correct_flashcard')
-        Gamification.update_streak(user_id)
+        session.correct += 1
+        await answer_queue.submit(user_id, card['card_id'], result_map[rating],
+                                  action='correct_flashcard', streak=True, deck_id=session.deck_id)
     else:
-        session['wrong'] += 1
+        session.wrong += 1
+        await answer_queue.submit(user_id, card['card_id'], result_map[rating])
 
-    session['current'] += 1
-    session['flipped'] = False
-
-    if session['current'] >= len(session['cards']):
-        return await _finish_session(query, context, user_id)
-
-    await _show_flashcard(query, context)
-    return STUDY_FLASHCARD
+    session.advance()
+    return await _show_current(query, context)
 
 # ---- Write ----
 
-async def start_write_mode(update: Update, context: ContextTypes.DEFAULT_TYPE):
+@router.route('study_write', int)
+async def start_write_mode(update: Update, context: ContextTypes.DEFAULT_TYPE, deck_id: int):
     query = update.callback_query
-    deck_id = int(query.data.split("_")[2])
     user_id = query.from_user.id
-    cards = StudyModes.prepare_cards(user_id, deck_id, mode='write')
+    cards = await adb.run_read(StudyModes.prepare_cards, user_id, deck_id, mode='write')
 
     if not cards:
         await query.edit_message_text("❌ В колоде нет карточек!")
         return DECK_MENU
 
-    context.user_data['study_session'] = {
-        'mode': 'write',
-        'deck_id': deck_id,
-        'cards': cards,
-        'current': 0,
-        'correct': 0,
-        'wrong': 0
-    }
+    context.user_data['study_session'] = _start_session('write', deck_id, cards)
 
-    await _ask_write_question(query, context)
-    return STUDY_WRITE
+    return await _show_current(query, context)
 
-async def _ask_write_question(query, context):
-    session = context.user_data['study_session']
-    card = session['cards'][session['current']]
-    total = len(session['cards'])
-    current = session['current'] + 1
+async def _ask_write_question(query, session, card):
+    total = len(session)
+    current = session.number
 
-    text = (
-        f"✍️ *Письменный режим {current}/{total}*\n\n"
-        f"❓ *{card['question']}*\n\n"
-        f"Напишите ответ:"
-    )
-    keyboard = [[InlineKeyboardButton("⏹ Завершить", callback_data="stop_study")]]
-    await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode="Markdown")
+    text, markup = views.write_question(card, current, total)
+    await query.edit_message_text(text, reply_markup=markup, parse_mode="Markdown")
+    _prerender_next(session)
 
 async def check_write_answer(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     user_answer = update.message.text.strip()
     session = context.user_data.get('study_session')
 
-    if not session or session.get('mode') != 'write':
+    if not session or session.sub_mode != 'write':
         await update.message.reply_text("Используйте меню:", reply_markup=get_main_menu_keyboard())
         return MAIN_MENU
 
-    card = session['cards'][session['current']]
+    card = await adb.get_card(session.card_id)
+    if card is None:
+        await update.message.reply_text("⚠️ Эту карточку удалили — переходим к следующей.",
+                                        reply_markup=views.NEXT_CARD_KEYBOARD)
+        return STUDY_WRITE
     correct_answer = card['answer'].strip()
-    similarity = StudyModes.calculate_similarity(user_answer, correct_answer)
+    result = StudyModes.check_answer(user_answer, correct_answer)
 
-    if similarity >= 0.85:
-        session['correct'] += 1
-        SpacedRepetition.update_card_progress(user_id, card['card_id'], 'correct')
-        points = Gamification.add_points(user_id, 'correct_write')
-        streak = Gamification.update_streak(user_id)
+    if result.grade == 'correct':
+        session.correct += 1
+        points, streak = await answer_queue.submit(user_id, card['card_id'], 'correct',
+                                                   action='correct_write', streak=True,
+                                                   deck_id=session.deck_id)
         text = (
             f"✅ *Правильно!* +{points} очков 🔥 Серия: {streak}\n\n"
             f"Ваш: _{user_answer}_\nПравильный: *{correct_answer}*"
         )
-        keyboard = [[InlineKeyboardButton("➡️ Далее", callback_data="next_card")]]
-    elif similarity >= 0.5:
+        markup = views.NEXT_CARD_KEYBOARD
+    elif result.grade == 'close':
         text = (
             f"⚠️ *Почти!*\n\n"
             f"Ваш: _{user_answer}_\nПравильный: *{correct_answer}*"
         )
-        keyboard = [
-            [InlineKeyboardButton("🔄 Повторить", callback_data="retry_card"),
-             InlineKeyboardButton("➡️ Далее", callback_data="next_card")]
-        ]
+        markup = views.RETRY_OR_NEXT_KEYBOARD
     else:
-        session['wrong'] += 1
-        SpacedRepetition.update_card_progress(user_id, card['card_id'], 'wrong')
+        session.wrong += 1
+        await answer_queue.submit(user_id, card['card_id'], 'wrong')
         hint = StudyModes.get_hint(correct_answer)
         text = (
             f"❌ *Неправильно*\n\n"
             f"Ваш: _{user_answer}_\nПравильный: *{correct_answer}*\n\nПодсказка: {hint}"
         )
-        keyboard = [
-            [InlineKeyboardButton("🔄 Повторить", callback_data="retry_card"),
-             InlineKeyboardButton("➡️ Далее", callback_data="next_card")]
-        ]
+        markup = views.RETRY_OR_NEXT_KEYBOARD
 
-    await update.message.reply_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode="Markdown")
+    await update.message.reply_text(text, reply_markup=markup, parse_mode="Markdown")
     return STUDY_WRITE
 
+@router.route('next_card')
 async def handle_next_card(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
-    user_id = query.from_user.id
     session = context.user_data.get('study_session')
     if not session:
         return MAIN_MENU
 
-    session['current'] += 1
-    if session['current'] >= len(session['cards']):
-        return await _finish_session(query, context, user_id)
-
-    mode = session['mode']
-    if mode == 'write':
-        await _ask_write_question(query, context)
-        return STUDY_WRITE
-    elif mode == 'quiz':
-        await _show_quiz_question(query, context)
-        return STUDY_QUIZ
-    elif mode == 'mixed':
-        return await _show_mixed_card(query, context)
-    else:
-        session['flipped'] = False
-        await _show_flashcard(query, context)
-        return STUDY_FLASHCARD
+    session.advance()
+    return await _show_current(query, context)
 
+@router.route('retry_card')
 async def handle_retry_card(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     session = context.user_data.get('study_session')
     if not session:
         return MAIN_MENU
-    mode = session.get('mode', 'write')
-    if mode == 'write':
-        await _ask_write_question(query, context)
-        return STUDY_WRITE
+    if session.sub_mode == 'write':
+        return await _show_current(query, context)
     return STUDY_FLASHCARD
 
+@router.route('show_hint', answer=False)
 async def handle_show_hint(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     session = context.user_data.get('study_session')
     if not session:
+        await query.answer()
         return MAIN_MENU
-    card = session['cards'][session['current']]
+    card = await adb.get_card(session.card_id)
+    if card is None:
+        await query.answer("Эту карточку удалили — нажмите «Далее»", show_alert=True)
+        return STUDY_WRITE
     hint = StudyModes.get_hint(card['answer'], 0.4)
     await query.answer(f"💡 Подсказка: {hint}", show_alert=True)
     return STUDY_WRITE
 
 # ---- Quiz ----
 
-async def start_quiz_mode(update: Update, context: ContextTypes.DEFAULT_TYPE):
+@router.route('study_quiz', int)
+async def start_quiz_mode(update: Update, context: ContextTypes.DEFAULT_TYPE, deck_id: int):
     query = update.callback_query
-    deck_id = int(query.data.split("_")[2])
     user_id = query.from_user.id
-    cards = StudyModes.prepare_cards(user_id, deck_id, mode='quiz')
+    cards = await adb.run_read(StudyModes.prepare_cards, user_id, deck_id, mode='quiz')
 
     if not cards:
         await query.edit_message_text("❌ В колоде нет карточек!")
@@ -465,138 +406,97 @@ async def start_quiz_mode(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await query.edit_message_text("❌ Для теста нужно минимум 2 карточки!")
         return DECK_MENU
 
-    context.user_data['study_session'] = {
-        'mode': 'quiz',
-        'deck_id': deck_id,
-        'cards': cards,
-        'current': 0,
-        'correct': 0,
-        'wrong': 0
-    }
-
-    await _show_quiz_question(query, context)
-    return STUDY_QUIZ
+    context.user_data['study_session'] = _start_session('quiz', deck_id, cards)
 
-async def _show_quiz_question(query, context):
-    session = context.user_data['study_session']
-    card = session['cards'][session['current']]
-    total = len(session['cards'])
-    current = session['current'] + 1
+    return await _show_current(query, context)
 
-    options = StudyModes.generate_quiz_options(card, session['cards'])
+async def _show_quiz_question(query, session, card):
+    total = len(session)
+    current = session.number
 
-    text = (
-        f"🎯 *Тест {current}/{total}*\n\n"
-        f"❓ *{card['question']}*\n\n"
-        f"Выберите правильный ответ:"
+    text, markup = await adb.run_read(
+        views.quiz_question, card, current, total, partial(StudyModes.generate_quiz_options, card)
     )
+    await query.edit_message_text(text, reply_markup=markup, parse_mode="Markdown")
+    _prerender_next(session)
 
-    keyboard = []
-    row = []
-    for i, option in enumerate(options):
-        callback = "quiz_correct" if option == card['answer'] else f"quiz_wrong_{i}"
-        # Truncate long options for button text
-        btn_text = option[:30] + "…" if len(option) > 30 else option
-        row.append(InlineKeyboardButton(btn_text, callback_data=callback))
-        if len(row) == 2:
-            keyboard.append(row)
-            row = []
-    if row:
-        keyboard.append(row)
-    keyboard.append([InlineKeyboardButton("⏹ Завершить", callback_data="stop_study")])
+@router.route('quiz_correct', answer=False)
+async def handle_quiz_correct(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    return await _handle_quiz_answer(update, context, True)
 
-    await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode="Markdown")
+@router.route('quiz_wrong', int, answer=False)
+async def handle_quiz_wrong(update: Update, context: ContextTypes.DEFAULT_TYPE, option: int):
+    return await _handle_quiz_answer(update, context, False)
 
-async def handle_quiz_answer(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def _handle_quiz_answer(update, context, correct):
     query = update.callback_query
     user_id = query.from_user.id
     session = context.user_data.get('study_session')
     if not session:
+        await query.answer()
         return MAIN_MENU
 
-    data = query.data
-    card = session['cards'][session['current']]
+    card = await adb.get_card(session.card_id)
 
-    if data == "quiz_correct":
-        session['correct'] += 1
-        SpacedRepetition.update_card_progress(user_id, card['card_id'], 'correct')
-        points = Gamification.add_points(user_id, 'correct_quiz')
+    if card is None:
+        await query.answer("Эту карточку удалили — переходим к следующей")
+    elif correct:
+        session.correct += 1
+        points, _ = await answer_queue.submit(user_id, card['card_id'], 'correct', action='correct_quiz',
+                                              deck_id=session.deck_id)
         await query.answer(f"✅ Правильно! +{points} очков", show_alert=False)
     else:
-        session['wrong'] += 1
-        SpacedRepetition.update_card_progress(user_id, card['card_id'], 'wrong')
+        session.wrong += 1
+        await answer_queue.submit(user_id, card['card_id'], 'wrong')
         await query.answer(f"❌ Неверно! Правильный: {card['answer']}", show_alert=True)
 
-    session['current'] += 1
-    if session['current'] >= len(session['cards']):
-        return await _finish_session(query, context, user_id)
-
-    await _show_quiz_question(query, context)
-    return STUDY_QUIZ
+    session.advance()
+    return await _show_current(query, context)
 
 # ---- Mixed ----
 
-async def start_mixed_mode(update: Update, context: ContextTypes.DEFAULT_TYPE):
+@router.route('study_mixed', int)
+async def start_mixed_mode(update: Update, context: ContextTypes.DEFAULT_TYPE, deck_id: int):
     query = update.callback_query
-    deck_id = int(query.data.split("_")[2])
     user_id = query.from_user.id
-    cards = StudyModes.prepare_cards(user_id, deck_id, mode='mixed')
+    cards = await adb.run_read(StudyModes.prepare_cards, user_id, deck_id, mode='mixed')
 
     if not cards:
         await query.edit_message_text("❌ В колоде нет карточек!")
         return DECK_MENU
 
     modes = ['flashcard', 'quiz'] if len(cards) < 2 else ['flashcard', 'write', 'quiz']
-    for card in cards:
-        card['sub_mode'] = random.choice(modes)
-
-    context.user_data['study_session'] = {
-        'mode': 'mixed',
-        'deck_id': deck_id,
-        'cards': cards,
-        'current': 0,
-        'correct': 0,
-        'wrong': 0,
-        'flipped': False
-    }
-
-    return await _show_mixed_card(query, context)
+    sub_modes = [random.choice(modes) for _ in cards]
+    context.user_data['study_session'] = _start_session('mixed', deck_id, cards, sub_modes)
 
-async def _show_mixed_card(query, context):
-    session = context.user_data['study_session']
-    card = session['cards'][session['current']]
-    sub_mode = card.get('sub_mode', 'flashcard')
-
-    if sub_mode == 'write':
-        await _ask_write_question(query, context)
-        return STUDY_WRITE
-    elif sub_mode == 'quiz':
-        await _show_quiz_question(query, context)
-        return STUDY_QUIZ
-    else:
-        session['flipped'] = False
-        await _show_flashcard(query, context)
-        return STUDY_FLASHCARD
+    return await _show_current(query, context)
 
 # ---- Session finish ----
 
 async def _finish_session(query, context, user_id):
-    session = context.user_data.get('study_session', {})
-    deck_id = session.get('deck_id')
-    correct = session.get('correct', 0)
-    wrong = session.get('wrong', 0)
+    session = context.user_data.get('study_session') or StudySession('flashcard', None, ())
+    deck_id = session.deck_id
+    correct = session.correct
+    wrong = session.wrong
     total = correct + wrong
 
     accuracy = round(correct / total * 100) if total > 0 else 0
 
-    db.record_study_session(user_id, deck_id, int(correct), total)
+    await answer_queue.flush()
+    await adb.record_study_session(user_id, deck_id, int(correct), total)
 
     if accuracy == 100 and total >= 3:
-        Gamification.add_points(user_id, 'perfect_session')
+        await adb.game.add_points(user_id, 'perfect_session', deck_id)
         bonus = "\n🏆 *Идеальная сессия!* +50 бонусных очков!"
     else:
         bonus = ""
 
+    await adb.run_write(events.publish, 'session_finished', user_id=user_id, mode=session.mode,
+                        correct=int(correct), total=total)
+    for key in achievements.pop_unseen(user_id):
+        achievement = Gamification.ACHIEVEMENTS[key]
+        bonus += f"\n🎖 *{achievement['name']}* — {achievement['desc']} (+{achievement['points']})"
+
     text = (
         f"🎉 *Сессия завершена!*\n\n"
         f"✅ Правильно: {int(correct)}/{total}\n"
@@ -615,6 +515,7 @@ async def _finish_session(query, context, user_id):
     await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode="Markdown")
     return MAIN_MENU
 
+@router.route('stop_study')
 async def stop_study_session(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     user_id = query.from_user.id
@@ -622,11 +523,11 @@ async def stop_study_session(update: Update, context: ContextTypes.DEFAULT_TYPE)
 
 # ==================== УПРАВЛЕНИЕ КАРТОЧКАМИ ====================
 
-async def start_add_cards(update: Update, context: ContextTypes.DEFAULT_TYPE):
+@router.route('add_cards', int)
+async def start_add_cards(update: Update, context: ContextTypes.DEFAULT_TYPE, deck_id: int):
     query = update.callback_query
-    deck_id = int(query.data.split("_")[2])
     context.user_data['new_deck_id'] = deck_id
-    deck_info = db.get_deck_info(deck_id)
+    deck_info = await adb.get_deck_info(deck_id)
     context.user_data['new_deck_name'] = deck_info['name'] if deck_info else 'Колода'
 
     text = (
@@ -643,15 +544,16 @@ async def start_add_cards(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode="Markdown")
     return ADD_CARD
 
-async def list_cards(update: Update, context: ContextTypes.DEFAULT_TYPE):
+@router.route('list_cards', int, answer=False)
+async def list_cards(update: Update, context: ContextTypes.DEFAULT_TYPE, deck_id: int):
     query = update.callback_query
-    deck_id = int(query.data.split("_")[2])
-    cards = db.get_deck_cards(deck_id)
-    deck_info = db.get_deck_info(deck_id)
+    cards = await adb.get_deck_cards(deck_id)
+    deck_info = await adb.get_deck_info(deck_id)
 
     if not cards:
         await query.answer("В колоде нет карточек", show_alert=True)
         return DECK_MENU
+    await query.answer()
 
     text = f"📋 *Карточки в «{deck_info['name']}»:*\n\n"
     for i, card in enumerate(cards[:30], 1):
@@ -666,10 +568,10 @@ async def list_cards(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode="Markdown")
     return DECK_MENU
 
-async def confirm_delete_deck(update: Update, context: ContextTypes.DEFAULT_TYPE):
+@router.route('delete_deck', int)
+async def confirm_delete_deck(update: Update, context: ContextTypes.DEFAULT_TYPE, deck_id: int):
     query = update.callback_query
-    deck_id = int(query.data.split("_")[2])
-    deck_info = db.get_deck_info(deck_id)
+    deck_info = await adb.get_deck_info(deck_id)
 
     text = (
         f"⚠️ *Удалить колоду «{deck_info['name']}»?*\n\n"
@@ -683,19 +585,19 @@ async def confirm_delete_deck(update: Update, context: ContextTypes.DEFAULT_TYPE
     await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode="Markdown")
     return DECK_MENU
 
-async def do_delete_deck(update: Update, context: ContextTypes.DEFAULT_TYPE):
+@router.route('confirm_delete', int, answer=False)
+async def do_delete_deck(update: Update, context: ContextTypes.DEFAULT_TYPE, deck_id: int):
     query = update.callback_query
     user_id = query.from_user.id
-    deck_id = int(query.data.split("_")[2])
-    db.delete_deck(deck_id, user_id)
+    await adb.delete_deck(deck_id, user_id)
     await query.answer("✅ Колода удалена", show_alert=False)
     return await show_decks_menu(update, context)
 
 # ==================== СОЗДАНИЕ КОЛОД ====================
 
+@router.route('create_deck')
 async def start_create_deck(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
-    await query.answer()
 
     text = (
         "➕ *Создание новой колоды*\n\n"
@@ -718,7 +620,7 @@ async def create_deck_name(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("❌ Название слишком длинное (макс. 50 символов):")
         return CREATE_DECK
 
-    deck_id = db.create_deck(user_id, deck_name)
+    deck_id = await adb.create_deck(user_id, deck_name)
     context.user_data['new_deck_id'] = deck_id
     context.user_data['new_deck_name'] = deck_name
 
@@ -762,9 +664,10 @@ async def add_card_to_deck(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("❌ Ошибка: колода не найдена. Начните заново.")
         return MAIN_MENU
 
-    card_id = db.add_card(deck_id, question, answer)
-    SpacedRepetition.init_card(user_id, card_id)
-    count = len(db.get_deck_cards(deck_id))
+    card_id = await adb.add_card(deck_id, question, answer)
+    await adb.srs.init_card(user_id, card_id)
+    deck_info = await adb.get_deck_info(deck_id)
+    count = deck_info['card_count'] if deck_info else 0
 
     reply = (
         f"✅ *Карточка добавлена!* ({count} всего)\n\n"
@@ -776,12 +679,13 @@ async def add_card_to_deck(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(reply, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode="Markdown")
     return ADD_CARD
 
+@router.route('finish_adding')
 async def finish_adding_cards(update: Update, context: ContextTypes.DEFAULT_TYPE):
     deck_id = context.user_data.get('new_deck_id')
     deck_name = context.user_data.get('new_deck_name', 'Колода')
 
     if deck_id:
-        deck_info = db.get_deck_info(deck_id)
+        deck_info = await adb.get_deck_info(deck_id)
         count = deck_info['card_count'] if deck_info else 0
     else:
         count = 0
@@ -807,6 +711,7 @@ async def finish_adding_cards(update: Update, context: ContextTypes.DEFAULT_TYPE
 
 # ==================== СТАТИСТИКА ====================
 
+@router.route('my_stats')
 async def show_full_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.callback_query:
         query = update.callback_query
@@ -814,28 +719,36 @@ async def show_full_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
     else:
         user_id = update.effective_user.id
 
-    stats = Gamification.get_full_stats(user_id)
-    study_stats = db.get_user_stats(user_id)
+    await answer_queue.flush()
+    await adb.run_write(points_ledger.flush)
+    stats = await adb.get_user_stats(user_id)
+    week_points = await adb.run_read(points_ledger.week_points, user_id)
 
-    last_studied = study_stats.get('last_studied')
+    last_studied = stats.get('last_studied')
     last_str = last_studied[:10] if last_studied else 'Никогда'
+    unlocked = await adb.game.check_achievements(user_id)
+    achievements_str = "\n".join(
+        f"• {Gamification.ACHIEVEMENTS[key]['name']}" for key in unlocked
+    ) or "• Пока нет"
 
     text = (
         f"📊 *Ваша статистика*\n\n"
         f"📚 *Прогресс:*\n"
-        f"• Колод создано: {study_stats['decks_count']}\n"
+        f"• Колод создано: {stats['decks_count']}\n"
         f"• Карточек выучено: {stats['mastered_cards']}\n"
         f"• На изучении: {stats['learning_cards']}\n"
-        f"• Точность: {study_stats['accuracy']}%\n\n"
+        f"• Точность: {stats['accuracy']}%\n\n"
         f"🎮 *Игровая статистика:*\n"
-        f"• ⭐ Очков: {stats['total_points']}\n"
+        f"• ⭐ Очков: {stats['total_points']} (за неделю: {week_points})\n"
         f"• 🔥 Текущая серия: {stats['current_streak']} дней\n"
         f"• 🏆 Рекорд серии: {stats['max_streak']} дней\n"
         f"• 📅 Всего дней обучения: {stats['study_days_streak']}\n\n"
         f"📈 *Активность:*\n"
-        f"• Всего попыток: {study_stats['total_attempts']}\n"
-        f"• Правильных: {study_stats['total_correct']}\n"
-        f"• Последнее занятие: {last_str}"
+        f"• Всего попыток: {stats['total_attempts']}\n"
+        f"• Правильных: {stats['total_correct']}\n"
+        f"• Последнее занятие: {last_str}\n\n"
+        f"🎖 *Достижения ({len(unlocked)}/{len(Gamification.ACHIEVEMENTS)}):*\n"
+        f"{achievements_str}"
     )
 
     keyboard = [[InlineKeyboardButton("⬅️ Назад", callback_data="main_menu")]]
@@ -846,6 +759,39 @@ async def show_full_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode="Markdown")
     return MAIN_MENU
 
+async def show_leaderboard(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id
+    # Очки из очереди ответов и бонусы должны попасть в таблицу до показа
+    await answer_queue.flush()
+    await adb.run_write(points_ledger.flush)
+    total = leaderboards.total
+    weekly = leaderboards.weekly_board()
+    top_total = total.top(10)
+    top_weekly = weekly.top(5)
+    around = total.around(user_id, 2)
+    names = await adb.get_usernames({uid for _, uid, _ in top_total + top_weekly + around})
+
+    def line(place, uid, points):
+        name = escape_markdown(names.get(uid) or f"id{uid}")
+        me = " ← вы" if uid == user_id else ""
+        return f"{place}. {name} — {points}{me}\n"
+
+    text = "🏆 *Таблица лидеров*\n\n*За всё время:*\n"
+    text += "".join(line(*row) for row in top_total) or "Пока никого\n"
+    text += "\n📅 *За неделю:*\n"
+    text += "".join(line(*row) for row in top_weekly) or "Пока никого\n"
+
+    rank = total.rank(user_id)
+    if rank is None:
+        text += "\nЗарабатывайте очки, чтобы попасть в таблицу!"
+    elif rank > 10:
+        text += f"\n📍 *Ваше место: {rank} из {len(total)}*\n"
+        text += "".join(line(*row) for row in around)
+
+    keyboard = [[InlineKeyboardButton("⬅️ Назад", callback_data="main_menu")]]
+    await update.message.reply_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode="Markdown")
+    return MAIN_MENU
+
 # ==================== СЛОВАРЬ ====================
 
 COLLECTIONS = {
@@ -958,12 +904,10 @@ COLLECTIONS = {
     }
 }
 
+@router.route('browse_dict')
 async def browse_dictionary(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
 
-    if query.data.startswith("import_collection_"):
-        return await import_collection(update, context)
-
     text = (
         "📖 *Общий словарь*\n\n"
         "Выберите готовую коллекцию:"
@@ -978,20 +922,19 @@ async def browse_dictionary(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode="Markdown")
     return BROWSE_DICTIONARY
 
-async def import_collection(update: Update, context: ContextTypes.DEFAULT_TYPE):
+@router.route('import_collection', str, answer=False)
+async def import_collection(update: Update, context: ContextTypes.DEFAULT_TYPE, col_key: str):
     query = update.callback_query
     user_id = query.from_user.id
-    col_key = query.data.replace("import_collection_", "")
 
     collection = COLLECTIONS.get(col_key)
     if not collection:
         await query.answer("❌ Коллекция не найдена", show_alert=True)
         return BROWSE_DICTIONARY
+    await query.answer()
 
-    deck_id = db.create_deck(user_id, collection['name'])
-    for question, answer in collection['cards']:
-        card_id = db.add_card(deck_id, question, answer)
-        SpacedRepetition.init_card(user_id, card_id)
+    deck_id = await adb.create_deck(user_id, collection['name'])
+    await adb.add_cards_bulk(deck_id, collection['cards'], user_id=user_id)
 
     text = (
         f"✅ *Коллекция импортирована!*\n\n"
@@ -1009,10 +952,11 @@ async def import_collection(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 # ==================== НАСТРОЙКИ ====================
 
+@router.route('settings')
 async def show_settings(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     user_id = query.from_user.id
-    settings = db.get_user_settings(user_id)
+    settings = await adb.get_user_settings(user_id)
 
     notif = "✅ Вкл" if settings.get('notifications', 1) else "❌ Выкл"
     diff = settings.get('difficulty', 'medium')
@@ -1029,48 +973,51 @@ async def show_settings(update: Update, context: ContextTypes.DEFAULT_TYPE):
         f"• ⏰ Напоминание: {reminder}"
     )
 
-    keyboard = [
-        [InlineKeyboardButton(f"🔔 Уведомления: {notif}", callback_data="toggle_notifications")],
-        [InlineKeyboardButton("🎯 Сложность", callback_data="change_difficulty")],
-        [InlineKeyboardButton("➖ Меньше карточек", callback_data="cards_less"),
-         InlineKeyboardButton("➕ Больше карточек", callback_data="cards_more")],
-        [InlineKeyboardButton("⬅️ Назад", callback_data="main_menu")]
-    ]
-
-    await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode="Markdown")
+    markup = views.settings_keyboard(settings.get('notifications', 1))
+    await query.edit_message_text(text, reply_markup=markup, parse_mode="Markdown")
     return SETTINGS
 
-async def handle_settings_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+@router.route('toggle_notifications', answer=False)
+async def toggle_notifications(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    user_id = query.from_user.id
+    settings = await adb.get_user_settings(user_id)
+    new_val = 0 if settings.get('notifications', 1) else 1
+    await adb.update_user_setting(user_id, 'notifications', new_val)
+    await query.answer("✅ Уведомления обновлены")
+    return await show_settings(update, context)
+
+@router.route('change_difficulty', answer=False)
+async def change_difficulty(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     user_id = query.from_user.id
-    data = query.data
-
-    if data == "toggle_notifications":
-        settings = db.get_user_settings(user_id)
-        new_val = 0 if settings.get('notifications', 1) else 1
-        db.update_user_setting(user_id, 'notifications', new_val)
-        await query.answer("✅ Уведомления обновлены")
-    elif data == "change_difficulty":
-        settings = db.get_user_settings(user_id)
-        diff_cycle = {'easy': 'medium', 'medium': 'hard', 'hard': 'easy'}
-        new_diff = diff_cycle.get(settings.get('difficulty', 'medium'), 'medium')
-        db.update_user_setting(user_id, 'difficulty', new_diff)
-        await query.answer(f"Сложность изменена")
-    elif data == "cards_less":
-        settings = db.get_user_settings(user_id)
-        new_val = max(5, settings.get('cards_per_session', 20) - 5)
-        db.update_user_setting(user_id, 'cards_per_session', new_val)
-        await query.answer(f"Карточек за сессию: {new_val}")
-    elif data == "cards_more":
-        settings = db.get_user_settings(user_id)
-        new_val = min(50, settings.get('cards_per_session', 20) + 5)
-        db.update_user_setting(user_id, 'cards_per_session', new_val)
-        await query.answer(f"Карточек за сессию: {new_val}")
+    settings = await adb.get_user_settings(user_id)
+    diff_cycle = {'easy': 'medium', 'medium': 'hard', 'hard': 'easy'}
+    new_diff = diff_cycle.get(settings.get('difficulty', 'medium'), 'medium')
+    await adb.update_user_setting(user_id, 'difficulty', new_diff)
+    await query.answer(f"Сложность изменена")
+    return await show_settings(update, context)
 
+async def _change_cards_per_session(update, context, step):
+    query = update.callback_query
+    user_id = query.from_user.id
+    settings = await adb.get_user_settings(user_id)
+    new_val = min(50, max(5, settings.get('cards_per_session', 20) + step))
+    await adb.update_user_setting(user_id, 'cards_per_session', new_val)
+    await query.answer(f"Карточек за сессию: {new_val}")
     return await show_settings(update, context)
 
+@router.route('cards_less', answer=False)
+async def cards_less(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    return await _change_cards_per_session(update, context, -5)
+
+@router.route('cards_more', answer=False)
+async def cards_more(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    return await _change_cards_per_session(update, context, 5)
+
 # ==================== ПОМОЩЬ ====================
 
+@router.route('help')
 async def show_help(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.callback_query:
         send = update.callback_query.edit_message_text
@@ -1082,6 +1029,7 @@ async def show_help(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "*Команды:*\n"
         "/start — Главное меню\n"
         "/stats — Статистика\n"
+        "/top — Таблица лидеров\n"
         "/help — Эта помощь\n"
         "/cancel — Отмена действия\n\n"
         "*Режимы обучения:*\n"
@@ -1112,7 +1060,7 @@ async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     session = context.user_data.get('study_session')
-    if session and session.get('mode') == 'write':
+    if session and not session.finished and session.sub_mode == 'write':
         return await check_write_answer(update, context)
 
     await update.message.reply_text(
@@ -0,0 +1,257 @@
+import logging
+import random
+import threading
+from datetime import date, timedelta
+from typing import Dict, List, Optional, Tuple
+from database import Database
+
+logger = logging.getLogger(__name__)
+
+db = Database()
+
+# Очки каждого пользователя шарда начиная с дня
+WEEK_SCORES_SQL = '''
+    SELECT user_id, SUM(points) FROM (
+        SELECT user_id, points FROM points_daily WHERE day >= ?
+        UNION ALL
+        SELECT user_id, points FROM points_ledger WHERE day >= ?
+    )
+    GROUP BY user_id
+'''
+
+
+class _Node:
+    __slots__ = ('key', 'next', 'width')
+
+    def __init__(self, key, levels: int):
+        self.key = key
+        self.next = [None] * levels
+        self.width = [1] * levels
+
+
+class RankedSet:
+    """Индексируемый skip list: вставка, удаление, ранг и доступ по номеру за O(log n).
+
+    width[level] у узла — сколько элементов нижнего уровня перескакивает
+    ссылка next[level]; сумма ширин по пути поиска и есть позиция.
+    """
+
+    MAX_LEVELS = 24  # хватает на ~16 млн элементов
+
+    def __init__(self):
+        self._tail = _Node(None, 0)
+        self._head = _Node(None, self.MAX_LEVELS)
+        self._head.next = [self._tail] * self.MAX_LEVELS
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def _path(self, key) -> Tuple[List[_Node], List[int]]:
+        """Последний узел с ключом < key на каждом уровне и его позиция"""
+        chain = [None] * self.MAX_LEVELS
+        positions = [0] * self.MAX_LEVELS
+        node, position = self._head, 0
+        for level in reversed(range(self.MAX_LEVELS)):
+            while node.next[level] is not self._tail and node.next[level].key < key:
+                position += node.width[level]
+                node = node.next[level]
+            chain[level] = node
+            positions[level] = position
+        return chain, positions
+
+    def add(self, key):
+        chain, positions = self._path(key)
+        levels = 1
+        while levels < self.MAX_LEVELS and random.random() < 0.5:
+            levels += 1
+        new = _Node(key, levels)
+        # Позиция нового элемента (с 1) на нижнем уровне
+        position = positions[0] + 1
+        for level in range(levels):
+            prev = chain[level]
+            new.next[level] = prev.next[level]
+            prev.next[level] = new
+            new.width[level] = prev.width[level] - (position - positions[level]) + 1
+            prev.width[level] = position - positions[level]
+        for level in range(levels, self.MAX_LEVELS):
+            chain[level].width[level] += 1
+        self._size += 1
+
+    def remove(self, key):
+        chain, _ = self._path(key)
+        target = chain[0].next[0]
+        if target is self._tail or target.key != key:
+            raise KeyError(key)
+        for level in range(len(target.next)):
+            prev = chain[level]
+            prev.width[level] += target.width[level] - 1
+            prev.next[level] = target.next[level]
+        for level in range(len(target.next), self.MAX_LEVELS):
+            chain[level].width[level] -= 1
+        self._size -= 1
+
+    def index(self, key) -> int:
+        """Позиция ключа с 0"""
+        chain, positions = self._path(key)
+        if chain[0].next[0] is self._tail or chain[0].next[0].key != key:
+            raise KeyError(key)
+        return positions[0]
+
+    def __getitem__(self, index: int):
+        if not 0 <= index < self._size:
+            raise IndexError(index)
+        node, remaining = self._head, index + 1
+        for level in reversed(range(self.MAX_LEVELS)):
+            while node.next[level] is not self._tail and node.width[level] <= remaining:
+                remaining -= node.width[level]
+                node = node.next[level]
+        return node.key
+
+    def slice(self, start: int, stop: int) -> list:
+        """Ключи с позиции start по stop - 1: поиск начала за O(log n), дальше по списку"""
+        start, stop = max(start, 0), min(stop, self._size)
+        if start >= stop:
+            return []
+        node, remaining = self._head, start + 1
+        for level in reversed(range(self.MAX_LEVELS)):
+            while node.next[level] is not self._tail and node.width[level] <= remaining:
+                remaining -= node.width[level]
+                node = node.next[level]
+        keys = []
+        while len(keys) < stop - start:
+            keys.append(node.key)
+            node = node.next[0]
+        return keys
+
+
+class Leaderboard:
+    """Таблица лидеров: очки пользователей и их порядок"""
+
+    def __init__(self, scores: Dict[int, int] = None):
+        self._scores: Dict[int, int] = {}
+        self._ranked = RankedSet()
+        self._lock = threading.Lock()
+        self.version = 0
+        for user_id, score in (scores or {}).items():
+            self._set(user_id, score)
+
+    def __len__(self):
+        return len(self._scores)
+
+    def _set(self, user_id: int, score: int):
+        old = self._scores.pop(user_id, None)
+        if old is not None:
+            self._ranked.remove((-old, user_id))
+        # Пользователи без очков в таблицу не попадают
+        if score > 0:
+            self._scores[user_id] = score
+            self._ranked.add((-score, user_id))
+        self.version += 1
+
+    def set(self, user_id: int, score: int):
+        with self._lock:
+            if self._scores.get(user_id, 0) != score:
+                self._set(user_id, score)
+
+    def add(self, user_id: int, points: int):
+        with self._lock:
+            self._set(user_id, self._scores.get(user_id, 0) + points)
+
+    def score(self, user_id: int) -> int:
+        return self._scores.get(user_id, 0)
+
+    def top(self, n: int = 10) -> List[Tuple[int, int, int]]:
+        """[(место, user_id, очки)] первых n"""
+        with self._lock:
+            return [(i + 1, user_id, -neg) for i, (neg, user_id) in enumerate(self._ranked.slice(0, n))]
+
+    def rank(self, user_id: int) -> Optional[int]:
+        """Место пользователя с 1; None, если очков нет"""
+        with self._lock:
+            score = self._scores.get(user_id)
+            if score is None:
+                return None
+            return self._ranked.index((-score, user_id)) + 1
+
+    def around(self, user_id: int, radius: int = 2) -> List[Tuple[int, int, int]]:
+        """Соседи пользователя по таблице: radius мест выше и ниже"""
+        with self._lock:
+            score = self._scores.get(user_id)
+            if score is None:
+                return []
+            index = self._ranked.index((-score, user_id))
+            start = max(index - radius, 0)
+            keys = self._ranked.slice(start, index + radius + 1)
+            return [(start + i + 1, uid, -neg) for i, (neg, uid) in enumerate(keys)]
+
+    def scores(self) -> Dict[int, int]:
+        with self._lock:
+            return dict(self._scores)
+
+
+def week_key(day: date) -> str:
+    year, week, _ = day.isocalendar()
+    return f'{year}-W{week:02d}'
+
+
+class Leaderboards:
+    """Общая и недельная таблицы лидеров.
+
+    Обе собираются при старте из базы, поэтому начисления перед падением
+    не теряются: общая — из user_stats.total_points, недельная — из
+    points_daily и points_ledger. Дальше общая хранит total_points как
+    есть и сама исправляется при следующем начислении, недельная копит
+    начисления.
+    """
+
+    def __init__(self, database: Database):
+        self.db = database
+        self.total = Leaderboard()
+        self.week = week_key(date.today())
+        self.weekly = Leaderboard()
+
+    def weekly_board(self, today: date = None) -> Leaderboard:
+        week = week_key(today or date.today())
+        if week != self.week:
+            self.week, self.weekly = week, Leaderboard()
+        return self.weekly
+
+    def record(self, user_id: int, total_points: int, points: int):
+        """Учесть начисление очков (вызывается после фиксации транзакции)"""
+        self.total.set(user_id, total_points)
+        self.weekly_board().add(user_id, points)
+
+    # ===== ЗАГРУЗКА =====
+
+    def _total_scores(self) -> Dict[int, int]:
+        """Текущие итоги: user_stats.total_points растёт триггером на вставку в журнал очков"""
+        scores = {}
+        for pool in self.db.pools:
+            with pool.connection() as conn:
+                scores.update(conn.execute(
+                    'SELECT user_id, total_points FROM user_stats WHERE total_points > 0'
+                ).fetchall())
+        return scores
+
+    def _week_scores(self, today: date) -> Dict[int, int]:
+        """Очки за неделю с понедельника: суточные итоги плюс ещё не свёрнутый журнал"""
+        monday = str(today - timedelta(days=today.weekday()))
+        scores = {}
+        for pool in self.db.pools:
+            with pool.connection() as conn:
+                scores.update(conn.execute(WEEK_SCORES_SQL, (monday, monday)).fetchall())
+        return scores
+
+    def load(self, today: date = None):
+        """Собрать таблицы из базы"""
+        today = today or date.today()
+        self.total = Leaderboard(self._total_scores())
+        self.week, self.weekly = week_key(today), Leaderboard(self._week_scores(today))
+        logger.info(f"🏆 Таблица лидеров: {len(self.total)} пользователей")
+
+    async def start(self, adb):
+        await adb.run_read(self.load)
+
+
+leaderboards = Leaderboards(db)
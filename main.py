@@ -1,8 +1,9 @@
+import asyncio
 import logging
 import os
 from telegram import Update
 from telegram.ext import (
-    Application, CommandHandler, MessageHandler, CallbackQueryHandler,
+    Application, CommandHandler, MessageHandler,
     ConversationHandler, filters
 )
 
@@ -13,73 +14,124 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 from database import Database
+from cache import TTLCache
+from persistence import SQLitePersistence
+from send_queue import SendQueue
+from webhook import WebhookSettings, run_webhook
+from dispatcher import PENDING_LIMIT, OrderedConcurrentApplication
+from views import render_stats
+from leaderboard import leaderboards
+from points import points_ledger
+from gamification import streak_reset
 from handlers import (
-    start, main_menu_callback, deck_menu_callback, message_handler,
-    select_study_mode, start_flashcard_mode, start_write_mode,
-    start_quiz_mode, start_mixed_mode, start_create_deck, create_deck_name,
-    add_card_to_deck, finish_adding_cards, show_full_stats, browse_dictionary,
-    show_settings, handle_settings_callback, show_help, cancel,
+    adb, answer_queue, router, start, show_leaderboard, message_handler,
+    create_deck_name, add_card_to_deck, show_full_stats, show_help, cancel,
     MAIN_MENU, CREATE_DECK, ADD_CARD, STUDY_SELECT_MODE, STUDY_WRITE,
     STUDY_QUIZ, STUDY_FLASHCARD, DECK_MENU, SETTINGS, BROWSE_DICTIONARY
 )
 
 
+async def post_init(application: Application):
+    application.persistence.attach(application)
+    # Таблицы лидеров загружаются до повтора журнала: он начисляет очки
+    await leaderboards.start(adb)
+    await points_ledger.start(adb)
+    await answer_queue.start()
+    # После повтора журнала: он мог продлить серии
+    await streak_reset.start(adb)
+
+
+async def post_shutdown(application: Application):
+    await streak_reset.stop()
+    await answer_queue.stop()
+    await points_ledger.stop(adb)
+    logger.info(f"📦 Кэши: {TTLCache.all_stats()}")
+    logger.info(f"🖼 Отрисовка: {render_stats()}")
+    logger.info(f"📨 Исходящие: {application.bot.rate_limiter.stats()}")
+    if isinstance(application, OrderedConcurrentApplication):
+        logger.info(f"⚡ Обработка обновлений: {application.dispatch_metrics}")
+    # Дожидаемся записей, уже отправленных в поток-писатель
+    adb.shutdown()
+
+
 def main():
     TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
     if not TOKEN:
         logger.error("❌ TELEGRAM_BOT_TOKEN не установлен!")
         return
 
+    # BOT_MODE=webhook — обновления приходят на встроенный HTTP-сервер
+    mode = os.getenv("BOT_MODE", "polling").lower()
+    webhook_settings = WebhookSettings.from_env() if mode == "webhook" else None
+
     db = Database()
-    db.init_db()
+    schema_version = db.init_db()
+    logger.info(f"🗄 Схема базы данных: версия {schema_version}")
 
-    application = Application.builder().token(TOKEN).build()
+    builder = (
+        Application.builder()
+        .token(TOKEN)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .persistence(SQLitePersistence(adb))
+        # Все запросы к Bot API идут через очередь с лимитами Telegram
+        .rate_limiter(SendQueue())
+    )
+    if webhook_settings:
+        builder = builder.updater(None)
+    # CONCURRENT_UPDATES=N: до N обновлений разных пользователей параллельно,
+    # обновления одного пользователя — по очереди
+    concurrency = int(os.getenv("CONCURRENT_UPDATES", "1"))
+    if concurrency > 1:
+        builder = (
+            builder
+            .application_class(OrderedConcurrentApplication, kwargs={'max_concurrent': concurrency})
+            .concurrent_updates(PENDING_LIMIT)
+        )
+        logger.info(f"⚡ Параллельная обработка: до {concurrency} обновлений")
+    application = builder.build()
 
     conv_handler = ConversationHandler(
         entry_points=[
             CommandHandler("start", start),
         ],
+        # Нажатия кнопок разбирает router; в состоянии допускаются перечисленные действия
         states={
             MAIN_MENU: [
-                CallbackQueryHandler(main_menu_callback, pattern="^(my_decks|create_deck|browse_dict|my_stats|settings|help|main_menu)$"),
-                CallbackQueryHandler(deck_menu_callback, pattern="^deck_menu_"),
+                router.handler('my_decks', 'create_deck', 'browse_dict', 'my_stats', 'settings', 'help',
+                               'main_menu', 'deck_menu'),
             ],
             DECK_MENU: [
-                CallbackQueryHandler(deck_menu_callback),
+                router.handler(),
             ],
             STUDY_SELECT_MODE: [
-                CallbackQueryHandler(select_study_mode, pattern="^study_select_"),
-                CallbackQueryHandler(start_flashcard_mode, pattern="^study_flash_"),
-                CallbackQueryHandler(start_write_mode, pattern="^study_write_"),
-                CallbackQueryHandler(start_quiz_mode, pattern="^study_quiz_"),
-                CallbackQueryHandler(start_mixed_mode, pattern="^study_mixed_"),
-                CallbackQueryHandler(deck_menu_callback, pattern="^deck_menu_"),
+                router.handler('study_select', 'study_flash', 'study_write', 'study_quiz', 'study_mixed',
+                               'deck_menu'),
             ],
             STUDY_FLASHCARD: [
-                CallbackQueryHandler(deck_menu_callback),
+                router.handler(),
             ],
             STUDY_WRITE: [
                 MessageHandler(filters.TEXT & ~filters.COMMAND, message_handler),
-                CallbackQueryHandler(deck_menu_callback),
+                router.handler(),
             ],
             STUDY_QUIZ: [
-                CallbackQueryHandler(deck_menu_callback),
+                router.handler(),
             ],
             CREATE_DECK: [
                 MessageHandler(filters.TEXT & ~filters.COMMAND, create_deck_name),
-                CallbackQueryHandler(main_menu_callback, pattern="^main_menu$"),
+                router.handler('main_menu'),
             ],
             ADD_CARD: [
                 MessageHandler(filters.TEXT & ~filters.COMMAND, add_card_to_deck),
-                CallbackQueryHandler(finish_adding_cards, pattern="^finish_adding$"),
+                router.handler('finish_adding'),
             ],
             SETTINGS: [
-                CallbackQueryHandler(handle_settings_callback, pattern="^(toggle_|change_|cards_)"),
-                CallbackQueryHandler(main_menu_callback, pattern="^main_menu$"),
+                router.handler('toggle_notifications', 'change_difficulty', 'cards_less', 'cards_more',
+                               'main_menu'),
             ],
             BROWSE_DICTIONARY: [
-                CallbackQueryHandler(browse_dictionary, pattern="^import_collection_"),
-                CallbackQueryHandler(main_menu_callback, pattern="^main_menu$"),
+                router.handler('import_collection', 'main_menu'),
             ],
         },
         fallbacks=[
@@ -88,11 +140,18 @@ def main():
             MessageHandler(filters.TEXT & ~filters.COMMAND, message_handler),
         ],
         allow_reentry=True,
+        name="main",
+        persistent=True,
     )
 
     application.add_handler(conv_handler)
     application.add_handler(CommandHandler("help", show_help))
     application.add_handler(CommandHandler("stats", show_full_stats))
+    application.add_handler(CommandHandler("top", show_leaderboard))
+
+    if webhook_settings:
+        asyncio.run(run_webhook(application, webhook_settings))
+        return
 
     logger.info("🚀 Бот запущен!")
     application.run_polling(drop_pending_updates=True)
@@ -0,0 +1,96 @@
+"""Служебные команды для базы бота.
+
+Запуск: python maintenance.py <команда> [--db quizlet_bot.db] [--shards N]
+
+Без --shards число шардов берётся из DATABASE_SHARDS, как у бота.
+"""
+import argparse
+import os
+import sys
+from database import Database
+from points import PointsLedger, KEEP_DAYS
+
+
+def check_counters(db: Database, args) -> int:
+    """Сверить decks.card_count с таблицей cards"""
+    mismatches = db.check_deck_counters(repair=args.repair)
+    if not mismatches:
+        print("✅ Счётчики карточек согласованы")
+        return 0
+    for m in mismatches:
+        print(f"Колода {m['deck_id']}: сохранено {m['stored']}, фактически {m['actual']}")
+    if args.repair:
+        print(f"🔧 Исправлено колод: {len(mismatches)}")
+        return 0
+    print(f"⚠️ Расхождений: {len(mismatches)}. Запустите с --repair для исправления")
+    return 1
+
+
+def rebuild_stats(db: Database, args) -> int:
+    """Пересчитать сводную статистику user_stats"""
+    count = db.rebuild_user_stats(args.user)
+    print(f"✅ Пересчитано строк user_stats: {count}")
+    return 0
+
+
+def compact_points(db: Database, args) -> int:
+    """Свернуть старые записи журнала очков в суточные итоги"""
+    folded = PointsLedger(db).compact(keep_days=args.keep_days)
+    print(f"✅ Свёрнуто записей журнала очков: {folded}")
+    return 0
+
+
+def split_shards(db: Database, args) -> int:
+    """Разнести однофайловую базу по шардам"""
+    sharded = Database(args.db, shards=args.shards)
+    report = sharded.split_into_shards(args.db, clear_source=not args.keep_source)
+    for counts in report:
+        details = ', '.join(f"{table}: {n}" for table, n in counts.items() if table != 'shard')
+        print(f"Шард {counts['shard']}: {details}")
+    print(f"✅ Готово. Запускайте бота с DATABASE_SHARDS={args.shards}")
+    return 0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Обслуживание базы QuizletBot")
+    parser.add_argument('--db', default='quizlet_bot.db', help="файл базы данных")
+    parser.add_argument('--shards', dest='db_shards', type=int,
+                        help="число шардов базы (по умолчанию DATABASE_SHARDS)")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    cmd = commands.add_parser('check-counters', help="проверить счётчики карточек в колодах")
+    cmd.add_argument('--repair', action='store_true', help="исправить найденные расхождения")
+    cmd.set_defaults(func=check_counters)
+
+    cmd = commands.add_parser('rebuild-stats', help="пересчитать user_stats из исходных таблиц")
+    cmd.add_argument('--user', type=int, help="только для одного пользователя")
+    cmd.set_defaults(func=rebuild_stats)
+
+    cmd = commands.add_parser('compact-points', help="свернуть старые записи журнала очков")
+    cmd.add_argument('--keep-days', type=int, default=KEEP_DAYS, help="сколько последних дней оставить построчно")
+    cmd.set_defaults(func=compact_points)
+
+    cmd = commands.add_parser('split-shards', help="разнести однофайловую базу по шардам")
+    cmd.add_argument('--shards', type=int, required=True, help="число шардов")
+    cmd.add_argument('--keep-source', action='store_true',
+                     help="не удалять пользовательские данные из исходного файла")
+    cmd.set_defaults(func=split_shards)
+
+    args = parser.parse_args(argv)
+    if args.command == 'split-shards':
+        # Источник — однофайловая база
+        db = Database(args.db, shards=1)
+    else:
+        db = Database(args.db, shards=args.db_shards)
+        # Иначе команда молча обработала бы опустевший после split-shards файл
+        first_shard = Database(args.db, shards=2).shard_paths()[0]
+        if db.shards == 1 and os.path.exists(first_shard):
+            print(f"⚠️ Найден шард {first_shard}, а команда запущена для одного файла. "
+                  f"Укажите --shards или DATABASE_SHARDS")
+            return 2
+    db.init_db()
+    return args.func(db, args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,432 @@
+import sqlite3
+
+# Версия схемы хранится в PRAGMA user_version. Миграции применяются по
+# порядку, каждая в своей транзакции вместе с обновлением версии, поэтому
+# существующая база обновляется на месте и прерванный запуск безопасен.
+
+
+def _v1_base_schema(cursor: sqlite3.Cursor):
+    """Исходные таблицы"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS decks (
+            deck_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            description TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users(user_id)
+        )
+    ''')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS cards (
+            card_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            deck_id INTEGER NOT NULL,
+            question TEXT NOT NULL,
+            answer TEXT NOT NULL,
+            difficulty INTEGER DEFAULT 1,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (deck_id) REFERENCES decks(deck_id)
+        )
+    ''')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS learning_stats (
+            stat_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            deck_id INTEGER NOT NULL,
+            cards_studied INTEGER DEFAULT 0,
+            correct_answers INTEGER DEFAULT 0,
+            total_attempts INTEGER DEFAULT 0,
+            last_studied TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users(user_id),
+            FOREIGN KEY (deck_id) REFERENCES decks(deck_id)
+        )
+    ''')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS card_progress (
+            progress_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            card_id INTEGER NOT NULL,
+            level INTEGER DEFAULT 0,
+            next_review TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            correct_count INTEGER DEFAULT 0,
+            wrong_count INTEGER DEFAULT 0,
+            UNIQUE(user_id, card_id),
+            FOREIGN KEY (user_id) REFERENCES users(user_id),
+            FOREIGN KEY (card_id) REFERENCES cards(card_id)
+        )
+    ''')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS user_gamification (
+            user_id INTEGER PRIMARY KEY,
+            total_points INTEGER DEFAULT 0,
+            current_streak INTEGER DEFAULT 0,
+            max_streak INTEGER DEFAULT 0,
+            last_study_date DATE,
+            study_days_streak INTEGER DEFAULT 0,
+            achievements TEXT,
+            FOREIGN KEY (user_id) REFERENCES users(user_id)
+        )
+    ''')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS user_settings (
+            user_id INTEGER PRIMARY KEY,
+            notifications INTEGER DEFAULT 1,
+            difficulty TEXT DEFAULT 'medium',
+            cards_per_session INTEGER DEFAULT 20,
+            reminder_time TEXT DEFAULT '20:00',
+            FOREIGN KEY (user_id) REFERENCES users(user_id)
+        )
+    ''')
+
+
+def _v2_hot_query_indexes(cursor: sqlite3.Cursor):
+    """Индексы для частых запросов"""
+    # Склеиваем дубликаты learning_stats перед уникальным индексом
+    cursor.execute('''
+        UPDATE learning_stats
+        SET cards_studied = (SELECT SUM(x.cards_studied) FROM learning_stats x
+                             WHERE x.user_id = learning_stats.user_id AND x.deck_id = learning_stats.deck_id),
+            correct_answers = (SELECT SUM(x.correct_answers) FROM learning_stats x
+                               WHERE x.user_id = learning_stats.user_id AND x.deck_id = learning_stats.deck_id),
+            total_attempts = (SELECT SUM(x.total_attempts) FROM learning_stats x
+                              WHERE x.user_id = learning_stats.user_id AND x.deck_id = learning_stats.deck_id),
+            last_studied = (SELECT MAX(x.last_studied) FROM learning_stats x
+                            WHERE x.user_id = learning_stats.user_id AND x.deck_id = learning_stats.deck_id)
+        WHERE stat_id IN (
+            SELECT MIN(stat_id) FROM learning_stats
+            GROUP BY user_id, deck_id HAVING COUNT(*) > 1
+        )
+    ''')
+    cursor.execute('''
+        DELETE FROM learning_stats
+        WHERE stat_id NOT IN (SELECT MIN(stat_id) FROM learning_stats GROUP BY user_id, deck_id)
+    ''')
+
+    # get_deck_cards, JOIN cards по колоде
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_cards_deck ON cards(deck_id, card_id)')
+    # get_user_decks: фильтр по пользователю и сортировка по updated_at
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_decks_user ON decks(user_id, updated_at)')
+    # get_due_cards: card_progress.user_id + next_review
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_progress_due ON card_progress(user_id, next_review)')
+    # delete_card / delete_deck удаляют прогресс по card_id
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_progress_card ON card_progress(card_id)')
+    cursor.execute(
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_learning_stats_user_deck ON learning_stats(user_id, deck_id)'
+    )
+
+
+def _v3_answer_queue_state(cursor: sqlite3.Cursor):
+    """Последнее применённое событие очереди ответов"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS answer_queue_state (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            last_seq INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+
+
+def _v4_deck_counters(cursor: sqlite3.Cursor):
+    """Счётчик карточек в decks, поддерживаемый триггерами"""
+    cursor.execute('ALTER TABLE decks ADD COLUMN card_count INTEGER NOT NULL DEFAULT 0')
+    cursor.execute('''
+        UPDATE decks SET card_count = (SELECT COUNT(*) FROM cards WHERE cards.deck_id = decks.deck_id)
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_cards_insert_count AFTER INSERT ON cards
+        BEGIN
+            UPDATE decks
+            SET card_count = card_count + 1,
+                updated_at = strftime('%Y-%m-%d %H:%M:%f', 'now')
+            WHERE deck_id = NEW.deck_id;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_cards_delete_count AFTER DELETE ON cards
+        BEGIN
+            UPDATE decks
+            SET card_count = card_count - 1,
+                updated_at = strftime('%Y-%m-%d %H:%M:%f', 'now')
+            WHERE deck_id = OLD.deck_id;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_cards_move_count AFTER UPDATE OF deck_id ON cards
+        WHEN OLD.deck_id != NEW.deck_id
+        BEGIN
+            UPDATE decks SET card_count = card_count - 1 WHERE deck_id = OLD.deck_id;
+            UPDATE decks
+            SET card_count = card_count + 1,
+                updated_at = strftime('%Y-%m-%d %H:%M:%f', 'now')
+            WHERE deck_id = NEW.deck_id;
+        END
+    ''')
+
+
+def _user_stats_trigger(cursor, name, event, user_expr, body, when=''):
+    """Триггер, который гарантирует строку user_stats и обновляет её"""
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS {name} {event}
+        {when}
+        BEGIN
+            -- не INSERT OR IGNORE: ON CONFLICT внешнего upsert переопределил бы его
+            INSERT INTO user_stats (user_id)
+            SELECT {user_expr} WHERE NOT EXISTS (SELECT 1 FROM user_stats WHERE user_id = {user_expr});
+            UPDATE user_stats SET {body} WHERE user_id = {user_expr};
+        END
+    ''')
+
+
+def _v5_user_stats(cursor: sqlite3.Cursor):
+    """Сводная статистика пользователя, обновляемая триггерами"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS user_stats (
+            user_id INTEGER PRIMARY KEY,
+            mastered_cards INTEGER NOT NULL DEFAULT 0,
+            learning_cards INTEGER NOT NULL DEFAULT 0,
+            decks_count INTEGER NOT NULL DEFAULT 0,
+            total_studied INTEGER NOT NULL DEFAULT 0,
+            total_attempts INTEGER NOT NULL DEFAULT 0,
+            total_correct INTEGER NOT NULL DEFAULT 0,
+            last_studied TIMESTAMP,
+            total_points INTEGER NOT NULL DEFAULT 0,
+            current_streak INTEGER NOT NULL DEFAULT 0,
+            max_streak INTEGER NOT NULL DEFAULT 0,
+            study_days_streak INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+
+    # Прогресс карточек: выучено (level >= 4) / на изучении
+    _user_stats_trigger(
+        cursor, 'trg_user_stats_progress_insert', 'AFTER INSERT ON card_progress', 'NEW.user_id',
+        'mastered_cards = mastered_cards + (NEW.level >= 4), '
+        'learning_cards = learning_cards + (NEW.level < 4)'
+    )
+    _user_stats_trigger(
+        cursor, 'trg_user_stats_progress_update', 'AFTER UPDATE OF level ON card_progress', 'NEW.user_id',
+        'mastered_cards = mastered_cards + (NEW.level >= 4) - (OLD.level >= 4), '
+        'learning_cards = learning_cards + (NEW.level < 4) - (OLD.level < 4)',
+        when='WHEN (NEW.level >= 4) != (OLD.level >= 4)'
+    )
+    _user_stats_trigger(
+        cursor, 'trg_user_stats_progress_delete', 'AFTER DELETE ON card_progress', 'OLD.user_id',
+        'mastered_cards = mastered_cards - (OLD.level >= 4), '
+        'learning_cards = learning_cards - (OLD.level < 4)'
+    )
+
+    # Колоды
+    _user_stats_trigger(
+        cursor, 'trg_user_stats_deck_insert', 'AFTER INSERT ON decks', 'NEW.user_id',
+        'decks_count = decks_count + 1'
+    )
+    _user_stats_trigger(
+        cursor, 'trg_user_stats_deck_delete', 'AFTER DELETE ON decks', 'OLD.user_id',
+        'decks_count = decks_count - 1'
+    )
+
+    # Попытки и ответы
+    _user_stats_trigger(
+        cursor, 'trg_user_stats_learning_insert', 'AFTER INSERT ON learning_stats', 'NEW.user_id',
+        'total_studied = total_studied + NEW.cards_studied, '
+        'total_attempts = total_attempts + NEW.total_attempts, '
+        'total_correct = total_correct + NEW.correct_answers, '
+        'last_studied = NEW.last_studied'
+    )
+    _user_stats_trigger(
+        cursor, 'trg_user_stats_learning_update', 'AFTER UPDATE ON learning_stats', 'NEW.user_id',
+        'total_studied = total_studied + NEW.cards_studied - OLD.cards_studied, '
+        'total_attempts = total_attempts + NEW.total_attempts - OLD.total_attempts, '
+        'total_correct = total_correct + NEW.correct_answers - OLD.correct_answers, '
+        'last_studied = NEW.last_studied'
+    )
+    _user_stats_trigger(
+        cursor, 'trg_user_stats_learning_delete', 'AFTER DELETE ON learning_stats', 'OLD.user_id',
+        'total_studied = total_studied - OLD.cards_studied, '
+        'total_attempts = total_attempts - OLD.total_attempts, '
+        'total_correct = total_correct - OLD.correct_answers, '
+        'last_studied = (SELECT MAX(last_studied) FROM learning_stats WHERE user_id = OLD.user_id)'
+    )
+
+    # Очки и серии
+    _user_stats_trigger(
+        cursor, 'trg_user_stats_points', 'AFTER UPDATE OF total_points ON user_gamification', 'NEW.user_id',
+        'total_points = total_points + NEW.total_points - OLD.total_points'
+    )
+    _user_stats_trigger(
+        cursor, 'trg_user_stats_streak',
+        'AFTER UPDATE OF current_streak, max_streak, study_days_streak ON user_gamification', 'NEW.user_id',
+        'current_streak = NEW.current_streak, max_streak = NEW.max_streak, '
+        'study_days_streak = NEW.study_days_streak'
+    )
+
+    # Заполняем по существующим данным
+    cursor.execute('''
+        INSERT OR REPLACE INTO user_stats
+        SELECT u.user_id,
+               (SELECT COUNT(*) FROM card_progress cp WHERE cp.user_id = u.user_id AND cp.level >= 4),
+               (SELECT COUNT(*) FROM card_progress cp WHERE cp.user_id = u.user_id AND cp.level < 4),
+               (SELECT COUNT(*) FROM decks d WHERE d.user_id = u.user_id),
+               COALESCE((SELECT SUM(cards_studied) FROM learning_stats ls WHERE ls.user_id = u.user_id), 0),
+               COALESCE((SELECT SUM(total_attempts) FROM learning_stats ls WHERE ls.user_id = u.user_id), 0),
+               COALESCE((SELECT SUM(correct_answers) FROM learning_stats ls WHERE ls.user_id = u.user_id), 0),
+               (SELECT MAX(last_studied) FROM learning_stats ls WHERE ls.user_id = u.user_id),
+               COALESCE(g.total_points, 0), COALESCE(g.current_streak, 0),
+               COALESCE(g.max_streak, 0), COALESCE(g.study_days_streak, 0)
+        FROM (
+            SELECT user_id FROM users UNION SELECT user_id FROM decks
+            UNION SELECT user_id FROM card_progress UNION SELECT user_id FROM user_gamification
+        ) u
+        LEFT JOIN user_gamification g ON g.user_id = u.user_id
+    ''')
+
+
+def _v6_due_queue(cursor: sqlite3.Cursor):
+    """Очередь повторений: next_review в Unix time (UTC) и deck_id в card_progress"""
+    cursor.execute('ALTER TABLE card_progress ADD COLUMN deck_id INTEGER')
+    # next_review писался то текстом SQLite, то datetime из Python — strftime понимает оба
+    cursor.execute('''
+        UPDATE card_progress
+        SET next_review = COALESCE(CAST(strftime('%s', next_review) AS INTEGER), 0),
+            deck_id = (SELECT c.deck_id FROM cards c WHERE c.card_id = card_progress.card_id)
+    ''')
+    # Карточки колоды к повторению сразу в порядке next_review, без сортировки
+    cursor.execute(
+        'CREATE INDEX IF NOT EXISTS idx_progress_deck_due ON card_progress(user_id, deck_id, next_review, card_id)'
+    )
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_cards_move_progress AFTER UPDATE OF deck_id ON cards
+        WHEN OLD.deck_id != NEW.deck_id
+        BEGIN
+            UPDATE card_progress SET deck_id = NEW.deck_id WHERE card_id = NEW.card_id;
+        END
+    ''')
+
+
+def _v7_bot_persistence(cursor: sqlite3.Cursor):
+    """Состояние бота между перезапусками: user_data и состояния диалогов"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS bot_user_data (
+            user_id INTEGER PRIMARY KEY,
+            data BLOB NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS bot_conversations (
+            name TEXT NOT NULL,
+            key TEXT NOT NULL,
+            state TEXT NOT NULL,
+            PRIMARY KEY (name, key)
+        )
+    ''')
+
+
+def _v8_leaderboard_snapshots(cursor: sqlite3.Cursor):
+    """Снимки таблиц лидеров: board — total, weekly:<неделя> или deck:<id>"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS leaderboard_snapshots (
+            board TEXT PRIMARY KEY,
+            scores TEXT NOT NULL,
+            taken_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+
+def _v9_achievements_mask(cursor: sqlite3.Cursor):
+    """Полученные достижения — биты Gamification.ACHIEVEMENT_BITS"""
+    cursor.execute('ALTER TABLE user_gamification ADD COLUMN achievements_mask INTEGER NOT NULL DEFAULT 0')
+
+
+def _v10_points_ledger(cursor: sqlite3.Cursor):
+    """Журнал начислений очков и суточные итоги после свёртки"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS points_ledger (
+            entry_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            points INTEGER NOT NULL,
+            deck_id INTEGER,
+            day DATE NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    # Очки пользователя за период и свёртка по дням
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_points_ledger_user_day ON points_ledger(user_id, day)')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS points_daily (
+            user_id INTEGER NOT NULL,
+            day DATE NOT NULL,
+            points INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, day)
+        ) WITHOUT ROWID
+    ''')
+    # user_gamification.total_points теперь содержит только свёрнутые очки:
+    # текущий итог в user_stats растёт при вставке в журнал, а свёртка его не меняет
+    cursor.execute('DROP TRIGGER IF EXISTS trg_user_stats_points')
+    _user_stats_trigger(
+        cursor, 'trg_user_stats_points_ledger', 'AFTER INSERT ON points_ledger', 'NEW.user_id',
+        'total_points = total_points + NEW.points'
+    )
+
+
+def _v11_points_daily_by_day(cursor: sqlite3.Cursor):
+    """Очки всех пользователей за неделю — для недельной таблицы лидеров при старте"""
+    # Первичный ключ (user_id, day) входит в индекс WITHOUT ROWID-таблицы сам
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_points_daily_day ON points_daily(day, points)')
+
+
+def _v12_drop_leaderboard_snapshots(cursor: sqlite3.Cursor):
+    """Таблицы лидеров собираются при старте из user_stats и журнала очков — снимки не нужны"""
+    cursor.execute('DROP TABLE IF EXISTS leaderboard_snapshots')
+
+
+MIGRATIONS = [
+    (1, _v1_base_schema),
+    (2, _v2_hot_query_indexes),
+    (3, _v3_answer_queue_state),
+    (4, _v4_deck_counters),
+    (5, _v5_user_stats),
+    (6, _v6_due_queue),
+    (7, _v7_bot_persistence),
+    (8, _v8_leaderboard_snapshots),
+    (9, _v9_achievements_mask),
+    (10, _v10_points_ledger),
+    (11, _v11_points_daily_by_day),
+    (12, _v12_drop_leaderboard_snapshots),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def get_version(conn: sqlite3.Connection) -> int:
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def migrate(database, target: int = SCHEMA_VERSION) -> int:
+    """Применить недостающие миграции и вернуть итоговую версию схемы"""
+    with database.connection() as conn:
+        current = get_version(conn)
+    for version, step in MIGRATIONS:
+        if version <= current or version > target:
+            continue
+        with database.transaction() as conn:
+            # Повторная проверка под блокировкой записи: другой процесс мог успеть раньше
+            if get_version(conn) >= version:
+                continue
+            step(conn.cursor())
+            conn.execute(f'PRAGMA user_version = {version}')
+        current = version
+    return current
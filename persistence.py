@@ -0,0 +1,221 @@
+import asyncio
+import json
+import logging
+import pickle
+import time
+from collections import OrderedDict, defaultdict
+from typing import Dict, Optional
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+from async_database import AsyncDatabase
+
+logger = logging.getLogger(__name__)
+
+# Как часто Application передаёт изменения в persistence, секунды
+UPDATE_INTERVAL = 10
+# Через сколько секунд без апдейтов пользователь забывается до следующего апдейта
+IDLE_TIMEOUT = 1800
+
+
+class SQLitePersistence(BasePersistence):
+    """Хранит user_data и состояния ConversationHandler в SQLite.
+
+    user_data пользователя читается при первом его апдейте, а не при
+    старте. Application передаёт только пользователей, у которых были
+    апдейты; их данные копятся в очереди и сериализуются в потоке записи
+    по одному разу за сброс, неизменившиеся не записываются. Накопленное
+    фиксируется одной транзакцией на шард. После сброса пользователи без
+    апдейтов дольше idle_timeout забываются вместе со своими user_data в
+    Application (см. attach) — при следующем апдейте их данные снова
+    прочитаются из базы.
+    """
+
+    def __init__(self, adb: AsyncDatabase, update_interval: float = UPDATE_INTERVAL,
+                 idle_timeout: float = IDLE_TIMEOUT):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self.adb = adb
+        self.db = adb.db
+        self.idle_timeout = idle_timeout
+        # user_id -> время последнего апдейта, от давних к свежим
+        self._loaded: OrderedDict = OrderedDict()
+        # user_id -> hash последних записанных байтов, чтобы не писать неизменное
+        self._written: Dict[int, int] = {}
+        # user_id -> копия user_data от Application; None — удалить
+        self._pending_users: Dict[int, Optional[dict]] = {}
+        self._pending_conversations: Dict[tuple, Optional[str]] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+        self.application = None
+
+    def attach(self, application):
+        """Освобождать user_data забытых пользователей в этом Application"""
+        self.application = application
+
+    # ===== ЧТЕНИЕ =====
+
+    async def get_user_data(self) -> Dict[int, dict]:
+        # Данные загружаются лениво в refresh_user_data
+        return {}
+
+    async def get_chat_data(self) -> Dict[int, dict]:
+        return {}
+
+    async def get_bot_data(self) -> dict:
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name: str) -> Dict:
+        return await self.adb.run_read(self._load_conversations, name)
+
+    def _load_conversations(self, name: str) -> Dict:
+        with self.db.connection() as conn:
+            rows = conn.execute('SELECT key, state FROM bot_conversations WHERE name = ?', (name,)).fetchall()
+        return {tuple(json.loads(row['key'])): json.loads(row['state']) for row in rows}
+
+    async def refresh_user_data(self, user_id: int, user_data: dict):
+        if user_id in self._loaded:
+            self._loaded[user_id] = time.monotonic()
+            self._loaded.move_to_end(user_id)
+            return
+        self._loaded[user_id] = time.monotonic()
+        stored = await self.adb.run_read(self._load_user_data, user_id)
+        if stored:
+            # Изменения, сделанные до загрузки, важнее сохранённых
+            user_data.update({**stored, **user_data})
+
+    def _load_user_data(self, user_id: int) -> dict:
+        with self.db.connection(user_id=user_id) as conn:
+            row = conn.execute('SELECT data FROM bot_user_data WHERE user_id = ?', (user_id,)).fetchone()
+        if not row:
+            return {}
+        self._written[user_id] = hash(row['data'])
+        try:
+            return pickle.loads(row['data'])
+        except Exception:
+            logger.warning(f"Не удалось восстановить user_data пользователя {user_id}", exc_info=True)
+            return {}
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict):
+        pass
+
+    async def refresh_bot_data(self, bot_data: dict):
+        pass
+
+    # ===== ЗАПИСЬ =====
+
+    async def update_user_data(self, user_id: int, data: dict):
+        # data — уже копия; сериализуется при записи, следующий апдейт её заменит
+        self._pending_users[user_id] = data
+        self._schedule_flush()
+
+    async def drop_user_data(self, user_id: int):
+        self._pending_users[user_id] = None
+        self._schedule_flush()
+
+    async def update_conversation(self, name: str, key, new_state: Optional[object]):
+        state = None if new_state is None else json.dumps(new_state)
+        self._pending_conversations[(name, json.dumps(list(key)))] = state
+        self._schedule_flush()
+
+    async def update_chat_data(self, chat_id: int, data: dict):
+        pass
+
+    async def drop_chat_data(self, chat_id: int):
+        pass
+
+    async def update_bot_data(self, data: dict):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    def _schedule_flush(self):
+        # Задача стартует после всех update_* текущего прохода Application
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.get_running_loop().create_task(self._write_pending())
+
+    async def _write_pending(self):
+        # Пока идёт запись, могут прийти новые изменения — пишем и их
+        while self._pending_users or self._pending_conversations:
+            users, self._pending_users = self._pending_users, {}
+            conversations, self._pending_conversations = self._pending_conversations, {}
+            try:
+                written = await self.adb.run_write(self._write, users, conversations)
+            except Exception:
+                # Вернём в очередь то, что не перезаписано более новыми данными
+                for user_id, data in users.items():
+                    self._pending_users.setdefault(user_id, data)
+                for key, state in conversations.items():
+                    self._pending_conversations.setdefault(key, state)
+                logger.exception("Не удалось сохранить состояние бота")
+                return
+            for user_id, digest in written.items():
+                # Хэш нужен только тем, кого ещё не забыли
+                if digest is None or user_id not in self._loaded:
+                    self._written.pop(user_id, None)
+                else:
+                    self._written[user_id] = digest
+        self._forget_idle()
+
+    def _forget_idle(self):
+        """Забыть давно неактивных пользователей, у которых всё записано.
+
+        Их user_data в Application совпадает с записанным, поэтому его
+        можно выбросить: при следующем апдейте Application создаст пустой
+        словарь, а refresh_user_data заполнит его из базы.
+        """
+        deadline = time.monotonic() - self.idle_timeout
+        while self._loaded:
+            user_id, touched = next(iter(self._loaded.items()))
+            if touched > deadline or user_id in self._pending_users:
+                break
+            del self._loaded[user_id]
+            self._written.pop(user_id, None)
+            if self.application is not None:
+                # Не drop_user_data: тот удалил бы и записанные данные
+                self.application._user_data.pop(user_id, None)
+
+    def _write(self, users: Dict[int, Optional[dict]], conversations: Dict[tuple, Optional[str]]) -> Dict:
+        """Записать пачку; возвращает user_id -> hash записанных байтов (None — удалено)"""
+        written = {}
+        by_shard = defaultdict(list)
+        for user_id, data in users.items():
+            blob = digest = None
+            if data is not None:
+                blob = pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)
+                digest = hash(blob)
+                if self._written.get(user_id) == digest:
+                    continue
+            written[user_id] = digest
+            by_shard[self.db.shard_for_user(user_id)].append((user_id, blob))
+        for shard, rows in by_shard.items():
+            with self.db.pools[shard].transaction() as conn:
+                conn.executemany(
+                    'DELETE FROM bot_user_data WHERE user_id = ?',
+                    [(user_id,) for user_id, blob in rows if blob is None]
+                )
+                conn.executemany('''
+                    INSERT INTO bot_user_data (user_id, data, updated_at) VALUES (?, ?, CURRENT_TIMESTAMP)
+                    ON CONFLICT (user_id) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at
+                ''', [(user_id, blob) for user_id, blob in rows if blob is not None])
+        if conversations:
+            with self.db.transaction() as conn:
+                conn.executemany(
+                    'DELETE FROM bot_conversations WHERE name = ? AND key = ?',
+                    [key for key, state in conversations.items() if state is None]
+                )
+                conn.executemany('''
+                    INSERT INTO bot_conversations (name, key, state) VALUES (?, ?, ?)
+                    ON CONFLICT (name, key) DO UPDATE SET state = excluded.state
+                ''', [(*key, state) for key, state in conversations.items() if state is not None])
+        return written
+
+    async def flush(self):
+        if self._flush_task is not None:
+            await self._flush_task
+        await self._write_pending()
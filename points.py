@@ -0,0 +1,180 @@
+import asyncio
+import logging
+import threading
+from collections import defaultdict
+from datetime import date, datetime, time, timedelta
+from functools import partial
+from database import Database
+from leaderboard import leaderboards
+
+logger = logging.getLogger(__name__)
+
+db = Database()
+
+# Сколько дней начисления хранятся построчно, прежде чем свернуться в points_daily
+KEEP_DAYS = 7
+# Как часто записывать начисления, сделанные вне транзакции, секунды
+FLUSH_INTERVAL = 2.0
+
+# Очки начиная с дня: суточные итоги плюс ещё не свёрнутый журнал
+POINTS_SINCE_SQL = '''
+    SELECT (SELECT COALESCE(SUM(points), 0) FROM points_daily WHERE user_id = ? AND day >= ?)
+         + (SELECT COALESCE(SUM(points), 0) FROM points_ledger WHERE user_id = ? AND day >= ?)
+'''
+
+
+class PointsLedger:
+    """Очки как журнал начислений points_ledger, в который только добавляют.
+
+    Начисления копятся в памяти и пишутся одним executemany. Начисления
+    внутри транзакции шарда (применение очереди ответов, достижения)
+    записываются перед её COMMIT — вместе с ответами, за которые получены.
+    Остальные ждут сброса по таймеру или flush().
+
+    Текущий итог пользователя — user_stats.total_points: его увеличивает
+    триггер на вставку в журнал. Свёртка переносит записи старше KEEP_DAYS
+    в суточные итоги points_daily и в user_gamification.total_points, так
+    что журнал не растёт, а очки за неделю — сумма нескольких строк.
+    """
+
+    def __init__(self, database: Database):
+        self.db = database
+        self._buffer = defaultdict(list)  # шард -> [(user_id, points, deck_id, day)]
+        self._lock = threading.Lock()
+        self._tx = threading.local()  # начисления текущей транзакции по шардам
+        # Один и тот же объект на шард: before_commit регистрирует его раз за транзакцию
+        self._commit_hooks = [partial(self._write_transaction, shard) for shard in range(len(database.pools))]
+        self._tasks = []
+
+    def add(self, user_id: int, points: int, deck_id: int = None, day: date = None):
+        """Добавить начисление в буфер"""
+        shard = self.db.shard_for_user(user_id)
+        entry = (user_id, points, deck_id, str(day or date.today()))
+        pool = self.db.pools[shard]
+        if pool.in_transaction():
+            entries = getattr(self._tx, 'entries', None)
+            if entries is None:
+                entries = self._tx.entries = {}
+            # Первое начисление в транзакции; остатки откатившейся отбрасываем
+            if pool.before_commit(self._commit_hooks[shard]):
+                entries[shard] = []
+            entries[shard].append(entry)
+        else:
+            with self._lock:
+                self._buffer[shard].append(entry)
+
+    def _write_transaction(self, shard: int):
+        entries = self._tx.entries.pop(shard, [])
+        if entries:
+            self._insert(shard, entries)
+
+    def flush(self) -> int:
+        """Записать начисления, сделанные вне транзакций"""
+        with self._lock:
+            buffer, self._buffer = self._buffer, defaultdict(list)
+        written = 0
+        for shard, entries in buffer.items():
+            try:
+                self._insert(shard, entries)
+            except Exception:
+                with self._lock:
+                    self._buffer[shard][:0] = entries
+                raise
+            written += len(entries)
+        return written
+
+    def _insert(self, shard: int, entries):
+        with self.db.pools[shard].transaction() as conn:
+            conn.executemany(
+                'INSERT INTO points_ledger (user_id, points, deck_id, day) VALUES (?, ?, ?, ?)', entries
+            )
+            user_ids = list({entry[0] for entry in entries})
+            totals = dict(conn.execute(
+                f'SELECT user_id, total_points FROM user_stats WHERE user_id IN ({",".join("?" * len(user_ids))})',
+                user_ids
+            ).fetchall())
+            self.db.after_commit(lambda: self._record(entries, totals))
+
+    @staticmethod
+    def _record(entries, totals):
+        for user_id, points, _, _ in entries:
+            leaderboards.record(user_id, totals.get(user_id, 0), points)
+
+    # ===== ЧТЕНИЕ =====
+
+    def points_since(self, user_id: int, day: date) -> int:
+        """Очки пользователя начиная с дня day: суточные итоги плюс ещё не свёрнутый журнал"""
+        with self.db.connection(user_id=user_id) as conn:
+            row = conn.execute(POINTS_SINCE_SQL, (user_id, str(day), user_id, str(day))).fetchone()
+        return row[0]
+
+    def week_points(self, user_id: int, today: date = None) -> int:
+        """Очки за текущую неделю (с понедельника)"""
+        today = today or date.today()
+        return self.points_since(user_id, today - timedelta(days=today.weekday()))
+
+    # ===== СВЁРТКА =====
+
+    def compact(self, today: date = None, keep_days: int = KEEP_DAYS) -> int:
+        """Свернуть записи журнала старше keep_days; возвращает число свёрнутых записей"""
+        cutoff = str((today or date.today()) - timedelta(days=keep_days))
+        folded = 0
+        for pool in self.db.pools:
+            with pool.transaction() as conn:
+                conn.execute('''
+                    INSERT INTO points_daily (user_id, day, points)
+                    SELECT user_id, day, SUM(points) FROM points_ledger WHERE day < ? GROUP BY user_id, day
+                    ON CONFLICT (user_id, day) DO UPDATE SET points = points + excluded.points
+                ''', (cutoff,))
+                # Очки без строки user_gamification иначе пропали бы при свёртке
+                conn.execute('''
+                    INSERT OR IGNORE INTO user_gamification (user_id)
+                    SELECT DISTINCT user_id FROM points_ledger WHERE day < ?
+                ''', (cutoff,))
+                conn.execute('''
+                    UPDATE user_gamification
+                    SET total_points = total_points + (
+                        SELECT SUM(points) FROM points_ledger l
+                        WHERE l.user_id = user_gamification.user_id AND l.day < ?
+                    )
+                    WHERE user_id IN (SELECT user_id FROM points_ledger WHERE day < ?)
+                ''', (cutoff, cutoff))
+                folded += conn.execute('DELETE FROM points_ledger WHERE day < ?', (cutoff,)).rowcount
+        return folded
+
+    # ===== ЖИЗНЕННЫЙ ЦИКЛ =====
+
+    async def start(self, adb, flush_interval: float = FLUSH_INTERVAL):
+        loop = asyncio.get_running_loop()
+        self._tasks = [
+            loop.create_task(self._flush_periodically(adb, flush_interval)),
+            loop.create_task(self._compact_nightly(adb)),
+        ]
+
+    async def stop(self, adb):
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        await adb.run_write(self.flush)
+
+    async def _flush_periodically(self, adb, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await adb.run_write(self.flush)
+            except Exception:
+                logger.exception("Не удалось записать начисления очков")
+
+    async def _compact_nightly(self, adb):
+        while True:
+            try:
+                folded = await adb.run_write(self.compact)
+                logger.info(f"⭐ Свёрнуто записей журнала очков: {folded}")
+            except Exception:
+                logger.exception("Не удалось свернуть журнал очков")
+            now = datetime.now()
+            midnight = datetime.combine(now.date() + timedelta(days=1), time.min)
+            await asyncio.sleep((midnight - now).total_seconds() + 1)
+
+
+points_ledger = PointsLedger(db)
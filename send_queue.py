@@ -0,0 +1,318 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict, deque
+from typing import Any, Callable, Coroutine, Dict, List, Optional, Union
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+logger = logging.getLogger(__name__)
+
+# Лимиты Telegram: ~30 сообщений/с на бота, ~1/с в личный чат, 20/мин в группу
+GLOBAL_RATE = 30.0
+PRIVATE_CHAT_RATE = 1.0
+PRIVATE_CHAT_BURST = 3
+GROUP_CHAT_RATE = 20 / 60
+GROUP_CHAT_BURST = 3
+# Правки уже отправленных сообщений (переворот карточки, ответ в тесте) не
+# добавляют сообщений в чат: у них своё ведро чата, а не ведро отправки
+EDIT_CHAT_RATE = 5.0
+EDIT_CHAT_BURST = 5
+
+# Приоритет передаётся через rate_limit_args={'priority': BROADCAST}
+INTERACTIVE = 0
+BROADCAST = 1
+
+# Методы без лимитов на отправку: выполняются сразу, мимо очереди
+UNLIMITED = frozenset({
+    'getUpdates', 'getMe', 'answerCallbackQuery', 'setWebhook', 'deleteWebhook',
+    'getWebhookInfo', 'logOut', 'close', 'setMyCommands', 'deleteMyCommands',
+})
+# Правки, из которых в очереди остаётся только последняя для одного сообщения
+COLLAPSIBLE = frozenset({'editMessageText', 'editMessageReplyMarkup', 'editMessageCaption'})
+
+
+class TokenBucket:
+    """rate токенов в секунду, не больше capacity"""
+
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated', 'blocked_until')
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0  # после 429 — до конца retry_after
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now: float) -> float:
+        """Сколько ждать до следующего токена; 0 — можно сейчас"""
+        self._refill(now)
+        wait = 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+        return max(wait, self.blocked_until - now)
+
+    def take(self, now: float):
+        self._refill(now)
+        self.tokens -= 1
+
+    def idle(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity and self.blocked_until <= now
+
+
+def _seconds(retry_after) -> float:
+    # int в python-telegram-bot 20.x, timedelta в более новых версиях
+    return retry_after.total_seconds() if hasattr(retry_after, 'total_seconds') else float(retry_after)
+
+
+def _copy_outcome(source: asyncio.Future, target: asyncio.Future):
+    if target.done():
+        return
+    if source.cancelled():
+        target.cancel()
+    elif source.exception() is not None:
+        target.set_exception(source.exception())
+    else:
+        target.set_result(source.result())
+
+
+class _Request:
+    __slots__ = ('lane', 'chat_id', 'bucket_key', 'edit_key', 'callback', 'args', 'kwargs', 'future',
+                 'enqueued', 'retries')
+
+    def __init__(self, lane, chat_id, edit_key, callback, args, kwargs, future):
+        self.lane = lane
+        self.chat_id = chat_id
+        # Правки чата ждут своё ведро и свою очередь, отправки — свои
+        self.bucket_key = None if chat_id is None else (chat_id, edit_key is not None)
+        self.edit_key = edit_key
+        self.callback = callback
+        self.args = args
+        self.kwargs = kwargs
+        self.future = future
+        self.enqueued = time.monotonic()
+        self.retries = 0
+
+
+class SendQueue(BaseRateLimiter[Dict[str, Any]]):
+    """Очередь исходящих запросов к Bot API с учётом лимитов Telegram.
+
+    Подключается через Application.builder().rate_limiter(...): все вызовы
+    бота проходят через process_request. Запрос ждёт токен общего ведра и
+    ведра своего чата; у правок сообщений ведро чата отдельное от отправок,
+    так что очередь новых сообщений не задерживает правку текущего.
+    Интерактивная полоса обслуживается раньше рассылок, а внутри полосы
+    чаты идут по кругу, чтобы занятый чат не задерживал остальных; в пути
+    у ведра чата не больше одного запроса, чтобы сообщения не обгоняли
+    друг друга. Если в очереди уже лежит правка того же сообщения, она
+    заменяется новой — отправляется только последняя, оба вызова получают
+    её результат. На 429 ведро чата (или весь бот) приостанавливается на
+    retry_after, и запрос повторяется.
+    """
+
+    def __init__(self, global_rate: float = GLOBAL_RATE, max_retries: int = 3, drain_timeout: float = 10.0):
+        self.max_retries = max_retries
+        self.drain_timeout = drain_timeout
+        self._global = TokenBucket(global_rate, global_rate)
+        # (chat_id, правка ли) -> ведро
+        self._chats: Dict[tuple, TokenBucket] = {}
+        # Полоса -> ведро чата -> очередь запросов; порядок чатов — круговой
+        self._lanes: List[OrderedDict] = [OrderedDict(), OrderedDict()]
+        self._edits: Dict[tuple, _Request] = {}
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._inflight = set()
+        # Ведра чатов, чей запрос сейчас в пути: следующий уйдёт после ответа,
+        # иначе параллельные запросы могут прийти в чат не в том порядке
+        self._sending = set()
+        self.metrics = {
+            'sent': 0, 'unlimited': 0, 'collapsed': 0, 'retried': 0, 'failed': 0,
+            'queued': 0, 'max_queued': 0, 'wait_total': 0.0, 'wait_max': 0.0,
+        }
+
+    # ===== BaseRateLimiter =====
+
+    async def initialize(self):
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def shutdown(self):
+        """Отправить то, что уже в очереди (не дольше drain_timeout), и остановиться"""
+        if self._task is None:
+            return
+        deadline = time.monotonic() + self.drain_timeout
+        while (self.metrics['queued'] or self._inflight) and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        self._task.cancel()
+        self._task = None
+        for lane in self._lanes:
+            for requests in lane.values():
+                for request in requests:
+                    if not request.future.done():
+                        request.future.set_exception(RuntimeError("Очередь отправки остановлена"))
+            lane.clear()
+        self._edits.clear()
+        self.metrics['queued'] = 0
+
+    async def process_request(
+        self,
+        callback: Callable[..., Coroutine[Any, Any, Union[bool, Dict[str, Any], List[Dict[str, Any]]]]],
+        args: Any,
+        kwargs: Dict[str, Any],
+        endpoint: str,
+        data: Dict[str, Any],
+        rate_limit_args: Optional[Dict[str, Any]],
+    ):
+        if endpoint in UNLIMITED or self._task is None:
+            self.metrics['unlimited'] += 1
+            return await callback(*args, **kwargs)
+
+        chat_id = data.get('chat_id')
+        edit_key = None
+        if endpoint in COLLAPSIBLE:
+            edit_key = (endpoint, chat_id, data.get('message_id'), data.get('inline_message_id'))
+            pending = self._edits.get(edit_key)
+            if pending is not None:
+                # Более ранняя правка ещё не ушла: отправим только эту, на её месте в очереди
+                pending.callback, pending.args, pending.kwargs = callback, args, kwargs
+                self.metrics['collapsed'] += 1
+                return await asyncio.shield(pending.future)
+
+        lane = (rate_limit_args or {}).get('priority', INTERACTIVE)
+        request = _Request(lane, chat_id, edit_key, callback, args, kwargs,
+                           asyncio.get_running_loop().create_future())
+        self._enqueue(request)
+        return await asyncio.shield(request.future)
+
+    # ===== ОЧЕРЕДЬ =====
+
+    def _enqueue(self, request: _Request, front: bool = False):
+        requests = self._lanes[request.lane].get(request.bucket_key)
+        if requests is None:
+            requests = self._lanes[request.lane][request.bucket_key] = deque()
+        if front:
+            requests.appendleft(request)
+        else:
+            requests.append(request)
+        if request.edit_key is not None:
+            self._edits[request.edit_key] = request
+        self.metrics['queued'] += 1
+        self.metrics['max_queued'] = max(self.metrics['max_queued'], self.metrics['queued'])
+        self._wakeup.set()
+
+    def _chat_bucket(self, key) -> Optional[TokenBucket]:
+        """Ведро (chat_id, правка ли); у запросов без chat_id (inline-сообщения) его нет"""
+        if key is None:
+            return None
+        bucket = self._chats.get(key)
+        if bucket is None:
+            if len(self._chats) > 10000:
+                now = time.monotonic()
+                self._chats = {k: b for k, b in self._chats.items() if not b.idle(now)}
+            chat_id, is_edit = key
+            if is_edit:
+                bucket = TokenBucket(EDIT_CHAT_RATE, EDIT_CHAT_BURST)
+            # Отрицательные id — группы и каналы
+            elif isinstance(chat_id, int) and chat_id < 0:
+                bucket = TokenBucket(GROUP_CHAT_RATE, GROUP_CHAT_BURST)
+            else:
+                bucket = TokenBucket(PRIVATE_CHAT_RATE, PRIVATE_CHAT_BURST)
+            self._chats[key] = bucket
+        return bucket
+
+    def _next(self, now: float):
+        """Следующий запрос, который можно отправить, или время ожидания"""
+        wait = self._global.delay(now)
+        if wait > 0:
+            return None, wait
+        wait = None
+        for lane in self._lanes:
+            for key in lane:
+                if key in self._sending:
+                    continue
+                bucket = self._chat_bucket(key)
+                delay = bucket.delay(now) if bucket is not None else 0
+                if delay <= 0:
+                    requests = lane[key]
+                    request = requests.popleft()
+                    # Чат уходит в конец круга
+                    if requests:
+                        lane.move_to_end(key)
+                    else:
+                        del lane[key]
+                    return request, 0
+                wait = delay if wait is None else min(wait, delay)
+        return None, wait
+
+    async def _run(self):
+        while True:
+            now = time.monotonic()
+            request, wait = self._next(now)
+            if request is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            self._global.take(now)
+            bucket = self._chat_bucket(request.bucket_key)
+            if bucket is not None:
+                bucket.take(now)
+                self._sending.add(request.bucket_key)
+            self.metrics['queued'] -= 1
+            if request.edit_key is not None and self._edits.get(request.edit_key) is request:
+                del self._edits[request.edit_key]
+            waited = now - request.enqueued
+            self.metrics['wait_total'] += waited
+            self.metrics['wait_max'] = max(self.metrics['wait_max'], waited)
+            task = asyncio.get_running_loop().create_task(self._send(request))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+    async def _send(self, request: _Request):
+        try:
+            await self._call(request)
+        finally:
+            self._sending.discard(request.bucket_key)
+            self._wakeup.set()
+
+    async def _call(self, request: _Request):
+        try:
+            result = await request.callback(*request.args, **request.kwargs)
+        except RetryAfter as exc:
+            retry_after = _seconds(exc.retry_after)
+            bucket = self._chat_bucket(request.bucket_key) or self._global
+            bucket.blocked_until = max(bucket.blocked_until, time.monotonic() + retry_after)
+            newer = self._edits.get(request.edit_key) if request.edit_key is not None else None
+            if newer is not None:
+                # Пока правка ждала ответа, в очередь встала более новая — повторять нечего
+                self.metrics['collapsed'] += 1
+                newer.future.add_done_callback(lambda done: _copy_outcome(done, request.future))
+                return
+            if request.retries < self.max_retries:
+                request.retries += 1
+                self.metrics['retried'] += 1
+                logger.warning(f"429 для чата {request.chat_id}: повтор через {retry_after} с")
+                self._enqueue(request, front=True)
+                return
+            self.metrics['failed'] += 1
+            request.future.set_exception(exc)
+        except Exception as exc:
+            self.metrics['failed'] += 1
+            request.future.set_exception(exc)
+        else:
+            self.metrics['sent'] += 1
+            request.future.set_result(result)
+
+    def stats(self) -> Dict[str, Any]:
+        sent = self.metrics['sent'] + self.metrics['failed']
+        stats = {key: value for key, value in self.metrics.items() if key != 'wait_total'}
+        stats['wait_avg'] = round(self.metrics['wait_total'] / sent, 3) if sent else 0.0
+        stats['wait_max'] = round(stats['wait_max'], 3)
+        stats['chats'] = len(self._chats)
+        return stats
@@ -1,106 +1,129 @@
-from datetime import datetime, timedelta
+import time
 from database import Database
+import events
 
 db = Database()
 
+DAY_SECONDS = 86400
+
+# Страница очереди повторения по индексу (user_id, deck_id, next_review, card_id)
+DUE_PAGE_SQL = '''
+    SELECT c.*, cp.level, cp.next_review
+    FROM card_progress cp
+    JOIN cards c ON c.card_id = cp.card_id
+    WHERE cp.user_id = ? AND cp.deck_id = ? AND cp.next_review <= ?
+      AND (cp.next_review, cp.card_id) > (?, ?)
+    ORDER BY cp.next_review, cp.card_id
+    LIMIT ?
+'''
+DUE_COUNT_SQL = '''
+    SELECT COUNT(*) FROM card_progress
+    WHERE user_id = ? AND deck_id = ? AND next_review <= ?
+'''
+
 class SpacedRepetition:
     """Интервальное повторение (SRS)"""
     
     @staticmethod
     def init_card(user_id, card_id):
         """Инициализировать карточку в системе повторения"""
-        conn = db.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            INSERT OR IGNORE INTO card_progress 
-            (user_id, card_id, level, next_review, correct_count, wrong_count)
-            VALUES (?, ?, 0, datetime('now'), 0, 0)
-        ''', (user_id, card_id))
-        
-        conn.commit()
-        conn.close()
+        with db.transaction(user_id=user_id) as conn:
+            conn.execute('''
+                INSERT OR IGNORE INTO card_progress 
+                (user_id, card_id, deck_id, level, next_review, correct_count, wrong_count)
+                VALUES (?, ?, (SELECT deck_id FROM cards WHERE card_id = ?), 0, ?, 0, 0)
+            ''', (user_id, card_id, card_id, int(time.time())))
     
     @staticmethod
-    def update_card_progress(user_id, card_id, result):
-        """Обновить прогресс карточки"""
-        conn = db.get_connection()
-        cursor = conn.cursor()
-        
-        # Получаем текущий прогресс
-        cursor.execute('''
-            SELECT level, correct_count, wrong_count 
-            FROM card_progress 
-            WHERE user_id = ? AND card_id = ?
-        ''', (user_id, card_id))
-        
-        row = cursor.fetchone()
-        if not row:
-            SpacedRepetition.init_card(user_id, card_id)
-            level, correct, wrong = 0, 0, 0
-        else:
+    def update_card_progress(user_id, card_id, result, answered_at=None):
+        """Обновить прогресс карточки; answered_at — время ответа (epoch)"""
+        with db.transaction(user_id=user_id) as conn:
+            cursor = conn.cursor()
+            
+            # Получаем текущий прогресс
+            select = '''
+                SELECT level, correct_count, wrong_count
+                FROM card_progress 
+                WHERE user_id = ? AND card_id = ?
+            '''
+            cursor.execute(select, (user_id, card_id))
+            
+            row = cursor.fetchone()
+            if not row:
+                SpacedRepetition.init_card(user_id, card_id)
+                cursor.execute(select, (user_id, card_id))
+                row = cursor.fetchone()
             level, correct, wrong = row
-        
-        # Обновляем статистику
-        if result == 'correct':
-            correct += 1
-            level = min(level + 1, 6)  # Максимальный уровень 6
-        elif result == 'wrong':
-            wrong += 1
-            level = max(level - 1, 0)  # Минимальный уровень 0
-        elif result == 'again':
-            wrong += 1
-            level = 0  # Сброс уровня
-        
-        # Рассчитываем следующее повторение
-        intervals = [0, 1, 3, 7, 14, 30, 60]  # дни для каждого уровня
-        next_review = datetime.now() + timedelta(days=intervals[level])
-        
-        cursor.execute('''
-            UPDATE card_progress 
-            SET level = ?, next_review = ?, correct_count = ?, wrong_count = ?
-            WHERE user_id = ? AND card_id = ?
-        ''', (level, next_review, correct, wrong, user_id, card_id))
-        
-        conn.commit()
-        conn.close()
+            old_level = level
+            
+            # Обновляем статистику
+            if result == 'correct':
+                correct += 1
+                level = min(level + 1, 6)  # Максимальный уровень 6
+            elif result == 'wrong':
+                wrong += 1
+                level = max(level - 1, 0)  # Минимальный уровень 0
+            elif result == 'again':
+                wrong += 1
+                level = 0  # Сброс уровня
+            
+            # Рассчитываем следующее повторение
+            intervals = [0, 1, 3, 7, 14, 30, 60]  # дни для каждого уровня
+            next_review = int(time.time()) + intervals[level] * DAY_SECONDS
+            
+            cursor.execute('''
+                UPDATE card_progress 
+                SET level = ?, next_review = ?, correct_count = ?, wrong_count = ?
+                WHERE user_id = ? AND card_id = ?
+            ''', (level, next_review, correct, wrong, user_id, card_id))
+            events.publish(
+                'card_progress', user_id=user_id, old_level=old_level, new_level=level,
+                result=result, ts=time.time() if answered_at is None else answered_at
+            )
     
     @staticmethod
-    def get_due_cards(user_id, deck_id):
-        """Получить карточки, которые пора повторить"""
-        conn = db.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT c.*, cp.level 
-            FROM cards c
-            JOIN card_progress cp ON c.card_id = cp.card_id
-            WHERE c.deck_id = ? AND cp.user_id = ? AND cp.next_review <= datetime('now')
-            ORDER BY cp.level ASC
-        ''', (deck_id, user_id))
-        
-        cards = [dict(row) for row in cursor.fetchall()]
-        conn.close()
-        
-        return cards
+    def get_due_cards(user_id, deck_id, limit=None):
+        """Получить карточки, которые пора повторить (самые просроченные первыми)"""
+        # LIMIT -1 в SQLite — без ограничения
+        return SpacedRepetition.get_due_page(user_id, deck_id, -1 if limit is None else limit)
+    
+    @staticmethod
+    def get_due_page(user_id, deck_id, limit=20, after=None, now=None):
+        """Страница очереди повторения по индексу (user_id, deck_id, next_review, card_id).
+        
+        after — (next_review, card_id) последней карточки предыдущей страницы.
+        """
+        now = int(time.time()) if now is None else now
+        last_due, last_card = after if after is not None else (-1, -1)
+        with db.connection(user_id=user_id) as conn:
+            cursor = conn.cursor()
+            cursor.execute(DUE_PAGE_SQL, (user_id, deck_id, now, last_due, last_card, limit))
+            return [dict(row) for row in cursor.fetchall()]
+    
+    @staticmethod
+    def get_due_count(user_id, deck_id):
+        """Сколько карточек колоды пора повторить (счёт по индексу, без сортировки)"""
+        with db.connection(user_id=user_id) as conn:
+            cursor = conn.cursor()
+            cursor.execute(DUE_COUNT_SQL, (user_id, deck_id, int(time.time())))
+            return cursor.fetchone()[0]
     
     @staticmethod
     def get_deck_progress(user_id, deck_id):
         """Получить процент выученности колоды"""
-        conn = db.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT 
-                COUNT(CASE WHEN cp.level >= 4 THEN 1 END) as mastered,
-                COUNT(*) as total
-            FROM cards c
-            LEFT JOIN card_progress cp ON c.card_id = cp.card_id AND cp.user_id = ?
-            WHERE c.deck_id = ?
-        ''', (user_id, deck_id))
-        
-        row = cursor.fetchone()
-        conn.close()
+        with db.connection(user_id=user_id) as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute('''
+                SELECT 
+                    COUNT(CASE WHEN cp.level >= 4 THEN 1 END) as mastered,
+                    COUNT(*) as total
+                FROM cards c
+                LEFT JOIN card_progress cp ON c.card_id = cp.card_id AND cp.user_id = ?
+                WHERE c.deck_id = ?
+            ''', (user_id, deck_id))
+            
+            row = cursor.fetchone()
         
         if row and row['total'] > 0:
             return round((row['mastered'] / row['total']) * 100)
@@ -109,22 +132,21 @@ class SpacedRepetition:
     @staticmethod
     def get_detailed_stats(user_id, deck_id):
         """Детальная статистика по колоде"""
-        conn = db.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT 
-                COUNT(CASE WHEN level >= 4 THEN 1 END) as mastered,
-                COUNT(CASE WHEN level BETWEEN 1 AND 3 THEN 1 END) as learning,
-                COUNT(CASE WHEN level = 0 OR level IS NULL THEN 1 END) as review,
-                COUNT(*) as total
-            FROM cards c
-            LEFT JOIN card_progress cp ON c.card_id = cp.card_id AND cp.user_id = ?
-            WHERE c.deck_id = ?
-        ''', (user_id, deck_id))
-        
-        row = cursor.fetchone()
-        conn.close()
+        with db.connection(user_id=user_id) as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute('''
+                SELECT 
+                    COUNT(CASE WHEN level >= 4 THEN 1 END) as mastered,
+                    COUNT(CASE WHEN level BETWEEN 1 AND 3 THEN 1 END) as learning,
+                    COUNT(CASE WHEN level = 0 OR level IS NULL THEN 1 END) as review,
+                    COUNT(*) as total
+                FROM cards c
+                LEFT JOIN card_progress cp ON c.card_id = cp.card_id AND cp.user_id = ?
+                WHERE c.deck_id = ?
+            ''', (user_id, deck_id))
+            
+            row = cursor.fetchone()
         
         total = row['total'] or 1
         return {
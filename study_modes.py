@@ -1,47 +1,80 @@
 import random
-from difflib import SequenceMatcher
+import time
+import config
+from answer_matching import get_matcher
 from database import Database
+from spaced_repetition import SpacedRepetition
 
 db = Database()
 
+# Во сколько раз доля ошибок поднимает вес карточки при выборке
+ERROR_WEIGHTS = {'write': 4, 'quiz': 4}
+DEFAULT_ERROR_WEIGHT = 2
+
+# Взвешенная выборка без возвращения: ключ -ln(u)/w, берём наименьшие
+WEIGHTED_CARDS_SQL = '''
+    SELECT c.*, cp.level, cp.next_review
+    FROM cards c
+    LEFT JOIN card_progress cp ON cp.card_id = c.card_id AND cp.user_id = ?
+    WHERE c.deck_id = ? AND (cp.next_review IS NULL OR cp.next_review > ?)
+    ORDER BY -ln((ABS(RANDOM() % 1000000) + 1) / 1000001.0) / (
+        (7 - COALESCE(cp.level, 0)) *
+        (1.0 + ? * COALESCE(cp.wrong_count, 0) /
+               MAX(COALESCE(cp.correct_count, 0) + COALESCE(cp.wrong_count, 0), 1))
+    )
+    LIMIT ?
+'''
+
 class StudyModes:
     """Режимы обучения"""
     
     @staticmethod
-    def prepare_cards(user_id, deck_id, mode='flashcard', limit=20):
-        """Подготовить карточки для обучения"""
-        cards = db.get_deck_cards(deck_id)
-        
-        if not cards:
-            return []
+    def session_size(user_id, limit=None):
+        """Размер сессии: настройка пользователя, не больше MAX_CARDS_PER_SESSION"""
+        if limit is None:
+            # prepare_cards выполняется в потоке чтения — настройки читаем без записи
+            limit = db.peek_user_settings(user_id).get('cards_per_session') or 20
+        return max(1, min(int(limit), config.MAX_CARDS_PER_SESSION))
+    
+    @staticmethod
+    def prepare_cards(user_id, deck_id, mode='flashcard', limit=None):
+        """Подготовить карточки для обучения.
         
-        # Приоритет сложным и новым карточкам
-        if mode in ['write', 'quiz']:
-            # Сортируем: сначала те, что плохо знаем
-            cards.sort(key=lambda x: x.get('difficulty', 1), reverse=True)
+        Сначала карточки, которым пора на повторение, остальное — взвешенная
+        случайная выборка в SQL: чем ниже уровень и больше ошибок, тем чаще.
+        """
+        limit = StudyModes.session_size(user_id, limit)
+        cards = SpacedRepetition.get_due_cards(user_id, deck_id, limit)
+        if len(cards) >= limit:
+            return cards
         
-        # Перемешиваем для разнообразия
-        random.shuffle(cards)
+        error_weight = ERROR_WEIGHTS.get(mode, DEFAULT_ERROR_WEIGHT)
+        with db.connection(user_id=user_id) as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                WEIGHTED_CARDS_SQL, (user_id, deck_id, int(time.time()), error_weight, limit - len(cards))
+            )
+            cards.extend(dict(row) for row in cursor.fetchall())
         
-        return cards[:limit]
+        return cards
     
     @staticmethod
     def calculate_similarity(a, b):
-        """Рассчитать схожесть двух строк (0-1)"""
-        return SequenceMatcher(None, a.lower(), b.lower()).ratio()
+        """Рассчитать схожесть ответа a с ответом карточки b (0-1)"""
+        return get_matcher().match(a, b).similarity
     
     @staticmethod
-    def generate_quiz_options(correct_card, all_cards, num_options=4):
-        """Сгенерировать варианты ответа для теста"""
+    def check_answer(user_answer, answer):
+        """Проверить письменный ответ: grade — correct / close / wrong"""
+        return get_matcher().match(user_answer, answer)
+    
+    @staticmethod
+    def generate_quiz_options(correct_card, num_options=4):
+        """Сгенерировать варианты ответа для теста из индекса колоды"""
         correct_answer = correct_card['answer']
+        index = db.get_distractor_index(correct_card['deck_id'])
         options = [correct_answer]
-        
-        # Берем случайные неправильные ответы
-        other_cards = [c for c in all_cards if c['card_id'] != correct_card['card_id']]
-        wrong_answers = random.sample([c['answer'] for c in other_cards], 
-                                     min(num_options-1, len(other_cards)))
-        
-        options.extend(wrong_answers)
+        options.extend(index.pick(correct_card['card_id'], correct_answer, num_options - 1))
         random.shuffle(options)
         
         return options
@@ -0,0 +1,64 @@
+from array import array
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Подрежимы смешанного режима храним по одному байту на карточку
+SUB_MODES = ('flashcard', 'write', 'quiz')
+
+
+class StudySession:
+    """Состояние сессии обучения: только id карточек и счётчики.
+
+    Тексты карточек не хранятся — их отдаёт общий кэш карточек
+    (Database.get_card), поэтому сессия занимает порядка 8 байт на карточку.
+    """
+
+    __slots__ = ('mode', 'deck_id', 'card_ids', 'sub_modes', 'current', 'correct', 'wrong', 'flipped')
+
+    def __init__(self, mode: str, deck_id: int, card_ids: Iterable[int], sub_modes: Iterable[str] = None):
+        self.mode = mode
+        self.deck_id = deck_id
+        self.card_ids = array('q', card_ids)
+        self.sub_modes = bytes(SUB_MODES.index(m) for m in sub_modes) if sub_modes is not None else b''
+        self.current = 0
+        self.correct = 0
+        self.wrong = 0
+        self.flipped = False
+
+    @classmethod
+    def from_cards(cls, mode: str, deck_id: int, cards: List[Dict], sub_modes: Iterable[str] = None):
+        return cls(mode, deck_id, (card['card_id'] for card in cards), sub_modes)
+
+    def __len__(self):
+        return len(self.card_ids)
+
+    @property
+    def card_id(self) -> int:
+        return self.card_ids[self.current]
+
+    @property
+    def number(self) -> int:
+        """Номер текущей карточки для показа, с 1"""
+        return self.current + 1
+
+    @property
+    def finished(self) -> bool:
+        return self.current >= len(self.card_ids)
+
+    @property
+    def sub_mode(self) -> str:
+        """Режим текущей карточки: в смешанном — её подрежим"""
+        if self.sub_modes:
+            return SUB_MODES[self.sub_modes[self.current]]
+        return self.mode
+
+    def upcoming(self) -> Optional[Tuple[int, str]]:
+        """id и режим следующей карточки; None, если текущая последняя"""
+        index = self.current + 1
+        if index >= len(self.card_ids):
+            return None
+        mode = SUB_MODES[self.sub_modes[index]] if self.sub_modes else self.mode
+        return self.card_ids[index], mode
+
+    def advance(self):
+        self.current += 1
+        self.flipped = False
@@ -0,0 +1,74 @@
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+BOT_TOKEN = '123456:TEST'
+
+
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    """Модули открывают quizlet_bot.db по относительному пути — пусть он будет во временном каталоге"""
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+def make_update(update_id: int, user_id: int, text: str = 'x') -> dict:
+    """Обновление с сообщением в личном чате в формате Bot API"""
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id, 'date': 0, 'text': text,
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': f'user{user_id}'},
+        },
+    }
+
+
+@pytest.fixture
+def offline_request():
+    """Запросы к Bot API без сети: getMe отвечает сразу, остальные методы возвращают True"""
+    from telegram.request import BaseRequest
+
+    class OfflineRequest(BaseRequest):
+        def __init__(self):
+            self.calls = []
+
+        async def initialize(self):
+            pass
+
+        async def shutdown(self):
+            pass
+
+        async def do_request(self, url, method, request_data=None, **timeouts):
+            endpoint = url.rsplit('/', 1)[-1]
+            self.calls.append((endpoint, request_data.parameters if request_data else {}))
+            if endpoint == 'getMe':
+                result = {'id': 1, 'is_bot': True, 'first_name': 'bot', 'username': 'test_bot'}
+            else:
+                result = True
+            return 200, json.dumps({'ok': True, 'result': result}).encode()
+
+    return OfflineRequest()
+
+
+@pytest.fixture
+def bot_db(workdir):
+    """База по умолчанию, которой пользуются модули бота, — в каталоге теста.
+
+    Пулы соединений и именованные кэши общие для процесса: после теста
+    соединения закрываются, а кэши очищаются, чтобы следующий тест открыл
+    свою базу.
+    """
+    from cache import TTLCache
+    from database import Database
+
+    db = Database()
+    db.init_db()
+    yield db
+    db.close()
+    for cache in TTLCache._shared.values():
+        cache.clear()
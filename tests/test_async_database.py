@@ -0,0 +1,58 @@
+import asyncio
+import threading
+
+from async_database import AsyncDatabase
+from database import Database
+
+
+def users_in_different_shards(db: Database):
+    first = 1
+    second = next(user for user in range(2, 100) if db.shard_for_user(user) != db.shard_for_user(first))
+    return first, second
+
+
+def test_shard_writes_do_not_wait_for_each_other(workdir):
+    db = Database(str(workdir / 'sharded.db'), shards=4)
+    db.init_db()
+    adb = AsyncDatabase(db)
+    busy_user, other_user = users_in_different_shards(db)
+    release = threading.Event()
+
+    def hold(user_id):
+        release.wait(10)
+        return threading.current_thread().name
+
+    async def main():
+        held = asyncio.ensure_future(adb.run_write(hold, user_id=busy_user))
+        await asyncio.sleep(0.05)
+        # Писатель шарда busy_user занят — записи другого шарда проходят, в том числе через фасад
+        other_thread = await asyncio.wait_for(
+            adb.run_write(lambda user_id: threading.current_thread().name, user_id=other_user), 5)
+        await asyncio.wait_for(adb.add_user(other_user, 'other'), 5)
+        deck_id = await asyncio.wait_for(adb.create_deck(other_user, 'deck'), 5)
+        await asyncio.wait_for(adb.add_card(deck_id, 'q', 'a'), 5)
+        # Запись в шард busy_user встаёт в очередь за удерживающей
+        queued = asyncio.ensure_future(adb.add_user(busy_user, 'busy'))
+        await asyncio.sleep(0.05)
+        assert not held.done() and not queued.done()
+        release.set()
+        await queued
+        return await held, other_thread, deck_id
+
+    try:
+        busy_thread, other_thread, deck_id = asyncio.run(main())
+    finally:
+        release.set()
+        adb.shutdown()
+    assert busy_thread != other_thread
+    assert db.shard_for_id(deck_id) == db.shard_for_user(other_user)
+    assert db.get_deck_cards(deck_id)[0]['question'] == 'q'
+    db.close()
+
+
+def test_single_file_has_one_writer(workdir):
+    db = Database(str(workdir / 'single.db'), shards=1)
+    adb = AsyncDatabase(db)
+    assert adb.writer(user_id=1) is adb.writer(row_id=5) is adb.writer()
+    adb.shutdown()
+    db.close()
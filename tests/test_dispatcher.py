@@ -0,0 +1,108 @@
+import asyncio
+import random
+import time
+from collections import defaultdict
+
+import pytest
+
+pytest.importorskip('telegram')
+
+from telegram import Update
+from telegram.ext import Application, TypeHandler
+
+from conftest import BOT_TOKEN, make_update
+from dispatcher import PENDING_LIMIT, OrderedConcurrentApplication
+
+
+def build(request, max_concurrent: int, pending_limit: int = PENDING_LIMIT):
+    return (
+        Application.builder().token(BOT_TOKEN).updater(None)
+        .request(request).get_updates_request(request)
+        .application_class(OrderedConcurrentApplication, kwargs={'max_concurrent': max_concurrent})
+        .concurrent_updates(pending_limit)
+        .build()
+    )
+
+
+async def run_updates(application, updates, handler):
+    """Пропустить обновления через update_queue, как их кладёт Updater или webhook"""
+    application.add_handler(TypeHandler(Update, handler))
+    await application.initialize()
+    await application.start()
+    try:
+        for data in updates:
+            await application.update_queue.put(Update.de_json(data, application.bot))
+        await asyncio.wait_for(application.update_queue.join(), 30)
+    finally:
+        await application.stop()
+        await application.shutdown()
+
+
+def test_stress_keeps_per_user_order(offline_request):
+    users, per_user, max_concurrent = 50, 20, 8
+    rng = random.Random(1)
+    updates = [make_update(i * users + u + 1, 1000 + u, text=str(i))
+               for i in range(per_user) for u in range(users)]
+    delays = {data['update_id']: rng.uniform(0.001, 0.005) for data in updates}
+    seen = defaultdict(list)
+    active = {'now': 0, 'max': 0, 'per_user': defaultdict(int)}
+
+    async def handler(update, context):
+        user_id = update.effective_user.id
+        active['per_user'][user_id] += 1
+        assert active['per_user'][user_id] == 1, "два обновления одного пользователя одновременно"
+        active['now'] += 1
+        active['max'] = max(active['max'], active['now'])
+        await asyncio.sleep(delays[update.update_id])
+        seen[user_id].append(int(update.message.text))
+        active['now'] -= 1
+        active['per_user'][user_id] -= 1
+
+    application = build(offline_request, max_concurrent)
+    started = time.perf_counter()
+    asyncio.run(run_updates(application, updates, handler))
+    elapsed = time.perf_counter() - started
+
+    assert all(order == list(range(per_user)) for order in seen.values())
+    assert len(seen) == users
+    assert active['max'] <= max_concurrent
+    assert application.dispatch_metrics['processed'] == users * per_user
+    # Последовательно — сумма задержек (~3 с); параллельная обработка занимает ~0.8 с
+    # вместе с накладными расходами PTB, запас — на загруженную машину
+    assert elapsed < sum(delays.values()) / 2
+
+
+def test_busy_user_backlog_does_not_block_others(offline_request):
+    """Обновления, ждущие своего пользователя, не занимают слоты обработки"""
+    backlog = 200
+    updates = [make_update(i + 1, 1, text=str(i)) for i in range(backlog)]
+    updates.append(make_update(backlog + 1, 2))
+    finished = {}
+
+    async def handler(update, context):
+        await asyncio.sleep(0.005)
+        finished[update.update_id] = time.perf_counter()
+
+    started = time.perf_counter()
+    asyncio.run(run_updates(build(offline_request, max_concurrent=4), updates, handler))
+
+    # Второй пользователь обработан сразу, а не после очереди первого (~1 с)
+    assert finished[backlog + 1] - started < 0.25
+    assert max(finished.values()) - started > 0.9
+
+
+def test_backlog_over_pending_limit_delays_others(offline_request):
+    """Граница PENDING_LIMIT: сверх неё очередь одного пользователя задерживает остальных"""
+    pending_limit, backlog = 10, 40
+    updates = [make_update(i + 1, 1) for i in range(backlog)]
+    updates.append(make_update(backlog + 1, 2))
+    finished = []
+
+    async def handler(update, context):
+        await asyncio.sleep(0.005)
+        finished.append(update.effective_user.id)
+
+    asyncio.run(run_updates(build(offline_request, 4, pending_limit), updates, handler))
+
+    # Второй пользователь дождался, пока у первого в обработке не останется меньше pending_limit
+    assert finished.index(2) >= backlog - pending_limit
@@ -0,0 +1,19 @@
+from datetime import date
+
+from leaderboard import Leaderboards
+
+
+def test_boards_are_rebuilt_from_database(bot_db):
+    from points import points_ledger
+
+    today = date.today()
+    for user_id, points in ((1, 30), (2, 50), (3, 10)):
+        bot_db.add_user(user_id, f'user{user_id}')
+        points_ledger.add(user_id, points, day=today)
+    points_ledger.flush()
+    # Процесс упал без сохранения: новая таблица знает только то, что в базе
+    boards = Leaderboards(bot_db)
+    boards.load(today)
+    assert boards.total.top(3) == [(1, 2, 50), (2, 1, 30), (3, 3, 10)]
+    assert boards.weekly_board(today).scores() == {1: 30, 2: 50, 3: 10}
+    assert boards.total.rank(1) == 2
@@ -0,0 +1,104 @@
+import sqlite3
+
+import pytest
+
+import database
+import leaderboard
+import points
+import spaced_repetition
+import study_modes
+from database import Database
+from migrations import SCHEMA_VERSION, get_version, migrate
+
+# Частые запросы, индексы, которыми они должны обслуживаться, и допустимые обходы таблиц.
+# SCAN CONSTANT ROW — SELECT без FROM вокруг подзапросов, а не обход таблицы
+HOT_QUERIES = [
+    (database.DECK_CARDS_SQL, (1,), {'idx_cards_deck'}, set()),
+    (database.USER_DECKS_SQL, (1,), {'idx_decks_user'}, set()),
+    (spaced_repetition.DUE_PAGE_SQL, (1, 1, 0, -1, -1, 20), {'idx_progress_deck_due'}, set()),
+    (spaced_repetition.DUE_COUNT_SQL, (1, 1, 0), {'idx_progress_deck_due'}, set()),
+    (database.DELETE_CARD_PROGRESS_SQL, (1,), {'idx_progress_card'}, set()),
+    (database.DECK_OVERVIEW_SQL.format(deck_filter=''), (0, 1, 1), {'idx_decks_user', 'idx_cards_deck'}, set()),
+    (database.DECK_OVERVIEW_SQL.format(deck_filter='AND d.deck_id = ?'), (0, 1, 1, 1),
+     {'idx_cards_deck'}, set()),
+    (study_modes.WEIGHTED_CARDS_SQL, (1, 1, 0, 4, 20), {'idx_cards_deck'}, set()),
+    (points.POINTS_SINCE_SQL, (1, '2026-01-01', 1, '2026-01-01'), {'idx_points_ledger_user_day'},
+     {'SCAN CONSTANT ROW'}),
+    # Журнал хранит только последние KEEP_DAYS и читается целиком
+    (leaderboard.WEEK_SCORES_SQL, ('2026-01-01', '2026-01-01'), {'idx_points_daily_day'},
+     {'SCAN points_ledger', 'SCAN (subquery-2)'}),
+]
+
+
+@pytest.fixture
+def db(workdir):
+    database = Database(str(workdir / 'migrations.db'), shards=1)
+    database.init_db()
+    yield database
+    database.close()
+
+
+def plan(db: Database, sql: str, params) -> list:
+    with db.connection() as conn:
+        return [row['detail'] for row in conn.execute('EXPLAIN QUERY PLAN ' + sql, params)]
+
+
+def test_fresh_database_reaches_latest_version(db):
+    with db.connection() as conn:
+        assert get_version(conn) == SCHEMA_VERSION
+    # Повторный запуск ничего не меняет
+    assert migrate(db.common) == SCHEMA_VERSION
+
+
+def test_upgrade_from_first_version(workdir):
+    database = Database(str(workdir / 'old.db'), shards=1)
+    assert migrate(database.common, target=1) == 1
+    with database.transaction() as conn:
+        conn.execute("INSERT INTO decks (user_id, name) VALUES (1, 'd')")
+        conn.execute("INSERT INTO cards (deck_id, question, answer) VALUES (1, 'q', 'a')")
+        conn.execute("INSERT INTO card_progress (user_id, card_id, next_review) VALUES (1, 1, '2020-01-01 00:00:00')")
+        # До уникального индекса дубликаты learning_stats были возможны
+        conn.executemany(
+            'INSERT INTO learning_stats (user_id, deck_id, cards_studied, correct_answers, total_attempts) '
+            'VALUES (1, 1, ?, ?, ?)', [(2, 1, 3), (5, 4, 6)]
+        )
+    assert migrate(database.common) == SCHEMA_VERSION
+    with database.connection() as conn:
+        stats = conn.execute('SELECT cards_studied, correct_answers, total_attempts FROM learning_stats').fetchall()
+        progress = conn.execute('SELECT deck_id, next_review FROM card_progress').fetchone()
+    assert [tuple(row) for row in stats] == [(7, 5, 9)]
+    assert tuple(progress) == (1, 1577836800)
+    database.close()
+
+
+@pytest.mark.parametrize('sql, params, indexes, scans', HOT_QUERIES,
+                         ids=[' '.join(sql.split())[:60] for sql, _, _, _ in HOT_QUERIES])
+def test_hot_queries_use_indexes(db, sql, params, indexes, scans):
+    details = plan(db, sql, params)
+    used = ' '.join(details)
+    for index in indexes:
+        assert index in used, details
+    assert not [detail for detail in details if detail.startswith('SCAN') and detail not in scans], details
+
+
+def test_due_page_reads_in_index_order(db):
+    """Очередь повторения листается по индексу, без сортировки всех просроченных карточек"""
+    assert not [detail for detail in plan(db, spaced_repetition.DUE_PAGE_SQL, (1, 1, 0, -1, -1, 20))
+                if 'TEMP B-TREE' in detail]
+
+
+def test_study_stats_upsert_has_unique_index(db):
+    """ON CONFLICT в record_study_session компилируется только при уникальном индексе (user_id, deck_id)"""
+    def compile_upsert(conn):
+        # EXPLAIN без QUERY PLAN компилирует запрос целиком, включая разбор ON CONFLICT
+        conn.execute('EXPLAIN ' + database.RECORD_STUDY_SQL, (1, 1, 1, 1, None)).fetchall()
+
+    # Без кэша выражений: после DROP INDEX запрос должен компилироваться заново
+    conn = sqlite3.connect(db.common.path, isolation_level=None, cached_statements=0)
+    try:
+        compile_upsert(conn)
+        conn.execute('DROP INDEX idx_learning_stats_user_deck')
+        with pytest.raises(sqlite3.OperationalError):
+            compile_upsert(conn)
+    finally:
+        conn.close()
@@ -0,0 +1,37 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip('telegram')
+
+from telegram.ext import Application
+
+from async_database import AsyncDatabase
+from conftest import BOT_TOKEN
+from persistence import SQLitePersistence
+
+
+def test_idle_users_leave_application_and_reload(bot_db):
+    adb = AsyncDatabase(bot_db)
+    persistence = SQLitePersistence(adb, idle_timeout=0)
+    application = Application.builder().token(BOT_TOKEN).persistence(persistence).build()
+    persistence.attach(application)
+
+    async def main():
+        # Как при апдейте: Application создаёт словарь, persistence его заполняет
+        user_data = application.user_data[7]
+        await persistence.refresh_user_data(7, user_data)
+        user_data['deck'] = 3
+        await persistence.update_user_data(7, {'deck': 3})
+        await persistence.flush()
+        forgotten = 7 not in application.user_data
+        reloaded = application.user_data[7]
+        await persistence.refresh_user_data(7, reloaded)
+        return forgotten, reloaded
+
+    try:
+        forgotten, reloaded = asyncio.run(main())
+    finally:
+        adb.shutdown()
+    assert forgotten
+    assert reloaded == {'deck': 3}
@@ -0,0 +1,226 @@
+import asyncio
+import json
+import time
+from urllib.parse import parse_qsl
+
+import pytest
+
+pytest.importorskip('telegram')
+
+from telegram.error import RetryAfter
+from telegram.ext import ExtBot
+from telegram.request import HTTPXRequest
+
+import send_queue
+from conftest import BOT_TOKEN
+from send_queue import BROADCAST, SendQueue
+
+
+class FakeBotAPI:
+    """Локальный HTTP-сервер Bot API: записывает отправленное и по заказу отвечает 429"""
+
+    def __init__(self):
+        self.sent = []  # (время, endpoint, chat_id, текст)
+        self.flood = {}  # chat_id -> сколько раз ответить 429
+        self.retry_after = 1
+        self.server = None
+
+    async def start(self) -> str:
+        self.server = await asyncio.start_server(self._serve, '127.0.0.1', 0)
+        port = self.server.sockets[0].getsockname()[1]
+        return f'http://127.0.0.1:{port}/bot'
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            # Соединение держится открытым: httpx шлёт по нему запрос за запросом
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = {}
+                while (line := await reader.readline()) not in (b'\r\n', b''):
+                    name, _, value = line.decode().partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+                endpoint = request_line.split()[1].decode().rsplit('/', 1)[-1]
+                status, payload = self._answer(endpoint, dict(parse_qsl(body.decode())))
+                data = json.dumps(payload).encode()
+                writer.write(f'HTTP/1.1 {status} X\r\nContent-Type: application/json\r\n'
+                             f'Content-Length: {len(data)}\r\n\r\n'.encode() + data)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    def _answer(self, endpoint: str, params: dict):
+        if endpoint == 'getMe':
+            return 200, {'ok': True, 'result': {'id': 1, 'is_bot': True, 'first_name': 'bot', 'username': 'bot'}}
+        chat_id = int(params['chat_id']) if 'chat_id' in params else None
+        if self.flood.get(chat_id):
+            self.flood[chat_id] -= 1
+            return 429, {'ok': False, 'error_code': 429, 'description': 'Too Many Requests',
+                         'parameters': {'retry_after': self.retry_after}}
+        text = params.get('text') or params.get('callback_query_id')
+        self.sent.append((time.monotonic(), endpoint, chat_id, text))
+        if endpoint == 'answerCallbackQuery':
+            return 200, {'ok': True, 'result': True}
+        message = {'message_id': int(params.get('message_id', len(self.sent))), 'date': 0, 'text': text,
+                   'chat': {'id': chat_id, 'type': 'private'}}
+        return 200, {'ok': True, 'result': message}
+
+    def times(self, chat_id=None):
+        return [at for at, _, chat, _ in self.sent if chat_id is None or chat == chat_id]
+
+
+def run(scenario, **kwargs):
+    """Настоящий бот с SendQueue, направленный на локальный FakeBotAPI"""
+    async def main():
+        api = FakeBotAPI()
+        queue = SendQueue(**kwargs)
+        bot = ExtBot(BOT_TOKEN, base_url=await api.start(), rate_limiter=queue,
+                     request=HTTPXRequest(connection_pool_size=64))
+        await bot.initialize()
+        try:
+            return await scenario(bot, api, queue)
+        finally:
+            await bot.shutdown()
+            await api.stop()
+    return asyncio.run(main())
+
+
+def send(bot: ExtBot, chat_id: int, text: str, priority: int = None):
+    return bot.send_message(chat_id, text, rate_limit_args={'priority': priority} if priority is not None else None)
+
+
+def edit(bot: ExtBot, chat_id: int, message_id: int, text: str):
+    return bot.edit_message_text(text, chat_id=chat_id, message_id=message_id)
+
+
+@pytest.fixture(autouse=True)
+def fast_chat_limits(monkeypatch):
+    # Те же пропорции, что у лимитов Telegram, но в 10 раз быстрее
+    monkeypatch.setattr(send_queue, 'PRIVATE_CHAT_RATE', 10.0)
+    monkeypatch.setattr(send_queue, 'PRIVATE_CHAT_BURST', 3)
+    monkeypatch.setattr(send_queue, 'EDIT_CHAT_RATE', 50.0)
+    monkeypatch.setattr(send_queue, 'EDIT_CHAT_BURST', 5)
+
+
+def test_per_chat_limit_keeps_other_chats_moving():
+    async def scenario(bot, api, queue):
+        start = time.monotonic()
+        await asyncio.gather(*(send(bot, 1, str(i)) for i in range(8)), send(bot, 2, 'other'))
+        return start, api
+
+    start, api = run(scenario)
+    busy = api.times(1)
+    # Сначала запас ведра, дальше не чаще 10 в секунду. Время — по приходу на
+    # сервер, поэтому границы с запасом на установку соединений
+    assert busy[2] - start < 0.15
+    assert busy[-1] - start >= (8 - 3) / 10 - 0.02
+    assert busy[-1] - busy[2] >= (8 - 3) / 10 - 0.1
+    assert api.times(2)[0] - start < 0.15
+    assert [text for _, _, chat, text in api.sent if chat == 1] == [str(i) for i in range(8)]
+
+
+def test_global_limit():
+    async def scenario(bot, api, queue):
+        start = time.monotonic()
+        await asyncio.gather(*(send(bot, chat, 'x') for chat in range(1, 31)))
+        return start, api
+
+    start, api = run(scenario, global_rate=20)
+    times = sorted(api.times())
+    assert len(times) == 30
+    # 20 сразу из полного ведра, остальные 10 — по 20 в секунду
+    assert times[19] - start < 0.25
+    assert times[-1] - start >= 10 / 20 - 0.02
+
+
+def test_retry_after_pauses_chat_and_retries():
+    async def scenario(bot, api, queue):
+        api.flood[1] = 1
+        start = time.monotonic()
+        result, other = await asyncio.gather(send(bot, 1, 'hi'), send(bot, 2, 'other'))
+        return start, result, other, api, queue
+
+    start, result, other, api, queue = run(scenario)
+    assert result.text == 'hi' and other.text == 'other'
+    assert api.times(1)[0] - start >= 1.0
+    # 429 в одном чате не задерживает остальные
+    assert api.times(2)[0] - start < 0.25
+    assert queue.metrics['retried'] == 1 and queue.metrics['failed'] == 0
+
+
+def test_retry_after_gives_up_after_max_retries():
+    async def scenario(bot, api, queue):
+        api.flood[1] = 10
+        with pytest.raises(RetryAfter):
+            await send(bot, 1, 'hi')
+        return queue
+
+    queue = run(scenario, max_retries=1)
+    assert queue.metrics['retried'] == 1 and queue.metrics['failed'] == 1
+
+
+def test_queued_edits_of_one_message_collapse():
+    async def scenario(bot, api, queue):
+        # Запас ведра правок израсходован — следующие правки ждут в очереди
+        await asyncio.gather(*(edit(bot, 1, 100 + i, 'warm') for i in range(5)))
+        edits = [asyncio.ensure_future(edit(bot, 1, 7, f'edit {i}')) for i in range(5)]
+        other = asyncio.ensure_future(edit(bot, 1, 8, 'another'))
+        return await asyncio.gather(*edits), await other, api, queue
+
+    results, other, api, queue = run(scenario)
+    edits = [text for _, endpoint, _, text in api.sent if endpoint == 'editMessageText' and text != 'warm']
+    assert edits == ['edit 4', 'another']
+    assert [message.text for message in results] == ['edit 4'] * 5 and other.text == 'another'
+    assert queue.metrics['collapsed'] == 4
+
+
+def test_edits_do_not_wait_for_queued_messages():
+    async def scenario(bot, api, queue):
+        # Запас ведра отправки израсходован, новые сообщения чата стоят в очереди
+        await asyncio.gather(*(send(bot, 1, f'm{i}') for i in range(3)))
+        queued = [asyncio.ensure_future(send(bot, 1, f'q{i}')) for i in range(3)]
+        start = time.monotonic()
+        await edit(bot, 1, 1, 'flip')
+        flipped = time.monotonic() - start
+        await asyncio.gather(*queued)
+        return flipped, api
+
+    flipped, api = run(scenario)
+    # Без своего ведра правка ждала бы три сообщения по 0,1 с
+    assert flipped < 0.2
+    order = [text for _, _, _, text in api.sent]
+    assert order.index('flip') < order.index('q0')
+
+
+def test_interactive_requests_overtake_broadcast():
+    async def scenario(bot, api, queue):
+        broadcast = [asyncio.ensure_future(send(bot, 1, f'b{i}', priority=BROADCAST)) for i in range(5)]
+        await asyncio.sleep(0.01)
+        await send(bot, 1, 'reply')
+        await asyncio.gather(*broadcast)
+        return api
+
+    api = run(scenario)
+    order = [text for _, _, _, text in api.sent]
+    # Ведро чата отдало запас первым рассылкам, дальше ответ пользователю идёт вне очереди
+    assert order.index('reply') <= 3
+    assert [text for text in order if text != 'reply'] == [f'b{i}' for i in range(5)]
+
+
+def test_unlimited_endpoints_bypass_queue():
+    async def scenario(bot, api, queue):
+        # getMe при инициализации бота тоже идёт мимо очереди
+        before = queue.metrics['unlimited']
+        await asyncio.gather(*(bot.answer_callback_query(str(i)) for i in range(10)))
+        return queue.metrics['unlimited'] - before, queue
+
+    unlimited, queue = run(scenario)
+    assert unlimited == 10 and queue.metrics['sent'] == 0
@@ -0,0 +1,20 @@
+from database import Database
+
+
+def test_split_keeps_applied_answer_seq_in_every_shard(workdir):
+    single = Database(str(workdir / 'bot.db'), shards=1)
+    single.init_db()
+    for user_id in range(1, 6):
+        single.add_user(user_id, f'user{user_id}')
+    with single.transaction() as conn:
+        conn.execute('INSERT INTO answer_queue_state (id, last_seq) VALUES (1, 42)')
+
+    sharded = Database(str(workdir / 'bot.db'), shards=3)
+    report = sharded.split_into_shards(str(workdir / 'bot.db'))
+    # Иначе шарды начали бы с last_seq 0 и повторили уже применённые события журнала
+    assert [counts['answer_queue_state'] for counts in report] == [1, 1, 1]
+    for pool in sharded.pools:
+        with pool.connection() as conn:
+            assert conn.execute('SELECT last_seq FROM answer_queue_state').fetchone()[0] == 42
+    assert sum(counts['users'] for counts in report) == 5
+    sharded.close()
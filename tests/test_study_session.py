@@ -0,0 +1,101 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip('telegram')
+
+from telegram import Bot, Update
+
+from conftest import BOT_TOKEN
+
+USER_ID = 42
+
+
+def callback_update(bot, update_id: int, data: str) -> Update:
+    return Update.de_json({'update_id': update_id, 'callback_query': {
+        'id': str(update_id), 'chat_instance': 'ci', 'data': data,
+        'from': {'id': USER_ID, 'is_bot': False, 'first_name': 'u'},
+        'message': {'message_id': 1, 'date': 0, 'text': 'x', 'chat': {'id': USER_ID, 'type': 'private'}},
+    }}, bot)
+
+
+def message_update(bot, update_id: int, text: str) -> Update:
+    return Update.de_json({'update_id': update_id, 'message': {
+        'message_id': update_id, 'date': 0, 'text': text,
+        'chat': {'id': USER_ID, 'type': 'private'},
+        'from': {'id': USER_ID, 'is_bot': False, 'first_name': 'u'},
+    }}, bot)
+
+
+@pytest.fixture
+def deck(bot_db):
+    bot_db.add_user(USER_ID, 'u')
+    deck_id = bot_db.create_deck(USER_ID, 'deck')
+    for i in range(3):
+        bot_db.add_card(deck_id, f'question {i}', f'answer {i}')
+    return deck_id
+
+
+def run_session(offline_request, scenario):
+    import handlers
+
+    async def main():
+        bot = Bot(BOT_TOKEN, request=offline_request)
+        await bot.initialize()
+        context = SimpleNamespace(user_data={})
+        try:
+            return await scenario(handlers, bot, context)
+        finally:
+            await handlers.answer_queue.stop()
+
+    return asyncio.run(main())
+
+
+def edits(offline_request):
+    return [params['text'] for endpoint, params in offline_request.calls if endpoint == 'editMessageText']
+
+
+def test_deleted_cards_are_skipped_and_session_ends(bot_db, deck, offline_request):
+    async def scenario(handlers, bot, context):
+        state = await handlers.start_flashcard_mode(callback_update(bot, 1, f'study_flash_{deck}'), context, deck)
+        assert state == handlers.STUDY_FLASHCARD
+        session = context.user_data['study_session']
+        _, second, third = session.card_ids
+        # Следующую карточку удалили, пока пользователь смотрел на первую
+        bot_db.delete_card(second)
+        state = await handlers.handle_rate_card(callback_update(bot, 2, 'rate_good'), context, 'good')
+        assert state == handlers.STUDY_FLASHCARD
+        assert session.card_id == third
+        shown = edits(offline_request)[-1]
+        # Показываемую карточку удалили до оценки — сессия заканчивается
+        bot_db.delete_card(third)
+        state = await handlers.handle_rate_card(callback_update(bot, 3, 'rate_good'), context, 'good')
+        return state, session, shown, context
+
+    state, session, shown, context = run_session(offline_request, scenario)
+    import handlers
+    assert state == handlers.MAIN_MENU
+    assert 'study_session' not in context.user_data
+    assert (session.correct, session.wrong) == (1, 0)
+    assert 'Карточка 3/3' in shown
+    assert 'Сессия завершена' in edits(offline_request)[-1]
+
+
+def test_write_answer_to_deleted_card(bot_db, deck, offline_request):
+    async def scenario(handlers, bot, context):
+        await handlers.start_write_mode(callback_update(bot, 1, f'study_write_{deck}'), context, deck)
+        session = context.user_data['study_session']
+        bot_db.delete_card(session.card_id)
+        state = await handlers.check_write_answer(message_update(bot, 2, 'answer'), context)
+        hint = await handlers.handle_show_hint(callback_update(bot, 3, 'show_hint'), context)
+        state_next = await handlers.handle_next_card(callback_update(bot, 4, 'next_card'), context)
+        return state, hint, state_next, session
+
+    state, hint, state_next, session = run_session(offline_request, scenario)
+    import handlers
+    assert state == hint == state_next == handlers.STUDY_WRITE
+    assert session.number == 2 and session.wrong == 0
+    sent = [params['text'] for endpoint, params in offline_request.calls if endpoint == 'sendMessage']
+    assert 'удалили' in sent[-1]
+    assert 'Письменный режим 2/3' in edits(offline_request)[-1]
@@ -0,0 +1,22 @@
+import pytest
+
+pytest.importorskip('telegram')
+
+import views
+
+CARD = {'card_id': 1, 'deck_id': 1, 'question': 'cat', 'answer': 'кошка', 'updated_at': '2026-01-01'}
+
+
+def options_of(markup):
+    return [(button.text, button.callback_data) for row in markup.inline_keyboard[:-1] for button in row]
+
+
+def test_quiz_options_are_chosen_per_render():
+    renders = iter([['кошка', 'собака', 'дом', 'река'], ['река', 'дом', 'кошка', 'море']])
+    first_text, first_markup = views.quiz_question(CARD, 1, 5, lambda: next(renders))
+    second_text, second_markup = views.quiz_question(CARD, 1, 5, lambda: next(renders))
+    # Текст вопроса — из кэша, варианты и место правильного ответа — свои у каждого показа
+    assert second_text is first_text
+    assert options_of(first_markup)[0] == ('кошка', 'quiz_correct')
+    assert options_of(second_markup)[2] == ('кошка', 'quiz_correct')
+    assert ('море', 'quiz_wrong_3') in options_of(second_markup)
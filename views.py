@@ -0,0 +1,164 @@
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Callable, Dict, List, Tuple
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+from cache import TTLCache
+
+# Объекты telegram неизменяемы, поэтому статические клавиатуры — общие синглтоны
+
+MAIN_MENU_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("📚 Мои колоды", callback_data="my_decks"),
+     InlineKeyboardButton("➕ Создать колоду", callback_data="create_deck")],
+    [InlineKeyboardButton("📖 Общий словарь", callback_data="browse_dict"),
+     InlineKeyboardButton("📊 Статистика", callback_data="my_stats")],
+    [InlineKeyboardButton("⚙️ Настройки", callback_data="settings"),
+     InlineKeyboardButton("❓ Помощь", callback_data="help")]
+])
+
+STOP_STUDY_BUTTON = InlineKeyboardButton("⏹ Завершить", callback_data="stop_study")
+
+FLASHCARD_FRONT_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🔄 Показать ответ", callback_data="flip_card")],
+    [STOP_STUDY_BUTTON]
+])
+
+FLASHCARD_RATE_KEYBOARD = InlineKeyboardMarkup([
+    [
+        InlineKeyboardButton("😞 Снова", callback_data="rate_again"),
+        InlineKeyboardButton("😐 Трудно", callback_data="rate_hard"),
+        InlineKeyboardButton("🙂 Хорошо", callback_data="rate_good"),
+        InlineKeyboardButton("😄 Легко", callback_data="rate_easy")
+    ],
+    [STOP_STUDY_BUTTON]
+])
+
+WRITE_QUESTION_KEYBOARD = InlineKeyboardMarkup([[STOP_STUDY_BUTTON]])
+
+NEXT_CARD_KEYBOARD = InlineKeyboardMarkup([[InlineKeyboardButton("➡️ Далее", callback_data="next_card")]])
+
+RETRY_OR_NEXT_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🔄 Повторить", callback_data="retry_card"),
+     InlineKeyboardButton("➡️ Далее", callback_data="next_card")]
+])
+
+
+def _settings_keyboard(notif: str) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton(f"🔔 Уведомления: {notif}", callback_data="toggle_notifications")],
+        [InlineKeyboardButton("🎯 Сложность", callback_data="change_difficulty")],
+        [InlineKeyboardButton("➖ Меньше карточек", callback_data="cards_less"),
+         InlineKeyboardButton("➕ Больше карточек", callback_data="cards_more")],
+        [InlineKeyboardButton("⬅️ Назад", callback_data="main_menu")]
+    ])
+
+
+SETTINGS_KEYBOARDS = {True: _settings_keyboard("✅ Вкл"), False: _settings_keyboard("❌ Выкл")}
+
+
+def settings_keyboard(notifications: bool) -> InlineKeyboardMarkup:
+    return SETTINGS_KEYBOARDS[bool(notifications)]
+
+
+# ===== КАРТОЧКИ =====
+
+# Готовые (text, reply_markup) или текст; ключ включает updated_at — правка карточки даёт новую запись
+_renders = TTLCache.shared('views:cards', maxsize=20000, ttl=900)
+_metrics: Dict[str, List[float]] = defaultdict(lambda: [0, 0, 0.0])  # view -> [попадания, сборки, секунды]
+_metrics_lock = threading.Lock()
+
+
+def _cached(view: str, card: Dict, args: tuple, build: Callable[[], Any]) -> Any:
+    key = (view, card['card_id'], card.get('updated_at')) + args
+    rendered = _renders.get(key)
+    if rendered is not None:
+        with _metrics_lock:
+            _metrics[view][0] += 1
+        return rendered
+    started = time.perf_counter()
+    rendered = build()
+    elapsed = time.perf_counter() - started
+    _renders.set(key, rendered)
+    with _metrics_lock:
+        _metrics[view][1] += 1
+        _metrics[view][2] += elapsed
+    return rendered
+
+
+def flashcard(card: Dict, number: int, total: int, flipped: bool) -> Tuple[str, InlineKeyboardMarkup]:
+    def build():
+        if flipped:
+            text = (
+                f"🎴 *Карточка {number}/{total}*\n\n"
+                f"❓ {card['question']}\n\n"
+                f"✅ *Ответ:* {card['answer']}\n\n"
+                f"*Оцените, как вы знали:*"
+            )
+            return text, FLASHCARD_RATE_KEYBOARD
+        text = (
+            f"🎴 *Карточка {number}/{total}*\n\n"
+            f"❓ *{card['question']}*\n\n"
+            f"Подумайте и переверните карточку"
+        )
+        return text, FLASHCARD_FRONT_KEYBOARD
+    return _cached('flashcard', card, (number, total, flipped), build)
+
+
+def write_question(card: Dict, number: int, total: int) -> Tuple[str, InlineKeyboardMarkup]:
+    def build():
+        text = (
+            f"✍️ *Письменный режим {number}/{total}*\n\n"
+            f"❓ *{card['question']}*\n\n"
+            f"Напишите ответ:"
+        )
+        return text, WRITE_QUESTION_KEYBOARD
+    return _cached('write', card, (number, total), build)
+
+
+def quiz_text(card: Dict, number: int, total: int) -> str:
+    def build():
+        return (
+            f"🎯 *Тест {number}/{total}*\n\n"
+            f"❓ *{card['question']}*\n\n"
+            f"Выберите правильный ответ:"
+        )
+    return _cached('quiz', card, (number, total), build)
+
+
+def quiz_question(card: Dict, number: int, total: int,
+                  make_options: Callable[[], List[str]]) -> Tuple[str, InlineKeyboardMarkup]:
+    """Вопрос теста: текст из кэша, варианты и их порядок — заново при каждом показе.
+
+    Кэшированные варианты показывали бы всем пользователям и при каждой
+    попытке правильный ответ на одном месте, а дистракторы устаревали бы
+    при правке других карточек колоды.
+    """
+    keyboard = []
+    row = []
+    for i, option in enumerate(make_options()):
+        callback = "quiz_correct" if option == card['answer'] else f"quiz_wrong_{i}"
+        # Truncate long options for button text
+        btn_text = option[:30] + "…" if len(option) > 30 else option
+        row.append(InlineKeyboardButton(btn_text, callback_data=callback))
+        if len(row) == 2:
+            keyboard.append(row)
+            row = []
+    if row:
+        keyboard.append(row)
+    keyboard.append([STOP_STUDY_BUTTON])
+    return quiz_text(card, number, total), InlineKeyboardMarkup(keyboard)
+
+
+def render_stats() -> Dict[str, Dict]:
+    """Метрики по видам: попадания в кэш, сборки и среднее время сборки"""
+    with _metrics_lock:
+        return {
+            view: {
+                'hits': hits,
+                'renders': renders,
+                'avg_ms': round(seconds / renders * 1000, 3) if renders else 0.0,
+            }
+            for view, (hits, renders, seconds) in _metrics.items()
+        }
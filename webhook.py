@@ -0,0 +1,243 @@
+import asyncio
+import hmac
+import json
+import logging
+import os
+import secrets
+import signal
+import time
+from typing import Optional
+from telegram import Update
+from telegram.ext import Application
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = 'x-telegram-bot-api-secret-token'
+MAX_BODY = 1 << 20  # обновления Telegram намного меньше мегабайта
+REQUEST_TIMEOUT = 30.0  # простой keep-alive соединения, секунды
+
+REASONS = {200: 'OK', 400: 'Bad Request', 403: 'Forbidden', 404: 'Not Found',
+           405: 'Method Not Allowed', 413: 'Payload Too Large', 503: 'Service Unavailable'}
+
+
+class WebhookSettings:
+    """Параметры режима webhook из переменных окружения"""
+
+    def __init__(self, url: str, secret: str, listen: str = '0.0.0.0', port: int = 8080,
+                 path: str = '/telegram', max_connections: int = 40, drop_pending_updates: bool = False):
+        self.url = url.rstrip('/')
+        self.secret = secret
+        self.listen = listen
+        self.port = port
+        self.path = path
+        self.max_connections = max_connections
+        # True — отбросить обновления, накопившиеся у Telegram, пока бот был остановлен
+        self.drop_pending_updates = drop_pending_updates
+
+    @classmethod
+    def from_env(cls) -> 'WebhookSettings':
+        url = os.getenv('WEBHOOK_URL')
+        if not url:
+            raise ValueError("Для BOT_MODE=webhook нужен WEBHOOK_URL — публичный адрес бота")
+        secret = os.getenv('WEBHOOK_SECRET')
+        if not secret:
+            # У каждого экземпляра был бы свой секрет — при нескольких экземплярах задайте общий
+            secret = secrets.token_urlsafe(32)
+            logger.warning("WEBHOOK_SECRET не задан, используется случайный")
+        return cls(
+            url=url, secret=secret,
+            listen=os.getenv('WEBHOOK_LISTEN', '0.0.0.0'),
+            port=int(os.getenv('PORT', '8080')),
+            path=os.getenv('WEBHOOK_PATH', '/telegram'),
+            max_connections=int(os.getenv('WEBHOOK_MAX_CONNECTIONS', '40')),
+            drop_pending_updates=os.getenv('WEBHOOK_DROP_PENDING', '').lower() in ('1', 'true', 'yes'),
+        )
+
+
+class WebhookServer:
+    """Минимальный HTTP/1.1 сервер на asyncio для приёма обновлений Telegram.
+
+    POST на path с верным секретом кладёт обновление в update_queue
+    приложения и сразу отвечает 200; /healthz отвечает, пока процесс жив,
+    /readyz — только когда приложение обрабатывает обновления и сервер не
+    останавливается. stop() сначала снимает готовность и закрывает приём,
+    затем дожидается запросов, которые уже читаются.
+    """
+
+    def __init__(self, application: Application, path: str, secret: str):
+        self.application = application
+        self.path = path
+        self.secret = secret.encode()
+        self.ready = False
+        self.port: Optional[int] = None
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._inflight = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._connections = set()
+        self.metrics = {'received': 0, 'rejected': 0, 'invalid': 0, 'started': None}
+
+    async def start(self, host: str, port: int):
+        self._server = await asyncio.start_server(self._serve, host, port)
+        # При port=0 порт выбирает система
+        self.port = self._server.sockets[0].getsockname()[1]
+        self.metrics['started'] = time.monotonic()
+        logger.info(f"🌐 Webhook слушает {host}:{self.port}{self.path}")
+
+    async def stop(self, timeout: float = 10.0):
+        self.ready = False
+        if self._server is None:
+            return
+        self._server.close()
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Не дождались {self._inflight} запросов webhook")
+        # Остались только простаивающие keep-alive соединения
+        for task in list(self._connections):
+            task.cancel()
+        await asyncio.gather(*self._connections, return_exceptions=True)
+        await self._server.wait_closed()
+        self._server = None
+
+    def stats(self) -> dict:
+        stats = {key: value for key, value in self.metrics.items() if key != 'started'}
+        if self.metrics['started'] is not None:
+            elapsed = time.monotonic() - self.metrics['started']
+            stats['updates_per_sec'] = round(self.metrics['received'] / elapsed, 1) if elapsed else 0.0
+        return stats
+
+    # ===== HTTP =====
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        task = asyncio.current_task()
+        self._connections.add(task)
+        try:
+            while True:
+                try:
+                    request_line = await asyncio.wait_for(reader.readline(), REQUEST_TIMEOUT)
+                except asyncio.TimeoutError:
+                    break
+                if not request_line.strip():
+                    break
+                self._begin()
+                try:
+                    keep_alive = await self._handle(request_line, reader, writer)
+                finally:
+                    self._end()
+                if not keep_alive or self._server is None or not self._server.is_serving():
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError):
+            pass
+        except asyncio.CancelledError:
+            # Соединение закрывает stop(); задача завершается штатно
+            pass
+        finally:
+            self._connections.discard(task)
+            writer.close()
+
+    def _begin(self):
+        self._inflight += 1
+        self._idle.clear()
+
+    def _end(self):
+        self._inflight -= 1
+        if not self._inflight:
+            self._idle.set()
+
+    async def _handle(self, request_line: bytes, reader, writer) -> bool:
+        method, target, version = request_line.decode('latin-1').split(' ', 2)
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        keep_alive = headers.get('connection', '').lower() != 'close' and version.strip() == 'HTTP/1.1'
+
+        length = int(headers.get('content-length', '0'))
+        if length > MAX_BODY:
+            await self._respond(writer, 413, keep_alive=False)
+            return False
+        body = await reader.readexactly(length) if length else b''
+
+        path = target.split('?', 1)[0]
+        if path == '/healthz':
+            status = 200
+        elif path == '/readyz':
+            status = 200 if self.ready and self.application.running else 503
+        elif path != self.path:
+            status = 404
+        elif method != 'POST':
+            status = 405
+        elif not hmac.compare_digest(headers.get(SECRET_HEADER, '').encode(), self.secret):
+            self.metrics['rejected'] += 1
+            status = 403
+        else:
+            status = await self._accept_update(body)
+        await self._respond(writer, status, keep_alive)
+        return keep_alive
+
+    async def _accept_update(self, body: bytes) -> int:
+        if not self.application.running:
+            # Останавливаемся: Telegram повторит доставку позже
+            return 503
+        try:
+            update = Update.de_json(json.loads(body), self.application.bot)
+        except (ValueError, TypeError, KeyError):
+            self.metrics['invalid'] += 1
+            return 400
+        await self.application.update_queue.put(update)
+        self.metrics['received'] += 1
+        return 200
+
+    @staticmethod
+    async def _respond(writer, status: int, keep_alive: bool):
+        body = REASONS[status].encode()
+        writer.write(
+            f"HTTP/1.1 {status} {REASONS[status]}\r\n"
+            f"Content-Type: text/plain\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode() + body
+        )
+        await writer.drain()
+
+
+async def run_webhook(application: Application, settings: WebhookSettings):
+    """Запустить бота в режиме webhook до SIGINT/SIGTERM.
+
+    При остановке сервер перестаёт принимать обновления, а application.stop()
+    дожидается обработки уже полученных, после чего вызывается post_shutdown.
+    """
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    server = WebhookServer(application, settings.path, settings.secret)
+    await application.initialize()
+    try:
+        if application.post_init:
+            await application.post_init(application)
+        await server.start(settings.listen, settings.port)
+        await application.start()
+        await application.bot.set_webhook(
+            settings.url + settings.path,
+            secret_token=settings.secret,
+            allowed_updates=Update.ALL_TYPES,
+            drop_pending_updates=settings.drop_pending_updates,
+            max_connections=settings.max_connections,
+        )
+        server.ready = True
+        logger.info("🚀 Бот запущен (webhook)!")
+        await stop.wait()
+        logger.info("Остановка: дожидаемся обработки полученных обновлений")
+    finally:
+        await server.stop()
+        if application.running:
+            await application.stop()
+        await application.shutdown()
+        logger.info(f"🌐 Webhook: {server.stats()}")
+        if application.post_shutdown:
+            await application.post_shutdown(application)